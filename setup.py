@@ -10,6 +10,8 @@ setup(
     license='The Unlicense',
     packages=['ujlaser'],
     install_requires=['pyserial>=3.0'],
+    extras_require={'numpy': ['numpy']}, # zero-copy reads from ujlaser.telemetrystore
+    entry_points={'console_scripts': ['ujlaser = ujlaser.cli:main']},
     classifiers=['Programming Language :: Python :: 3',
                  'Programming Language :: Python :: 3.4',
                  'Programming Language :: Python :: 3.5'],
@@ -4,7 +4,7 @@ ujlaser
 A community-built library to control Quantum Composers MicroJewel Lasers.
 
 """
-__all__ = ["lasercontrol"]
+__all__ = ["lasercontrol", "asynclaser", "telemetry", "scheduler", "fleet", "framing", "metrics", "settings", "clock", "recording", "telemetrystore", "campaign", "cli", "daemon"]
 __version__ = "0.9"
 __author__ = "Tyler Sengia, Noah Chaffin, Miles Green"
 __credits__ = "Student Space Programs Laboratory"
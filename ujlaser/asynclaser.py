@@ -0,0 +1,575 @@
+import asyncio
+import collections
+import threading as thread
+import time
+
+from ujlaser.lasercontrol import _PARITIES, Laser, LaserCommandError, LaserFireError, LaserStatusResponse
+from ujlaser.metrics import LaserMetrics
+from ujlaser.settings import LIMIT_QUERIES, LIMITS, SETTINGS, changed_settings, commit_setting, parse_limits, setting_command, upload_values, validate_setting
+
+def _check_ok(response):
+    """Returns True if the response is the laser's OK acknowledgement, otherwise raises a LaserCommandError."""
+    if response == b"OK\r":
+        return True
+    raise LaserCommandError(Laser.get_error_code_description(response))
+
+def _check_query(response):
+    """Raises a LaserCommandError if a query was answered with an error code (or not at all). Returns the response without its terminator."""
+    if not response or response[:1] == b"?":
+        raise LaserCommandError(Laser.get_error_code_description(response))
+    return response[:-1] if response[-1:] == b"\r" else response
+
+
+class AsyncLaser:
+    """
+    An asyncio version of the Laser class. Every method that talks to the laser is a coroutine.
+
+    Responses are framed inside the event loop as the serial port becomes readable, so any number of coroutines may have commands
+    outstanding at once and nothing ever blocks the loop. Replies are matched to commands in the order the commands were written.
+    When a reply doesn't arrive in time the link is resynchronised with an ID? before anything else is sent, so a late reply is
+    never taken for the reply to a later command.
+
+    Settings are checked by the same rules and against the same device limits as Laser, and only the settings that differ from the
+    last values the laser confirmed are uploaded (see ujlaser.settings).
+    """
+    # Constants for Energy Mode
+    MANUAL_ENERGY = Laser.MANUAL_ENERGY
+    LOW_ENERGY = Laser.LOW_ENERGY
+    HIGH_ENERGY = Laser.HIGH_ENERGY
+
+    # Constants for shot mode
+    CONTINUOUS = Laser.CONTINUOUS
+    SINGLE_SHOT = Laser.SINGLE_SHOT
+    BURST = Laser.BURST
+
+    SETTINGS = SETTINGS
+    LIMITS = LIMITS
+
+    def __init__(self, pulseMode = 0, pulsePeriod = 0, repRate = 1, burstCount = 10, diodeCurrent = .1, energyMode = 0, pulseWidth = 10, diodeTrigger = 0, metrics = False):
+        self._ser = None
+        self.pulseMode = pulseMode
+        self.pulsePeriod = pulsePeriod
+        self.repRate = repRate
+        self.burstCount = burstCount
+        self.diodeCurrent = diodeCurrent
+        self.energyMode = energyMode
+        self.pulseWidth = pulseWidth
+        self.diodeTrigger = diodeTrigger
+        self.burstDuration = burstCount/repRate
+        self._shadow = {} # last value of each setting the laser confirmed with OK, settings missing from it are unknown
+        self._limits = {} # (minimum, maximum) reported by the connected laser for each of AsyncLaser.LIMITS that has been read
+        self.metrics = LaserMetrics() if metrics else None # None when metrics are disabled, see get_metrics()
+
+        self.emergencyStopActive = False
+        self.connected = False
+        self.timeout = 1
+        self.fireTask = None
+        self.fireError = None # the exception that ended the last shot early, see wait_fire()
+        self._device_address = "LA"
+        self._loop = None
+        self._fd = None
+        self._poll_task = None
+        self._pending = collections.deque() # futures waiting for a response, in the order their commands were written
+        self._pending_event = None
+        self._rx_buffer = bytearray()
+        self._id_reply = None # the laser's reply to ID?, what a resynchronisation waits for
+        self._synced = None # asyncio.Event, cleared while the link is being resynchronised
+        self._sync = None # future completed by the reply to the resynchronising ID?, None while in sync
+        self._resync_task = None
+
+    async def connect(self, port_number, baud_rate=115200, timeout=1, parity=None, refresh=False):
+        """
+        Sets up a non-blocking connection between the computer and the laser
+
+        Parameters
+        ----------
+        port_number : str or serial-like object
+            The serial port the laser is on, or an already open serial object (such as FakeSerialLaser.Serial)
+
+        baud_rate : int
+            Bits per second on serial connection
+
+        timeout : int
+            Number of seconds to wait for a response before a command fails.
+
+        parity : str
+            None, 'none', 'even', 'odd', 'mark' or 'space'
+
+        refresh : bool
+            Reset every setting to its default and upload them, see laser_refresh()
+        """
+        if not baud_rate or not isinstance(baud_rate, int):
+            raise ValueError('Error: baud_rate parameter must be an integer')
+        if not timeout or not isinstance(timeout, (int, float)):
+            raise ValueError('Error: timeout parameter must be a number')
+        if parity not in _PARITIES:
+            raise ValueError("Error: parity must be None, \'none\', \'even\', \'odd\', \'mark\', \'space\'")
+
+        if isinstance(port_number, str):
+            import serial # only imported once a port is opened, see lasercontrol
+            # timeout=0 puts the port in non-blocking mode, reads only return what has already arrived
+            self._ser = serial.Serial(port=port_number, baudrate=baud_rate, parity=_PARITIES[parity], timeout=0)
+        else:
+            self._ser = port_number
+
+        self.timeout = timeout
+        self._loop = asyncio.get_running_loop()
+        self._pending_event = asyncio.Event()
+        self._synced = asyncio.Event()
+        self._synced.set()
+        self._rx_buffer.clear()
+        self._shadow.clear() # a newly connected laser's settings are unknown
+        self._limits = {}
+        self._id_reply = None
+
+        try:
+            self._fd = self._ser.fileno()
+        except (AttributeError, IOError, ValueError):
+            self._fd = None
+
+        if self._fd is not None:
+            self._loop.add_reader(self._fd, self._on_readable)
+        else: # Serial objects without a file descriptor are polled, but only while responses are outstanding
+            self._poll_task = self._loop.create_task(self._poll_port())
+        self.connected = True
+
+        try: # read the laser's limits once per connection, so the setters can check values without a round trip
+            await self.get_limits()
+        except (LaserCommandError, ValueError):
+            pass # an unresponsive or unusual laser is only checked against the fixed rules
+
+        if refresh:
+            await self.laser_refresh()
+
+    async def disconnect(self):
+        if not self.connected:
+            return
+        if self.fireTask is not None and not self.fireTask.done():
+            self.fireTask.cancel()
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._resync_task is not None:
+            self._resync_task.cancel()
+            self._resync_task = None
+        self.connected = False
+        for future in self._pending:
+            if not future.done():
+                future.set_exception(ConnectionError("Serial port was disconnected"))
+        self._pending.clear()
+        self._sync = None
+        self._synced.set() # commands waiting for a resynchronisation now fail as disconnected
+        self._ser.close()
+        self._ser = None
+        self._shadow.clear()
+        self._limits = {}
+
+    def _on_readable(self):
+        """Event loop callback for when the serial port's file descriptor becomes readable."""
+        data = self._ser.read(self._ser.in_waiting or 1)
+        if data:
+            self._feed(data)
+
+    async def _poll_port(self):
+        """Polls in_waiting for serial objects that cannot be watched by the event loop."""
+        while True:
+            if not self._pending and self._sync is None:
+                self._pending_event.clear()
+                await self._pending_event.wait()
+            waiting = self._ser.in_waiting
+            if waiting:
+                data = self._ser.read(waiting)
+                if data:
+                    self._feed(data)
+                    continue
+            await asyncio.sleep(0.0002)
+
+    def _feed(self, data):
+        """Adds received bytes to the receive buffer and hands every complete \\r terminated frame to the oldest outstanding command."""
+        buf = self._rx_buffer
+        buf += data
+        end = buf.find(b"\r")
+        while end != -1:
+            frame = bytes(buf[:end + 1])
+            del buf[:end + 1]
+            if self._sync is not None: # resynchronising, every frame before the reply to the ID? is late and has no command left
+                if frame == self._id_reply and not self._sync.done():
+                    self._sync.set_result(True)
+            elif self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result(frame)
+            end = buf.find(b"\r")
+
+    async def _send_command(self, cmd):
+        """
+        Sends command to laser
+
+        Parameters
+        ----------
+        cmd : string
+            This contains the ASCII of the command to be sent. Should not include the prefix, address, delimiter, or terminator
+
+        Returns
+        ----------
+        response : bytes
+            The binary response received by the laser. Includes the '\\r' terminator. None if no response arrived within the timeout.
+        """
+        if len(cmd) == 0:
+            return
+
+        if self.connected and not self._synced.is_set():
+            await self._synced.wait()
+        if not self.connected:
+            raise ConnectionError("Not connected to a serial port. Please call connect() before issuing any commands!")
+
+        future = self._loop.create_future()
+        self._pending.append(future)
+        self._pending_event.set()
+        data = self._frame(cmd)
+        self._ser.write(data)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.bytes_written += len(data)
+            sent = time.perf_counter()
+
+        try:
+            response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            response = None
+            self._desync()
+        if metrics is not None:
+            metrics.observe_reply(cmd, response, time.perf_counter() - sent)
+        return response
+
+    def _frame(self, cmd):
+        return (";" + self._device_address + ":" + cmd + "\r").encode("ascii")
+
+    def _desync(self):
+        """
+        Called when a reply didn't arrive in time. Replies are matched to commands by order, so its late reply would be taken for the
+        reply to the next command. Every command still waiting is answered with None instead, as if it had timed out too, and
+        nothing more is sent until _resync() has found where the replies stand.
+        """
+        if self._sync is not None or not self.connected:
+            return
+        for future in self._pending:
+            if not future.done():
+                future.set_result(None)
+        self._pending.clear()
+        self._synced.clear()
+        self._sync = self._loop.create_future()
+        self._pending_event.set()
+        self._resync_task = self._loop.create_task(self._resync())
+
+    async def _resync(self):
+        """Sends ID? and drops every frame up to its reply (for one timeout if the laser's ID isn't known), then lets commands through again."""
+        try:
+            self._rx_buffer.clear()
+            if self._id_reply is not None:
+                self._ser.write(self._frame("ID?"))
+            try:
+                await asyncio.wait_for(asyncio.shield(self._sync), self.timeout)
+            except asyncio.TimeoutError:
+                pass # anything late has had a whole timeout to arrive
+        finally:
+            self._sync = None
+            self._resync_task = None
+            self._synced.set()
+
+    async def _send_commands(self, cmds):
+        """Sends a batch of commands back to back without waiting between them. Returns the response for each command, in order."""
+        return await asyncio.gather(*(self._send_command(cmd) for cmd in cmds))
+
+    async def get_status(self):
+        """
+        Obtains the status of the laser
+
+        Returns
+        -------
+        status : LaserStatusResponse object
+                Returns a LaserStatusResponse object created from the SS? command's response that is received.
+        """
+        return LaserStatusResponse(_check_query(await self._send_command('SS?')))
+
+    async def is_armed(self):
+        """
+        Checks if the laser is armed
+
+        Returns
+        -------
+        armed : boolean
+            True if the laser is armed. False if the laser is not armed.
+        """
+        return _check_query(await self._send_command('EN?')) == b'1'
+
+    async def _get_float(self, cmd):
+        return float(_check_query(await self._send_command(cmd)))
+
+    async def get_fet_temp(self):
+        """Returns the float value of the FET temperature in Celsius."""
+        return await self._get_float('FT?')
+
+    async def get_resonator_temp(self):
+        """Returns the float value of the resonator temperature in Celsius."""
+        return await self._get_float('TR?')
+
+    async def get_fet_voltage(self):
+        """Returns the float value of the FET voltage."""
+        return await self._get_float('FV?')
+
+    async def get_diode_current(self):
+        """Returns the float value of the diode current."""
+        return await self._get_float('IM?')
+
+    async def get_bank_voltage(self):
+        """Returns the float value of the laser's bank voltage."""
+        return await self._get_float('BV?')
+
+    async def get_laser_ID(self):
+        """Returns a string containing the laser's ID information."""
+        return _check_query(await self._send_command('ID?')).decode('ascii')
+
+    async def get_latched_status(self):
+        """Returns a string containing the laser's latched status."""
+        return _check_query(await self._send_command('LS?')).decode('ascii')
+
+    async def get_system_shot_count(self):
+        """Returns the system shot count since factory build."""
+        return int(_check_query(await self._send_command('SC?')))
+
+    async def get_pulse_period_range(self):
+        """Returns the (minimum, maximum) periods for firing."""
+        return await self._get_limit("PE")
+
+    async def get_repetition_rate_range(self):
+        """Returns the (minimum, maximum) repetition rates for firing."""
+        return await self._get_limit("RR")
+
+    async def get_limits(self, refresh=False):
+        """
+        Returns the minimum and maximum the laser allows for each of AsyncLaser.LIMITS, see Laser.get_limits. The limits are read once
+        per connection, by connect(), in one batch after ID?.
+
+        Returns
+        -------
+        limits : dict
+            (minimum, maximum) keyed by command keyword. A bound the laser does not report (such as FT:MIN) is None.
+        """
+        if not refresh and all(key in self._limits for key in LIMITS):
+            return dict(self._limits)
+
+        responses = await self._send_commands(LIMIT_QUERIES)
+        response = responses[0]
+        if not response or response[:1] == b"?":
+            raise LaserCommandError("No response from the laser" if not response else Laser.get_error_code_description(response))
+        self._id_reply = response
+
+        limits = parse_limits(responses)
+        self._limits = dict(limits)
+        return limits
+
+    async def _get_limit(self, key):
+        """Returns the (minimum, maximum) of one of AsyncLaser.LIMITS, only asking the laser for it if it hasn't been read on this connection."""
+        if key in self._limits and None not in self._limits[key]:
+            return self._limits[key]
+        responses = await self._send_commands([key + ":MIN?", key + ":MAX?"])
+        limit = tuple(float(_check_query(r)) for r in responses)
+        self._limits[key] = limit
+        return limit
+
+    async def arm(self):
+        """Sends command to laser to arm. Returns True on nominal response, otherwise an error will be raised."""
+        if await self.is_armed():
+            raise LaserCommandError("Laser already armed")
+        return _check_ok(await self._send_command('EN 1'))
+
+    async def disarm(self):
+        """Sends command to laser to disarm. Returns True on nominal response, otherwise an error will be raised."""
+        return _check_ok(await self._send_command('EN 0'))
+
+    async def fire_laser(self):
+        """
+            Sends commands to laser to have it fire. The shot is timed by a background task (fireTask) so that other commands such as emergency_stop can still be awaited,
+            wait_fire() waits for it to end.
+        """
+        status = await self.get_status()
+
+        if not status.laser_enabled:
+            raise LaserCommandError("Laser not armed!")
+        if not status.ready_to_fire:
+            raise LaserCommandError("Laser not ready to fire!")
+        fire_response = await self._send_command('FL 1')
+
+        if fire_response != b"OK\r":
+            await self._send_command('FL 0') # aborts if laser fails to fire
+            raise LaserCommandError(Laser.get_error_code_description(fire_response))
+
+        status = await self.get_status()
+
+        if not status.laser_active:
+            await self._send_command('FL 0')
+            raise LaserCommandError('Laser Failed to Fire')
+
+        self.emergencyStopActive = False
+        self.fireError = None
+        self.fireTask = self._loop.create_task(self._fire_task())
+
+    async def wait_fire(self):
+        """Waits for the shot started by fire_laser() to end. Raises the LaserFireError that ended it early, if there was one."""
+        if self.fireTask is not None and not self.fireTask.done():
+            await asyncio.wait({self.fireTask})
+        if self.fireError is not None:
+            raise self.fireError
+
+    async def _fire_task(self):
+        """Handles time keeping for how long the laser takes to fire, then stops the laser."""
+        if self.pulseMode == self.CONTINUOUS:
+            duration = self.pulsePeriod
+        elif self.pulseMode == self.SINGLE_SHOT:
+            duration = 1 / self.repRate
+        else:
+            duration = self.burstDuration
+
+        try:
+            end = self._loop.time() + duration
+            while self._loop.time() < end and not self.emergencyStopActive:
+                status = await self.get_status()
+                if not status.laser_active:
+                    if not status.laser_enabled:
+                        raise LaserFireError("Laser has become disabled")
+                    break
+                await asyncio.sleep(min(.1, max(0, end - self._loop.time())))
+        except Exception as e:
+            self.fireError = e # nothing awaits this task, wait_fire() raises it instead
+        finally:
+            if not self.emergencyStopActive and self.connected:
+                await self._send_command('FL 0') # however the shot ended
+
+    async def emergency_stop(self):
+        """Immediately sends command to laser to stop firing. Returns True on nominal response, otherwise an error will be raised."""
+        self.emergencyStopActive = True
+        return _check_ok(await self._send_command('FL 0'))
+
+    async def _set_setting(self, name, value):
+        """Checks a value for one of AsyncLaser.SETTINGS, sends it and records it once the laser answers OK. Returns True."""
+        value = validate_setting(name, value, self._limits)
+        _check_ok(await self._send_command(setting_command(name, value)))
+        commit_setting(self, name, value)
+        return True
+
+    async def set_pulse_mode(self, mode):
+        """Sets the laser pulse mode. 0 = continuous, 1 = single shot, 2 = burst. Returns True on nominal response."""
+        return await self._set_setting("pulseMode", mode)
+
+    async def set_pulse_period(self, period):
+        """Sets the pulse period for firing. Returns True on nominal response."""
+        return await self._set_setting("pulsePeriod", period)
+
+    async def set_diode_trigger(self, trigger):
+        """Sets the diode trigger mode. 0 = Software/internal. 1 = Hardware/external trigger. Returns True on nominal response."""
+        return await self._set_setting("diodeTrigger", trigger)
+
+    async def set_pulse_width(self, width):
+        """Sets the diode pulse width. Width is in seconds, may be a float. Returns True on nominal response."""
+        return await self._set_setting("pulseWidth", width)
+
+    async def set_burst_count(self, count):
+        """Sets the burst count of the laser. Must be a positive non-zero integer. Returns True on nominal response."""
+        return await self._set_setting("burstCount", count)
+
+    async def set_rep_rate(self, rate):
+        """Sets the repetition rate of the laser. Rate must be a positive integer from 1 to 5 (# of Hz allowed). Returns True on nominal response."""
+        return await self._set_setting("repRate", rate)
+
+    async def set_diode_current(self, current):
+        """Sets the diode current of the laser, which switches it to manual energy mode. Returns True on nominal response."""
+        return await self._set_setting("diodeCurrent", current)
+
+    async def set_energy_mode(self, mode):
+        """Sets the energy mode of the laser. 0 = manual, 1 = low power, 2 = high power. Returns True on nominal response."""
+        return await self._set_setting("energyMode", mode)
+
+    async def update_settings(self):
+        """
+        Uploads the laser settings held by this object (every setting but the pulse period) at once. Only the settings that differ
+        from the last values the laser confirmed are sent. Returns the laser's response to each settings command, in the order they
+        were sent.
+        """
+        values = upload_values(self)
+        changed = changed_settings(values, self._shadow)
+        responses = await self._send_commands([setting_command(name, values[name]) for name in changed])
+        for name, response in zip(changed, responses):
+            if response == b"OK\r":
+                commit_setting(self, name, values[name])
+        return responses
+
+    async def editConstants(self, pulseMode = 0, pulsePeriod = 0, repRate = 1, burstCount = 10, diodeCurrent = .1, energyMode = 0, pulseWidth = 10, diodeTrigger = 0):
+        """Updates the laser settings held by this object and uploads them, see Laser.editConstants."""
+        self.pulseMode = pulseMode
+        self.pulsePeriod = pulsePeriod
+        self.repRate = repRate
+        self.burstCount = burstCount
+        self.diodeCurrent = diodeCurrent
+        self.energyMode = energyMode
+        self.pulseWidth = pulseWidth
+        self.diodeTrigger = diodeTrigger
+        self.burstDuration = burstCount/repRate
+        await self.update_settings()
+
+    async def laser_reset(self):
+        """Resets every laser setting to its default. Returns True on nominal response, otherwise an error will be raised."""
+        _check_ok(await self._send_command('RS'))
+        self._shadow.clear() # the laser is back to its own defaults, which may not match ours
+        await self.editConstants()
+        return True
+
+    async def laser_refresh(self):
+        """Resets the settings held by this object to their defaults and uploads them, as connect(refresh=True) does."""
+        await self.editConstants()
+        self._device_address = "LA"
+
+    def get_metrics(self):
+        """Returns a snapshot of the command latency, traffic and error metrics (see LaserMetrics.snapshot), None if created with metrics=False."""
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot()
+
+
+class SyncLaser:
+    """
+    A blocking facade over AsyncLaser for code that is not written with asyncio.
+
+    The AsyncLaser runs on a private event loop in a background thread. Every coroutine method of AsyncLaser can be called on this
+    object as a normal blocking method with the same name and arguments, and every other attribute is passed straight through.
+    """
+    def __init__(self, *args, **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = thread.Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
+        self.laser = AsyncLaser(*args, **kwargs)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def __getattr__(self, name):
+        if name == "laser": # not created yet, avoid recursing back into __getattr__
+            raise AttributeError(name)
+        attr = getattr(self.laser, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            return self._run(attr(*args, **kwargs))
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    def close(self):
+        """Disconnects from the laser and stops the background event loop."""
+        self._run(self.laser.disconnect())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
@@ -0,0 +1,286 @@
+"""
+Runs pre-planned sequences of shots (campaigns) on a Laser with as little dead time between shots as the link allows.
+
+A campaign is a list of steps:
+
+    campaign = Campaign(laser, [
+        Burst(20, rate=5, repeat=10),     # 10 bursts of 20 shots at 5 Hz
+        Configure(diodeCurrent=120),      # sent together with the settings of the next shot
+        SingleShots(50, rate=5),          # 50 single shots
+    ])
+    report = campaign.run()
+
+The whole plan is checked against the laser's limits, and the settings of every shot worked out, before anything is sent. Nothing is
+sent while a shot is in progress (the laser applies settings right away), but as soon as it reports the shot finished the next one
+only costs a single pipelined write of the settings that change, if any, and FL 1. The status is not polled until a shot is
+expected to end. The report compares each step's planned and achieved time.
+"""
+import collections
+import statistics
+
+from ujlaser.lasercontrol import Laser, LaserCommandError, LaserFireError
+from ujlaser.settings import validate_setting
+
+
+class Burst:
+    """Fires count shots at rate Hz in burst mode, repeat times back to back."""
+    def __init__(self, count, rate, repeat=1):
+        self.count = count
+        self.rate = rate
+        self.repeat = repeat
+
+    def settings(self):
+        return {"pulseMode": Laser.BURST, "burstCount": self.count, "repRate": self.rate}
+
+    def planned(self):
+        return self.repeat * self.count / self.rate
+
+    def __repr__(self):
+        return "Burst({}, rate={}, repeat={})".format(self.count, self.rate, self.repeat)
+
+class SingleShots:
+    """Fires shots single shots, each one taking 1 / rate seconds."""
+    def __init__(self, shots, rate):
+        self.shots = shots
+        self.rate = rate
+
+    @property
+    def repeat(self):
+        return self.shots
+
+    def settings(self):
+        return {"pulseMode": Laser.SINGLE_SHOT, "repRate": self.rate}
+
+    def planned(self):
+        return self.shots / self.rate
+
+    def __repr__(self):
+        return "SingleShots({}, rate={})".format(self.shots, self.rate)
+
+class Configure:
+    """Changes settings (keyed by Laser attribute name, see Laser.SETTINGS) for the steps after it."""
+    repeat = 0
+
+    def __init__(self, **settings):
+        self._settings = settings
+
+    def settings(self):
+        return dict(self._settings)
+
+    def planned(self):
+        return 0.0
+
+    def __repr__(self):
+        return "Configure({})".format(", ".join("{}={!r}".format(name, value) for name, value in self._settings.items()))
+
+class Pause:
+    """Waits seconds before the next step."""
+    repeat = 0
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def settings(self):
+        return {}
+
+    def planned(self):
+        return self.seconds
+
+    def __repr__(self):
+        return "Pause({})".format(self.seconds)
+
+
+# How one step of a campaign went. planned and achieved are in seconds, achieved runs from the end of the previous step to the end
+# of this one. dead_time is the part of achieved spent between shots (uploading settings and firing), in seconds.
+StepResult = collections.namedtuple("StepResult", ["step", "planned", "achieved", "shots", "dead_time"])
+
+
+class CampaignReport(list):
+    """The StepResult of every step that was run, in order. aborted is True if the campaign was stopped by an emergency stop."""
+    aborted = False
+
+    def summary(self):
+        """
+        Returns totals for the campaign.
+
+        Returns
+        -------
+        summary : dict
+            Steps run, shots fired, planned and achieved seconds, total dead time, and the mean dead time per shot in milliseconds.
+        """
+        shots = sum(r.shots for r in self)
+        gaps = [r.dead_time / r.shots for r in self if r.shots]
+        return {
+            "steps": len(self),
+            "shots": shots,
+            "planned_s": sum(r.planned for r in self),
+            "achieved_s": sum(r.achieved for r in self),
+            "dead_time_s": sum(r.dead_time for r in self),
+            "mean_dead_time_ms": statistics.mean(gaps) * 1e3 if gaps else 0.0,
+            "aborted": self.aborted,
+        }
+
+
+class Campaign:
+    """
+    A validated plan of steps for one Laser, see the module description.
+
+    run() blocks until the campaign is over. Call laser.emergency_stop() from another thread to end it early.
+    """
+    def __init__(self, laser, steps, poll=Laser.FIRE_POLL_MIN):
+        """
+        Parameters
+        ----------
+        laser : Laser
+            The connected laser to fire
+        steps : list
+            Burst, SingleShots, Configure and Pause steps
+        poll : float
+            Seconds between status polls once a shot is expected to have ended
+
+        Raises
+        ------
+        ValueError
+            If any step is invalid. The message lists every invalid step.
+        """
+        self.laser = laser
+        self.steps = list(steps)
+        self.poll = poll
+        self.plan = self.validate()
+
+    def validate(self):
+        """
+        Checks every step against the laser's limits, in order, with the settings the steps before it leave behind.
+
+        Returns
+        -------
+        plan : list
+            The settings (keyed by Laser attribute name) each step fires with, None for steps that don't fire. Like update_settings(),
+            the pulse period is left out unless a step sets it, and the diode current when the energy mode overrides it.
+        """
+        laser = self.laser
+        limits = None
+        if laser.connected:
+            try: # the setting checks only include the laser's own limits once they have been read
+                limits = laser.get_limits()
+            except (LaserCommandError, ValueError):
+                pass
+
+        current = {name: getattr(laser, name) for name in Laser.SETTINGS}
+        configured = set()
+        plan = []
+        errors = []
+        for i, step in enumerate(self.steps):
+            try:
+                if not isinstance(step, (Burst, SingleShots, Configure, Pause)):
+                    raise ValueError("not a campaign step")
+                if isinstance(step, Pause) and (type(step.seconds) not in (int, float) or step.seconds < 0):
+                    raise ValueError("pause must be a non-negative number of seconds")
+                if isinstance(step, (Burst, SingleShots)) and (type(step.repeat) != int or step.repeat < 1):
+                    raise ValueError("must fire at least once")
+                step_settings = step.settings()
+                for name, value in step_settings.items():
+                    current[name] = validate_setting(name, value, limits)
+                    configured.add(name)
+                if "diodeCurrent" in step_settings and "energyMode" not in step_settings:
+                    current["energyMode"] = Laser.MANUAL_ENERGY # setting the diode current switches the laser to manual energy mode
+            except ValueError as e:
+                errors.append("step {} {!r}: {}".format(i + 1, step, e))
+                plan.append(None)
+                continue
+            if not step.repeat:
+                plan.append(None)
+                continue
+            settings = {name: value for name, value in current.items() if name != "pulsePeriod" or name in configured}
+            if settings["energyMode"] != 0:
+                del settings["diodeCurrent"] # the low and high energy modes override it, and sending it would switch back to manual mode
+            plan.append(settings)
+
+        if errors:
+            raise ValueError("Invalid campaign:\n  " + "\n  ".join(errors))
+        return plan
+
+    def run(self):
+        """
+        Runs the campaign. The laser must be armed and ready to fire.
+
+        Returns
+        -------
+        report : CampaignReport
+            How each step went. Stops early, with report.aborted set, if the laser is emergency stopped.
+
+        Raises
+        ------
+        LaserCommandError
+            If the laser is not ready to fire, or refuses a setting or FL 1
+        LaserFireError
+            If the laser becomes disabled during the campaign
+        """
+        laser = self.laser
+        clock = laser.clock
+        status = laser.get_status(0)
+        if not status.laser_enabled:
+            raise LaserCommandError("Laser not armed!")
+        if not status.ready_to_fire:
+            raise LaserCommandError("Laser not ready to fire!")
+        laser.emergencyStopActive = False
+        laser.fireStop.clear()
+
+        report = CampaignReport()
+        step_start = clock.monotonic()
+        for step, settings in zip(self.steps, self.plan):
+            shots = 0
+            dead_time = 0.0
+            if isinstance(step, Pause) and clock.wait(laser.fireStop, step.seconds):
+                report.aborted = True
+            for _ in range(step.repeat):
+                if laser.fireStop.is_set():
+                    report.aborted = True
+                    break
+                gap_start = clock.monotonic()
+                with laser.settings() as staged: # only what changed, in a single write
+                    for name, value in settings.items():
+                        setattr(staged, name, value)
+                fired_at = self._fire(laser)
+                dead_time += fired_at - gap_start
+                if not self._wait_for_end(laser, settings, fired_at):
+                    report.aborted = True
+                    break
+                shots += 1
+
+            now = clock.monotonic()
+            report.append(StepResult(step, step.planned(), now - step_start, shots, dead_time))
+            step_start = now
+            if report.aborted:
+                break
+        return report
+
+    def _fire(self, laser):
+        """Sends FL 1. Returns the time on the laser's clock the laser confirmed it."""
+        response, = laser.send_commands(['FL 1'])
+        if response != b"OK\r":
+            laser.send_commands(['FL 0'])
+            raise LaserCommandError(Laser.get_error_code_description(response))
+        return laser.clock.monotonic()
+
+    def _wait_for_end(self, laser, settings, fired_at):
+        """
+        Waits for the shot that was just fired to end: without touching the link until it is expected to, then polling the status.
+        Returns False if the laser was emergency stopped.
+        """
+        clock = laser.clock
+        if settings["pulseMode"] == Laser.SINGLE_SHOT:
+            duration = 1 / settings["repRate"]
+        else:
+            duration = settings["burstCount"] / settings["repRate"]
+        delay = fired_at + duration - clock.monotonic()
+        while not clock.wait(laser.fireStop, max(delay, 0)):
+            status = laser.get_status(0)
+            laser.fire_polls += 1
+            if not status.laser_enabled:
+                raise LaserFireError("Laser has become disabled")
+            if not status.laser_active:
+                return True
+            delay = self.poll
+        laser.send_commands(['FL 0']) # the emergency stop may have been sent just before our FL 1
+        return False
@@ -0,0 +1,346 @@
+"""
+The ujlaser command, for operating a laser from the shell without writing a script.
+
+    ujlaser --port /dev/ttyUSB0 status
+    ujlaser --port /dev/ttyUSB0 arm --wait 10
+    ujlaser --port /dev/ttyUSB0 fire
+    ujlaser --port /dev/ttyUSB0 batch setup.txt
+    ujlaser --port /dev/ttyUSB0 monitor --rate 5 > laser.jsonl
+
+The port can also be given by the UJLASER_PORT environment variable, and can be the address of a daemon sharing the laser (see
+ujlaser.daemon and the serve command). Run from a checkout with python -m ujlaser.cli.
+
+A batch file holds one MicroJewel command per line, written as for Laser.send_commands() (such as "BC 20" or "FT?"). Blank lines
+and lines starting with # are skipped. Every command is written in one pipelined batch and each line's reply is printed.
+
+monitor prints one JSON object per line: a "status" line whenever the status word changes (and for the first sample), listing
+the flags that were set and cleared, and a "telemetry" line for every sample (one pipelined round trip, see Laser.get_telemetry()).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from ujlaser.lasercontrol import Laser, LaserCommandError, LaserFireError, LaserStatusResponse
+
+# Names of the status word's flags, in bit order
+STATUS_FLAGS = tuple(name for name, value in vars(LaserStatusResponse).items() if isinstance(value, property))
+
+# Settings fire_laser() times the shot with, read from the laser before firing: Laser attribute -> query and its type
+_FIRE_SETTINGS = (("pulseMode", "PM?", int), ("repRate", "RR?", float), ("burstCount", "BC?", int), ("pulsePeriod", "PE?", float))
+
+
+def _status_dict(status):
+    """Returns the status word and each of its flags, keyed by name."""
+    d = {"status": int(status)}
+    for name in STATUS_FLAGS:
+        d[name] = getattr(status, name)
+    return d
+
+def _flags(status):
+    """Returns the set of flags that are set in a status word."""
+    return {name for name in STATUS_FLAGS if getattr(status, name)}
+
+def _reply_text(reply):
+    """Returns a reply without its terminator, as text. None (no reply) stays None."""
+    if reply is None:
+        return None
+    return bytes(reply).rstrip(b"\r").decode("ascii", "replace")
+
+def read_batch(lines):
+    """
+    Picks the commands out of the lines of a batch file.
+
+    Returns
+    -------
+    commands : list
+        (line number, command) of every line that isn't blank or a comment, line numbers starting at 1.
+    """
+    commands = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            commands.append((number, line))
+    return commands
+
+def run_batch(laser, commands, out=None, as_json=False):
+    """
+    Sends a batch of commands to a connected laser in a single pipelined write, and prints each one's reply.
+
+    Parameters
+    ----------
+    laser : Laser
+        The connected laser
+    commands : list
+        (line number, command) pairs, see read_batch()
+    out : file
+        Where the results are printed, standard output by default
+    as_json : bool
+        Print a JSON object per command instead of a line of text
+
+    Returns
+    -------
+    failures : int
+        The number of commands that got an error reply or none at all.
+    """
+    out = sys.stdout if out is None else out
+    if not commands:
+        return 0
+    replies = laser.send_commands([command for _, command in commands])
+    failures = 0
+    for (number, command), reply in zip(commands, replies):
+        text = _reply_text(reply)
+        ok = text is not None and not text.startswith("?")
+        error = None
+        if not ok:
+            failures += 1
+            error = "No response from the laser" if text is None else Laser.get_error_code_description(reply)
+        if as_json:
+            out.write(json.dumps({"line": number, "command": command, "reply": text, "ok": ok, "error": error}) + "\n")
+        else:
+            out.write("{}\t{}\t{}{}\n".format(number, command, "-" if text is None else text, "" if ok else "\t" + error))
+    out.flush()
+    return failures
+
+def monitor(laser, rate=1.0, count=None, telemetry=True, out=None):
+    """
+    Samples a connected laser rate times a second and prints what it finds as JSON lines, see the module description.
+
+    Samples are taken at fixed times, so the rate doesn't drift with the time each one takes. If a sample runs late, the ticks it
+    overran are skipped rather than sampled back to back.
+
+    Parameters
+    ----------
+    laser : Laser
+        The connected laser
+    rate : float
+        Samples per second
+    count : int
+        Number of samples to take, None to run until interrupted
+    telemetry : bool
+        Read every reading with the status and print a telemetry line for each sample, otherwise only SS? is read and only status
+        changes are printed
+    out : file
+        Where the lines are printed, standard output by default
+    """
+    if not rate > 0:
+        raise ValueError("The monitor rate must be a positive number of samples per second")
+    out = sys.stdout if out is None else out
+    clock = laser.clock
+    period = 1 / rate
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    previous = None
+    taken = 0
+    tick = clock.monotonic()
+    while count is None or taken < count:
+        if telemetry:
+            sample = laser.get_telemetry()
+            status = sample["status"]
+        else:
+            status = laser.get_status(0)
+        timestamp = time.time()
+        if status is not None and status != previous:
+            flags = _flags(status)
+            old = set() if previous is None else _flags(previous)
+            out.write(dumps({"type": "status", "time": timestamp, "status": int(status),
+                             "previous": None if previous is None else int(previous),
+                             "set": [name for name in STATUS_FLAGS if name in flags - old],
+                             "cleared": [name for name in STATUS_FLAGS if name in old - flags]}) + "\n")
+            previous = status
+        if telemetry:
+            line = {"type": "telemetry", "time": timestamp}
+            line.update(sample)
+            if status is not None:
+                line["status"] = int(status)
+            out.write(dumps(line) + "\n")
+        out.flush()
+        taken += 1
+        if count is not None and taken >= count:
+            break
+        tick += period
+        now = clock.monotonic()
+        if now > tick: # running late, skip the ticks that have already gone by
+            tick += (now - tick) // period * period + period
+        clock.sleep(tick - now)
+
+def _load_fire_settings(laser):
+    """Reads the settings the shot will be timed with from the laser, as this process hasn't set them."""
+    replies = laser.send_commands([query for _, query, _ in _FIRE_SETTINGS])
+    for (name, query, kind), reply in zip(_FIRE_SETTINGS, replies):
+        text = _reply_text(reply)
+        if text is None or text.startswith("?"):
+            raise LaserCommandError("Could not read {}: {}".format(query, "No response from the laser" if text is None else Laser.get_error_code_description(reply)))
+        setattr(laser, name, kind(text))
+    laser.burstDuration = laser.burstCount / laser.repRate
+
+def _wait_ready(laser, timeout):
+    """Waits up to timeout seconds for the laser to be ready to fire."""
+    clock = laser.clock
+    deadline = clock.monotonic() + timeout
+    while not laser.get_status(0).ready_to_fire:
+        if clock.monotonic() >= deadline:
+            raise LaserCommandError("Laser not ready to fire after {} s".format(timeout))
+        clock.sleep(.1)
+
+
+def _status(laser, args):
+    status = laser.get_status(0)
+    if args.json:
+        print(json.dumps(_status_dict(status)))
+    else:
+        print("Status word: {}".format(int(status)))
+        for name in STATUS_FLAGS:
+            print("  {:<24} {}".format(name, getattr(status, name)))
+
+def _telemetry(laser, args):
+    telemetry = laser.get_telemetry()
+    if telemetry["status"] is not None:
+        telemetry["status"] = int(telemetry["status"])
+    if args.json:
+        print(json.dumps(telemetry))
+    else:
+        for name, value in telemetry.items():
+            print("{:<16} {}".format(name, "-" if value is None else value))
+
+def _arm(laser, args):
+    laser.arm()
+    if args.wait:
+        _wait_ready(laser, args.wait)
+    print("Laser armed")
+
+def _disarm(laser, args):
+    laser.disarm()
+    print("Laser disarmed")
+
+def _fire(laser, args):
+    _load_fire_settings(laser)
+    laser.fire_laser()
+    try:
+        laser.fireThread.join()
+    except KeyboardInterrupt:
+        laser.emergency_stop()
+        laser.fireThread.join()
+        raise
+    if laser.fireError is not None: # the shot failed after it started, main() reports it
+        raise laser.fireError
+    print("Fired")
+
+def _estop(laser, args):
+    try:
+        laser.emergency_stop()
+        message = "Emergency stop sent"
+    except LaserCommandError as e: # such as ?8 when the laser wasn't firing, which is only an error if it still is
+        if laser.get_status(0).laser_active:
+            raise
+        message = "Laser is not firing ({})".format(e)
+    finally:
+        if args.disarm: # even if FL 0 was refused
+            laser.disarm()
+    print(message + (", laser disarmed" if args.disarm else ""))
+
+def _batch(laser, args):
+    if args.file == "-":
+        commands = read_batch(sys.stdin)
+    else:
+        with open(args.file) as f:
+            commands = read_batch(f)
+    return 1 if run_batch(laser, commands, as_json=args.json) else 0
+
+def _monitor(laser, args):
+    try:
+        monitor(laser, args.rate, args.count, telemetry=not args.status_only)
+    except KeyboardInterrupt: # the usual way to stop it
+        pass
+
+def _serve(laser, args):
+    from ujlaser.daemon import LaserDaemon
+    daemon = LaserDaemon(laser, args.address, args.status_max_age, args.telemetry_max_age, args.refresh)
+    print("Serving the laser on " + daemon.address, flush=True)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="ujlaser", description="Operates a Quantum Composers MicroJewel laser.")
+    parser.add_argument("--port", default=os.environ.get("UJLASER_PORT"),
+                        help="serial port of the laser, or the address of a daemon serving it (tcp://host:port or unix:///path), "
+                             "$UJLASER_PORT by default")
+    parser.add_argument("--baud", type=int, default=115200, help="baud rate, 115200 by default")
+    parser.add_argument("--timeout", type=int, default=1, help="seconds to wait for each reply, 1 by default")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    commands.add_parser("status", help="print the status word and its flags").set_defaults(run=_status)
+    commands.add_parser("telemetry", help="print the status and every reading, read in one round trip").set_defaults(run=_telemetry)
+    arm = commands.add_parser("arm", help="arm (enable) the laser")
+    arm.add_argument("--wait", type=float, metavar="SECONDS", help="then wait up to SECONDS for it to be ready to fire")
+    arm.set_defaults(run=_arm)
+    commands.add_parser("disarm", help="disarm (disable) the laser").set_defaults(run=_disarm)
+    commands.add_parser("fire", help="fire with the laser's current settings and wait for the shot to end, "
+                                     "Ctrl-C stops it").set_defaults(run=_fire)
+    estop = commands.add_parser("estop", aliases=["e-stop"], help="stop firing immediately (FL 0)")
+    estop.add_argument("--disarm", action="store_true", help="then disarm the laser")
+    estop.set_defaults(run=_estop)
+    batch = commands.add_parser("batch", help="send a file of commands in one pipelined batch and print each reply")
+    batch.add_argument("file", help="one command per line, - for standard input")
+    batch.set_defaults(run=_batch)
+    monitor = commands.add_parser("monitor", help="stream status changes and telemetry as JSON lines until interrupted")
+    monitor.add_argument("--rate", type=float, default=1.0, help="samples per second, 1 by default")
+    monitor.add_argument("--count", type=int, help="stop after COUNT samples")
+    monitor.add_argument("--status-only", action="store_true", help="only read SS? and print status changes")
+    monitor.set_defaults(run=_monitor)
+    serve = commands.add_parser("serve", help="share the laser with other processes, see ujlaser.daemon")
+    serve.add_argument("address", help="where to listen: tcp://host:port or unix:///path")
+    serve.add_argument("--status-max-age", type=float, default=0.1, help="seconds a status is served from the cache, 0.1 by default")
+    serve.add_argument("--telemetry-max-age", type=float, default=1.0, help="the same for telemetry, 1 by default")
+    serve.add_argument("--refresh", type=float, help="read the status and telemetry every REFRESH seconds while idle")
+    serve.set_defaults(run=_serve)
+    return parser
+
+def main(argv=None, laser=None):
+    """
+    Entry point of the ujlaser command.
+
+    Parameters
+    ----------
+    argv : list
+        The arguments, sys.argv[1:] by default
+    laser : Laser
+        An already connected Laser to run the command on, instead of connecting to --port. It is left connected.
+
+    Returns
+    -------
+    status : int
+        The exit status: 0 on success, 1 if a command failed or the laser refused it.
+    """
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("a command is required")
+    if laser is None and not args.port:
+        parser.error("no port given, use --port or set UJLASER_PORT")
+
+    owned = laser is None
+    if owned:
+        laser = Laser(readMode=Laser.EVENT_READER)
+    try:
+        if owned:
+            port = args.port
+            if port.startswith(("tcp://", "unix://")): # a daemon sharing the laser, see ujlaser.daemon
+                from ujlaser.daemon import DaemonSerial
+                port = DaemonSerial(port, args.timeout)
+            laser.connect(port, args.baud, args.timeout)
+        return args.run(laser, args) or 0
+    except (LaserCommandError, LaserFireError, ConnectionError, OSError, ValueError) as e:
+        print("ujlaser: error: {}".format(e), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if owned:
+            laser.disconnect()
+
+if __name__ == "__main__":
+    sys.exit(main())
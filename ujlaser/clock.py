@@ -0,0 +1,140 @@
+"""
+Clocks that the library's timing loops (and the FakeSerialLaser) sleep and wait on.
+
+Clock is real time. VirtualClock is simulated time that skips ahead whenever every thread is waiting, so simulations and tests
+of long arm, fire and cool down cycles run as fast as the code allows.
+"""
+import threading as thread
+import time
+
+
+class Clock:
+    """Real time, on the monotonic clock."""
+
+    def monotonic(self):
+        """Returns the current time in seconds, see time.monotonic()."""
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        """Blocks for the given number of seconds."""
+        time.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        """Waits until a threading.Event is set or the timeout expires. Returns True if the event was set, see Event.wait()."""
+        return event.wait(timeout)
+
+    def wait_condition(self, condition, timeout=None):
+        """
+        Waits until a threading.Condition is notified or the timeout expires, see Condition.wait(). The caller must hold the condition.
+        Returns False if the timeout expired.
+        """
+        return condition.wait(timeout)
+
+
+class VirtualClock(Clock):
+    """
+    Simulated time, which only passes while threads sleep or wait on the clock and then jumps straight to the next deadline.
+
+    The clock can't see threads that aren't waiting on it, so it takes idle real seconds without any call to the clock as the sign that
+    every thread is waiting. It then moves time forward to the earliest deadline any thread is waiting for and wakes that thread. A
+    woken thread counts as busy until it calls the clock again or ends, so time never runs ahead of a thread that hasn't been scheduled
+    yet, unless it stays quiet for stall real seconds (it is then taken to be blocked on something else, such as a lock).
+
+    Code running between calls to the clock takes no simulated time, so as long as no thread spends longer than idle between calls to
+    the clock, everything happens in the same order and at the same simulated times as it would in real time.
+    """
+    def __init__(self, start=0.0, idle=0.001, stall=0.1):
+        """
+        Parameters
+        ----------
+        start : float
+            The simulated time to start at, in seconds
+        idle : float
+            Real seconds without any call to the clock after which waiting threads are taken to be the only ones left
+        stall : float
+            Real seconds a woken thread may go without calling the clock before time moves on without it
+        """
+        self._now = float(start)
+        self.idle = idle
+        self.stall = stall
+        self._condition = thread.Condition()
+        self._waiting = {} # thread -> simulated deadline it is waiting for
+        self._woken = {} # thread woken by time moving forward -> real time it was woken, until it calls the clock again
+        self._activity = 0 # bumped by every call to the clock, time only skips ahead when this stops changing
+
+    def monotonic(self):
+        self._activity += 1
+        if self._woken:
+            self._woken.pop(thread.current_thread(), None)
+        return self._now
+
+    def advance(self, seconds):
+        """Moves time forward by the given number of seconds right away, waking every thread whose deadline has passed."""
+        with self._condition:
+            self._move_to(self._now + seconds)
+
+    def _move_to(self, now):
+        """Sets the time and wakes the threads whose deadline has come. Must be called with self._condition held."""
+        self._now = now
+        self._activity += 1
+        woken = time.monotonic()
+        for waiter, deadline in self._waiting.items():
+            if deadline <= now:
+                self._woken[waiter] = woken
+        self._condition.notify_all()
+
+    def _settled(self):
+        """Returns True if every thread woken by time moving forward has run since. Must be called with self._condition held."""
+        now = time.monotonic()
+        for waiter, woken in list(self._woken.items()):
+            if not waiter.is_alive() or now - woken >= self.stall:
+                del self._woken[waiter]
+            else:
+                return False
+        return True
+
+    def sleep(self, seconds):
+        self._wait(seconds, None)
+
+    def wait(self, event, timeout=None):
+        if event.is_set():
+            return True
+        return self._wait(timeout, event.wait)
+
+    def wait_condition(self, condition, timeout=None):
+        return self._wait(timeout, condition.wait)
+
+    def _wait(self, timeout, wait_real):
+        """
+        Waits for timeout simulated seconds (forever if None). wait_real(seconds) waits for up to that many real seconds for whatever
+        else the caller is waiting on, returning True once it has happened. Returns True if it did, False if the timeout expired.
+        """
+        condition = self._condition
+        me = thread.current_thread()
+        with condition:
+            self._activity += 1
+            self._woken.pop(me, None)
+            deadline = None if timeout is None else self._now + max(timeout, 0)
+            if deadline is not None:
+                self._waiting[me] = deadline
+        try:
+            seen = None
+            while True:
+                with condition:
+                    if deadline is not None and self._now >= deadline:
+                        return False
+                    if self._activity == seen and self._settled(): # nobody has touched the clock for a while, skip ahead to the next deadline
+                        upcoming = [d for d in self._waiting.values() if d > self._now]
+                        if upcoming:
+                            self._move_to(min(upcoming))
+                            continue
+                    seen = self._activity
+                    if wait_real is None:
+                        condition.wait(self.idle)
+                        continue
+                if wait_real(self.idle):
+                    return True
+        finally:
+            if deadline is not None:
+                with condition:
+                    del self._waiting[me]
@@ -0,0 +1,471 @@
+"""
+A daemon that owns one Laser and shares it with any number of local clients over TCP or a Unix socket.
+
+The daemon speaks the laser's own serial protocol: a client writes command frames (;LA:SS?\r, the ;LA: prefix is optional) and
+reads one \r terminated reply per command, in order. So a Laser connects to the daemon as it would to the laser itself:
+
+    daemon = LaserDaemon(laser, "tcp://127.0.0.1:7777", refresh=1) # in the process that owns the port
+    daemon.serve_forever()
+
+    l = Laser()                                                    # in every other process
+    l.connect(DaemonSerial("tcp://127.0.0.1:7777"))
+
+or with `ujlaser --port /dev/ttyUSB0 serve tcp://127.0.0.1:7777` and `ujlaser --port tcp://127.0.0.1:7777 status`.
+
+Commands from every client go through one dispatcher thread, which writes everything waiting (up to max_batch commands) to the
+laser in one pipelined batch. FL 0 and EN 0 jump the queue: they are sent in a batch of their own, ahead of anything else waiting,
+and every EN 1 and FL 1 still waiting (from any client) is dropped and answered with ?8, so nothing queued before a stop can arm or
+fire the laser after it.
+SS? and the telemetry queries (FT?, TR?, FV?, IM?, BV?, SC?) are answered from a shared cache while it is fresh, and the same query
+from several clients in one batch is only sent once. The status cache is dropped whenever a command that changes the laser's state
+(EN, FL, EM, RS) goes through the daemon. With refresh set, the dispatcher keeps the cache that fresh while it is idle, so dashboards
+and loggers polling the daemon don't add any traffic to the link.
+
+A reply the laser never sends (a timeout) is not sent to the client either, just as on the serial port.
+"""
+import collections
+import os
+import select
+import socket
+import socketserver
+import threading as thread
+import time
+
+from ujlaser.lasercontrol import _STATE_CHANGING_COMMANDS, _TELEMETRY
+
+# Commands that stop the laser, sent ahead of every other command waiting
+SAFETY_COMMANDS = ("FL 0", "EN 0")
+
+# Commands that arm or fire the laser, dropped when a safety command arrives while they wait, and the reply they get instead
+CANCELLED_BY_SAFETY = ("EN 1", "FL 1")
+CANCELLED_REPLY = b"?8\r" # command unavailable in current system state
+
+# Queries answered from the cache: SS? (with status_max_age) and the rest of the telemetry (with telemetry_max_age)
+STATUS_QUERY = "SS?"
+TELEMETRY_QUERIES = tuple(query for _, query, _ in _TELEMETRY if query != STATUS_QUERY)
+
+
+def parse_address(address):
+    """
+    Turns a daemon address into what socket.connect() takes.
+
+    Parameters
+    ----------
+    address : str or tuple
+        tcp://host:port, unix:///path/to/socket, or a (host, port) tuple
+
+    Returns
+    -------
+    (family, address) : tuple
+        socket.AF_INET or AF_UNIX, and the (host, port) tuple or socket path.
+    """
+    if isinstance(address, tuple):
+        return socket.AF_INET, address
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://"):].rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError("Invalid daemon address {}, expected tcp://host:port".format(address))
+        return socket.AF_INET, (host.strip("[]"), int(port))
+    if address.startswith("unix://"):
+        return socket.AF_UNIX, address[len("unix://"):]
+    raise ValueError("Invalid daemon address {}, expected tcp://host:port or unix:///path".format(address))
+
+def _normalized(command):
+    """Returns a command with its words separated by single spaces and in upper case, for comparing it to SAFETY_COMMANDS."""
+    return " ".join(command.split()).upper()
+
+def _command(frame):
+    """Returns the command in a frame received from a client, without the ;LA: prefix and the terminator."""
+    frame = frame.strip(b"\n\r ")
+    if frame[:1] == b";":
+        frame = frame.partition(b":")[2]
+    return frame.decode("ascii", "replace").strip()
+
+
+class _Request:
+    """A command from a client. reply is the laser's reply frame, None until it arrives (or if it never does)."""
+    __slots__ = ("client", "command", "reply", "done")
+
+    def __init__(self, client, command):
+        self.client = client
+        self.command = command
+        self.reply = None
+        self.done = False
+
+
+class _Client:
+    """A connected client. Replies are sent in the order its commands arrived, even when a safety command is answered first."""
+    def __init__(self, sock):
+        self.sock = sock
+        self._pending = collections.deque()
+        self._lock = thread.Lock()
+
+    def expect(self, request):
+        with self._lock:
+            self._pending.append(request)
+
+    def complete(self, request, reply):
+        """Records the reply to one of this client's requests, and sends every reply that is no longer waiting on an earlier one."""
+        with self._lock:
+            request.reply = reply
+            request.done = True
+            replies = []
+            pending = self._pending
+            while pending and pending[0].done:
+                reply = pending.popleft().reply
+                if reply is not None:
+                    replies.append(reply)
+            if replies:
+                try:
+                    self.sock.sendall(b"".join(replies))
+                except OSError: # gone, or not reading its replies (the send timed out), the handler cleans up
+                    self.close()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Reads command frames from one client and hands them to the daemon."""
+    def handle(self):
+        daemon = self.server.laser_daemon
+        sock = self.request
+        sock.settimeout(daemon.send_timeout) # a client that stops reading its replies must not hold up the dispatcher
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(sock)
+        daemon._connected(client)
+        buffer = b""
+        while not daemon.closed:
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not data:
+                break
+            *frames, buffer = (buffer + data).split(b"\r")
+            for frame in frames:
+                command = _command(frame)
+                if command:
+                    daemon._submit(client, command)
+        daemon._disconnected(client)
+        client.close()
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class LaserDaemon:
+    """
+    Shares a connected Laser with clients on a TCP or Unix socket, see the module description.
+
+    The daemon doesn't connect or disconnect the laser, and nothing else should send it commands while the daemon serves it, apart
+    from the Laser's own keepalives.
+    """
+    def __init__(self, laser, address, status_max_age=0.1, telemetry_max_age=1.0, refresh=None, max_batch=32, send_timeout=5):
+        """
+        Parameters
+        ----------
+        laser : Laser
+            The connected laser to share
+        address : str or tuple
+            Where to listen: tcp://host:port (port 0 picks a free one, see address), unix:///path, or a (host, port) tuple
+        status_max_age : float
+            Seconds a status read from the laser is served from the cache for, 0 sends every SS? to the laser
+        telemetry_max_age : float
+            The same for the other telemetry queries
+        refresh : float
+            Read the status and telemetry every refresh seconds while idle, so polling clients are always served from the cache.
+            None only reads them when a client asks.
+        max_batch : int
+            The most commands written in one batch, which bounds how long a safety command can wait behind a batch in progress
+        send_timeout : float
+            Seconds a client may leave its replies unread before it is disconnected
+        """
+        self.laser = laser
+        self.status_max_age = status_max_age
+        self.telemetry_max_age = telemetry_max_age
+        self.refresh = refresh
+        self.max_batch = max_batch
+        self.send_timeout = send_timeout
+        self.closed = False
+        self.batches = 0 # batches written to the laser, for measuring how well requests are multiplexed
+        self._cache = {} # query -> (time.monotonic() it was sent, reply frame)
+        self._refreshed = 0.0 # time.monotonic() of the last refresh
+        self._clients = set()
+        self._clients_lock = thread.Lock()
+        self._cond = thread.Condition()
+        self._safety = collections.deque()
+        self._queue = collections.deque()
+
+        family, address = parse_address(address)
+        if family == socket.AF_UNIX:
+            self._server = _UnixServer(address, _Handler)
+        else:
+            self._server = _TCPServer(address, _Handler)
+        self._server.laser_daemon = self
+        self._server_thread = thread.Thread(target=self._server.serve_forever, name="ujlaser-daemon-server", daemon=True)
+        self._dispatcher = thread.Thread(target=self._dispatch, name="ujlaser-daemon-dispatcher", daemon=True)
+
+    @property
+    def address(self):
+        """The address clients connect to, as tcp://host:port (with the actual port) or unix:///path."""
+        bound = self._server.server_address
+        if isinstance(bound, tuple):
+            return "tcp://{}:{}".format(bound[0], bound[1])
+        return "unix://" + (bound.decode() if isinstance(bound, bytes) else bound)
+
+    def start(self):
+        """Starts serving clients, from threads of the calling process."""
+        self._dispatcher.start()
+        self._server_thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serves clients until interrupted (Ctrl-C) or closed from another thread."""
+        self.start()
+        try:
+            while self._dispatcher.is_alive():
+                self._dispatcher.join(1)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops serving and disconnects every client. Commands still waiting are dropped, the laser is left connected."""
+        if self.closed:
+            return
+        self.closed = True
+        with self._cond:
+            self._cond.notify_all()
+        if self._server_thread.is_alive():
+            self._server.shutdown()
+        self._server.server_close()
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+        if isinstance(self._server.server_address, str):
+            try:
+                os.remove(self._server.server_address)
+            except OSError:
+                pass
+        if self._dispatcher.is_alive() and self._dispatcher is not thread.current_thread():
+            self._dispatcher.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connected(self, client):
+        with self._clients_lock:
+            self._clients.add(client)
+
+    def _disconnected(self, client):
+        with self._clients_lock:
+            self._clients.discard(client)
+
+    @property
+    def clients(self):
+        """The number of connected clients."""
+        with self._clients_lock:
+            return len(self._clients)
+
+    def _max_age(self, command):
+        if command == STATUS_QUERY:
+            return self.status_max_age
+        if command in TELEMETRY_QUERIES:
+            return self.telemetry_max_age
+        return None
+
+    def _cached(self, command):
+        """Returns the cached reply to a query if it is still fresh, otherwise None."""
+        max_age = self._max_age(command)
+        if not max_age:
+            return None
+        cached = self._cache.get(command)
+        if cached is not None and time.monotonic() - cached[0] <= max_age:
+            return cached[1]
+        return None
+
+    def _submit(self, client, command):
+        """Queues a command from a client, or answers it at once from the cache."""
+        request = _Request(client, command)
+        client.expect(request)
+        reply = self._cached(command)
+        if reply is not None:
+            client.complete(request, reply)
+            return
+        cancelled = ()
+        with self._cond:
+            if _normalized(command) in SAFETY_COMMANDS:
+                cancelled = [r for r in self._queue if _normalized(r.command) in CANCELLED_BY_SAFETY]
+                if cancelled:
+                    self._queue = collections.deque(r for r in self._queue if _normalized(r.command) not in CANCELLED_BY_SAFETY)
+                self._safety.append(request)
+            else:
+                self._queue.append(request)
+            self._cond.notify()
+        for r in cancelled: # outside the lock, answering can block on a slow client
+            r.client.complete(r, CANCELLED_REPLY)
+
+    def _next_batch(self, timeout):
+        """Waits up to timeout seconds for requests. Returns every waiting safety command, or else up to max_batch requests."""
+        with self._cond:
+            if not (self._safety or self._queue or self.closed):
+                self._cond.wait(timeout)
+            if self._safety:
+                batch = list(self._safety)
+                self._safety.clear()
+                return batch
+            batch = []
+            while self._queue and len(batch) < self.max_batch:
+                batch.append(self._queue.popleft())
+            return batch
+
+    def _dispatch(self):
+        """Body of the dispatcher thread, the only one that sends the clients' commands to the laser."""
+        while not self.closed:
+            timeout = None
+            if self.refresh:
+                timeout = self._refreshed + self.refresh - time.monotonic()
+                if timeout <= 0:
+                    self._refreshed = time.monotonic()
+                    self._send([_Request(None, query) for query in (STATUS_QUERY,) + TELEMETRY_QUERIES])
+                    continue
+            batch = self._next_batch(timeout)
+            if batch:
+                self._send(batch)
+
+    def _send(self, batch):
+        """Writes a batch of requests to the laser in one pipelined write, and completes them with the replies."""
+        commands = [] # sent to the laser
+        sent_for = [] # index into commands each request is answered by
+        shared = {} # cacheable query -> index into commands, since the last state changing command
+        last_change = -1 # index into commands of the last state changing command
+        for request in batch:
+            command = request.command
+            if request.client is not None:
+                reply = self._cached(command)
+                if reply is not None: # read by an earlier batch while this request waited
+                    sent_for.append(reply)
+                    continue
+            if command in shared:
+                sent_for.append(shared[command])
+                continue
+            if command[:2] in _STATE_CHANGING_COMMANDS and "?" not in command:
+                shared.clear()
+                last_change = len(commands)
+            elif self._max_age(command) is not None:
+                shared[command] = len(commands)
+            sent_for.append(len(commands))
+            commands.append(command)
+
+        replies = []
+        if commands:
+            sent = time.monotonic()
+            try:
+                replies = self.laser.send_commands(commands)
+            except Exception: # the link failed, the clients' reads time out as they would on the serial port
+                replies = [None] * len(commands)
+            self.batches += 1
+            if last_change >= 0:
+                self._cache.pop(STATUS_QUERY, None)
+            for i, (command, reply) in enumerate(zip(commands, replies)):
+                if i > last_change and reply is not None and reply[:1] != b"?" and self._max_age(command) is not None:
+                    self._cache[command] = (sent, reply)
+
+        for request, index in zip(batch, sent_for):
+            if request.client is not None:
+                request.client.complete(request, index if isinstance(index, bytes) else replies[index])
+
+
+class DaemonSerial:
+    """
+    A serial-like connection to a LaserDaemon, for Laser.connect(). It has everything a Laser uses of a pyserial port: write, read,
+    readinto, read_until, in_waiting, fileno and timeout. baudrate and parity are accepted and ignored.
+    """
+    def __init__(self, address, timeout=1):
+        """
+        Parameters
+        ----------
+        address : str or tuple
+            The daemon's address, see LaserDaemon
+        timeout : float
+            Seconds reads wait for, None waits forever
+        """
+        family, address = parse_address(address)
+        if family == socket.AF_UNIX:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(address)
+        else:
+            self._sock = socket.create_connection(address)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = bytearray()
+        self.timeout = timeout
+        self.baudrate = None
+        self.parity = None
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def write(self, data):
+        self._sock.sendall(data)
+        return len(data)
+
+    def _receive(self, timeout):
+        """Adds whatever has arrived to the buffer, waiting up to timeout seconds (None for ever) for something to."""
+        if select.select([self._sock], [], [], timeout)[0]:
+            data = self._sock.recv(65536)
+            if not data:
+                raise ConnectionError("The laser daemon closed the connection")
+            self._buffer += data
+
+    @property
+    def in_waiting(self):
+        self._receive(0)
+        return len(self._buffer)
+
+    def _wait(self, done):
+        """Receives until done(buffer) is true or the timeout expires."""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not done(self._buffer):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            self._receive(remaining)
+
+    def _take(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def read(self, size=1):
+        self._wait(lambda buffer: len(buffer) >= size)
+        return self._take(size)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def read_until(self, expected=b"\r", size=None):
+        self._wait(lambda buffer: expected in buffer or (size is not None and len(buffer) >= size))
+        end = self._buffer.find(expected)
+        end = len(self._buffer) if end < 0 else end + len(expected)
+        return self._take(end if size is None else min(end, size))
+
+    def close(self):
+        self._sock.close()
@@ -0,0 +1,282 @@
+import collections
+import statistics
+import threading as thread
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ujlaser.lasercontrol import Laser, LaserCommandError
+
+# The outcome of one fleet operation on one laser. value is what the Laser method returned, error is the exception it raised
+# (None on success), started is the time.monotonic() the call began and latency is how long it took in seconds.
+LaserResult = collections.namedtuple("LaserResult", ["value", "error", "started", "latency"])
+
+
+class FleetResult(dict):
+    """The results of a fleet operation, a dict of LaserResult keyed by laser name, with some aggregate statistics."""
+
+    @property
+    def returned(self):
+        """The value returned for each laser that succeeded, keyed by laser name."""
+        return {name: r.value for name, r in self.items() if r.error is None}
+
+    @property
+    def errors(self):
+        """The exception raised for each laser that failed, keyed by laser name."""
+        return {name: r.error for name, r in self.items() if r.error is not None}
+
+    @property
+    def ok(self):
+        """True if the operation succeeded on every laser."""
+        return all(r.error is None for r in self.values())
+
+    def summary(self):
+        """
+        Returns aggregate latency statistics for the operation.
+
+        Returns
+        -------
+        summary : dict
+            Minimum, mean and maximum per laser latency, the total wall time from the first call starting to the last one finishing,
+            and the start skew (how far apart the calls started), all in milliseconds. Also the number of lasers and of failures.
+        """
+        if len(self) == 0:
+            return {"lasers": 0, "failures": 0}
+        latencies = [r.latency for r in self.values()]
+        starts = [r.started for r in self.values()]
+        ends = [r.started + r.latency for r in self.values()]
+        return {
+            "lasers": len(self),
+            "failures": len(self.errors),
+            "min_ms": min(latencies) * 1e3,
+            "mean_ms": statistics.mean(latencies) * 1e3,
+            "max_ms": max(latencies) * 1e3,
+            "wall_ms": (max(ends) - min(starts)) * 1e3,
+            "start_skew_ms": (max(starts) - min(starts)) * 1e3,
+        }
+
+
+class LaserFleet:
+    """
+    Controls many lasers, each on its own serial port, concurrently.
+
+    Every fleet operation calls the same Laser method on every laser at once from a pool of worker threads, so a fleet-wide operation
+    takes about as long as the slowest laser instead of the sum of all of them. Failures on one laser never stop the operation on the
+    others, they are reported in the returned FleetResult.
+    """
+    def __init__(self, lasers=None):
+        """
+        Parameters
+        ----------
+        lasers : dict or list
+            Laser objects keyed by name. A list is named by position ("0", "1", ...).
+        """
+        self.lasers = collections.OrderedDict()
+        self._executor = None
+        self._stop_threads = {} # laser name -> thread parked until emergency_stop() releases it
+        self._stop_condition = thread.Condition()
+        self._stop_lock = thread.Lock() # one emergency_stop() at a time
+        self._stop_round = 0 # bumped by emergency_stop() to release the parked threads
+        self._stop_results = {}
+        self._stopping_workers = False
+        if isinstance(lasers, dict):
+            for name, laser in lasers.items():
+                self.add(name, laser)
+        elif lasers is not None:
+            for i, laser in enumerate(lasers):
+                self.add(str(i), laser)
+
+    def __len__(self):
+        return len(self.lasers)
+
+    def __getitem__(self, name):
+        return self.lasers[name]
+
+    def add(self, name, laser):
+        """Adds a Laser to the fleet under the given name."""
+        if name in self.lasers:
+            raise ValueError("There is already a laser named " + str(name) + " in the fleet")
+        self.lasers[name] = laser
+        if self._executor is not None: # resize the pool so that every laser can still run at the same time
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._start_stop_worker(name)
+
+    def _start_stop_worker(self, name):
+        """Starts the thread that sends the named laser's emergency stop, so that emergency_stop() never has to start one."""
+        with self._stop_condition:
+            self._stopping_workers = False
+            worker = self._stop_threads.get(name)
+            if worker is None or not worker.is_alive():
+                worker = thread.Thread(target=self._stop_worker, args=(name, self.lasers[name], self._stop_round), name="ujlaser-estop", daemon=True)
+                self._stop_threads[name] = worker
+                worker.start()
+
+    def _stop_worker(self, name, laser, done):
+        """Body of a laser's emergency stop thread. Waits for emergency_stop() to release it, then stops the laser."""
+        condition = self._stop_condition
+        while True:
+            with condition:
+                while self._stop_round == done and not self._stopping_workers:
+                    condition.wait()
+                if self._stopping_workers:
+                    return
+                done = self._stop_round
+            result = self._call(Laser.emergency_stop, laser)
+            with condition:
+                self._stop_results[name] = result
+                condition.notify_all()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.lasers)), thread_name_prefix="ujlaser-fleet")
+        return self._executor
+
+    @staticmethod
+    def _call(function, laser, *args):
+        started = time.monotonic()
+        try:
+            value, error = function(laser, *args), None
+        except Exception as e:
+            value, error = None, e
+        return LaserResult(value, error, started, time.monotonic() - started)
+
+    def run(self, function, *args, names=None):
+        """
+        Calls function(laser, *args) for every laser in the fleet concurrently.
+
+        Parameters
+        ----------
+        function : callable
+            Called with each Laser object followed by args
+        names : list
+            Only run on the lasers with these names. Defaults to the whole fleet.
+
+        Returns
+        -------
+        results : FleetResult
+            The result of each call, keyed by laser name.
+        """
+        names = list(self.lasers) if names is None else names
+        pool = self._pool()
+        futures = [(name, pool.submit(self._call, function, self.lasers[name], *args)) for name in names]
+        return FleetResult((name, future.result()) for name, future in futures)
+
+    def connect(self, ports, baud_rate=115200, timeout=1, parity=None, **laser_kwargs):
+        """
+        Creates a Laser for every port and connects them all at once.
+
+        Parameters
+        ----------
+        ports : dict or list
+            Serial ports (or serial-like objects) keyed by laser name. A list is named by position.
+        baud_rate, timeout, parity :
+            Passed to Laser.connect for every laser
+        laser_kwargs :
+            Passed to the Laser constructor for every laser (e.g. readMode, statusMaxAge)
+
+        Returns
+        -------
+        results : FleetResult
+            The result of each connect, keyed by laser name. Lasers that fail to connect stay in the fleet, disconnected.
+        """
+        if not isinstance(ports, dict):
+            ports = collections.OrderedDict((str(i + len(self.lasers)), port) for i, port in enumerate(ports))
+        for name in ports:
+            self.add(name, Laser(**laser_kwargs))
+        pool = self._pool()
+        futures = [(name, pool.submit(self._call, Laser.connect, self.lasers[name], port, baud_rate, timeout, parity)) for name, port in ports.items()]
+        return FleetResult((name, future.result()) for name, future in futures)
+
+    def disconnect(self):
+        """Disconnects every laser in the fleet."""
+        return self.run(Laser.disconnect)
+
+    def close(self):
+        """Disconnects every laser and stops the worker threads."""
+        results = self.disconnect()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        with self._stop_condition:
+            self._stopping_workers = True
+            self._stop_condition.notify_all()
+            workers = list(self._stop_threads.values())
+            self._stop_threads.clear()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def get_status(self, max_age=None):
+        """Takes a fleet-wide status snapshot. Returns a FleetResult whose values are LaserStatusResponse objects."""
+        return self.run(lambda laser: laser.get_status(max_age))
+
+    def get_telemetry(self):
+        """Reads the status and every reading of every laser in one round trip per laser, as a dict per laser (see Laser.get_telemetry)."""
+        return self.run(Laser.get_telemetry)
+
+    def arm(self, wait=True, timeout=15, poll=.25):
+        """
+        Arms every laser at once.
+
+        Parameters
+        ----------
+        wait : bool
+            If True, wait for each laser to finish arming (about 8 seconds) and report it ready to fire.
+        timeout : float
+            Seconds to wait for each laser to become ready to fire.
+        poll : float
+            Seconds between status checks while waiting.
+
+        Returns
+        -------
+        results : FleetResult
+            The result of each arm, keyed by laser name. A laser that is not ready to fire in time fails with a LaserCommandError.
+        """
+        def arm(laser):
+            laser.arm()
+            if not wait:
+                return True
+            clock = laser.clock
+            deadline = clock.monotonic() + timeout
+            while not laser.get_status(0).ready_to_fire:
+                if clock.monotonic() >= deadline:
+                    raise LaserCommandError("Laser did not become ready to fire within " + str(timeout) + " seconds")
+                clock.sleep(poll)
+            return True
+        return self.run(arm)
+
+    def disarm(self):
+        """Disarms every laser at once."""
+        return self.run(Laser.disarm)
+
+    def fire(self):
+        """Fires every laser at once."""
+        return self.run(Laser.fire_laser)
+
+    def emergency_stop(self):
+        """
+        Sends an emergency stop to every laser with as little skew between them as possible.
+
+        Every laser has a dedicated thread, started when the laser was added and parked until now, and they are all released at once.
+        Nothing is started here, and this never waits behind other fleet operations that are still running in the worker pool (such
+        as arm(wait=True)).
+
+        Returns
+        -------
+        results : FleetResult
+            The result of each emergency stop, keyed by laser name. summary()["start_skew_ms"] is the spread of the send times.
+        """
+        with self._stop_lock:
+            names = list(self.lasers)
+            for name in names:
+                if name not in self._stop_threads: # only after close()
+                    self._start_stop_worker(name)
+            condition = self._stop_condition
+            with condition:
+                self._stop_results = {}
+                self._stop_round += 1
+                condition.notify_all()
+                while not all(name in self._stop_results for name in names):
+                    condition.wait()
+                results = self._stop_results
+            return FleetResult((name, results[name]) for name in names)
@@ -0,0 +1,150 @@
+"""
+Splits the byte stream from the laser into response frames, and parses replies straight from the received bytes.
+
+Every reply from the laser is terminated by a carriage return (\r). ResponseFramer keeps the received bytes in one preallocated
+buffer and hands out memoryview slices of it, so framing a reply copies nothing. The parse functions take those slices (or bytes)
+and never decode them to str: error codes are read byte by byte, and numbers go straight to int() and float(), which accept bytes
+and ignore the \r terminator.
+"""
+
+_QUESTION_MARK = 0x3F
+_ZERO = 0x30
+_NINE = 0x39
+
+
+class ResponseFramer:
+    """
+    A receive buffer that is filled in bulk from a serial port and split into \r terminated frames.
+
+    The buffer is allocated once. Consumed frames are dropped by moving a start index, and the unconsumed bytes are only moved
+    back to the front of the buffer when there isn't room for the next read.
+    """
+    def __init__(self, size=4096):
+        """
+        Parameters
+        ----------
+        size : int
+            Initial size of the receive buffer in bytes. It is replaced by a larger one if a single frame ever doesn't fit.
+        """
+        if not type(size) == int or size <= 0:
+            raise ValueError("Receive buffer size must be a positive, non-zero integer!")
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0 # index of the first byte that hasn't been handed out in a frame
+        self._end = 0   # index one past the last byte received
+
+    def __len__(self):
+        """Returns the number of bytes received that haven't been handed out in a frame yet."""
+        return self._end - self._start
+
+    def clear(self):
+        """Drops everything received."""
+        self._start = self._end = 0
+
+    def fill(self, ser, n):
+        """
+        Reads up to n bytes from a serial port into the buffer. Frames handed out before the call must not be used afterwards.
+
+        Parameters
+        ----------
+        ser : serial.Serial or serial-like object
+            The port to read from. Ports with readinto() read straight into the buffer, others are read with read().
+        n : int
+            Number of bytes to read, usually the port's in_waiting
+
+        Returns
+        -------
+        count : int
+            The number of bytes actually read.
+        """
+        if self._end + n > len(self._buf):
+            self._reserve(n)
+        end = self._end
+        readinto = getattr(ser, "readinto", None)
+        if readinto is not None:
+            count = readinto(self._view[end:end + n]) or 0
+        else:
+            data = ser.read(n)
+            count = len(data) if data else 0
+            if count:
+                self._buf[end:end + count] = data
+        self._end = end + count
+        return count
+
+    def feed(self, data):
+        """Adds bytes that were received some other way (e.g. from read_until) to the buffer."""
+        n = len(data)
+        if self._end + n > len(self._buf):
+            self._reserve(n)
+        self._buf[self._end:self._end + n] = data
+        self._end += n
+
+    def _reserve(self, n):
+        """Makes room for n more bytes after the received data."""
+        pending = self._end - self._start
+        if pending + n <= len(self._buf): # move the unconsumed bytes back to the front, through a copy since the ranges may overlap
+            self._buf[:pending] = bytes(self._view[self._start:self._end])
+        else: # a frame longer than the buffer, frames already handed out keep the old buffer alive
+            buf = bytearray(max(2 * len(self._buf), pending + n))
+            buf[:pending] = self._view[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        self._start, self._end = 0, pending
+
+    def next_frame(self):
+        """
+        Returns the next complete frame as a memoryview into the buffer, including its \r terminator, or None if no complete frame
+        has been received yet. The view is only valid until the next call to fill() or feed().
+        """
+        i = self._buf.find(b"\r", self._start, self._end)
+        if i == -1:
+            return None
+        frame = self._view[self._start:i + 1]
+        self._start = i + 1
+        if self._start == self._end: # nothing left over, start the next read at the front of the buffer
+            self._start = self._end = 0
+        return frame
+
+    def take_partial(self):
+        """Returns whatever has been received without a terminator as a memoryview (None if nothing has), and drops it."""
+        if self._start == self._end:
+            return None
+        frame = self._view[self._start:self._end]
+        self._start = self._end = 0
+        return frame
+
+
+def error_code(frame):
+    """Returns N if frame is a ?N error reply, 0 otherwise."""
+    if frame is None or len(frame) < 2 or frame[0] != _QUESTION_MARK:
+        return 0
+    code = 0
+    for i in range(1, len(frame)):
+        c = frame[i]
+        if _ZERO <= c <= _NINE:
+            code = code * 10 + c - _ZERO
+        else:
+            break
+    return code
+
+def parse_int(frame):
+    """
+    Parses a decimal integer reply, such as the status word of SS?.
+
+    Raises
+    ------
+    ValueError
+        If the frame isn't an integer.
+    """
+    return int(frame if type(frame) == bytes else bytes(frame))
+
+def parse_float(frame):
+    """
+    Parses a decimal number reply, such as a temperature or voltage.
+
+    Raises
+    ------
+    ValueError
+        If the frame isn't a number.
+    """
+    return float(frame if type(frame) == bytes else bytes(frame))
@@ -1,64 +1,133 @@
-import serial
-import serial.tools.list_ports
+import contextlib
+import queue
+import select
 import time
 import threading as thread
 
-from ujlaser.repeatedtimer import RepeatedTimer
+from ujlaser.clock import Clock
+from ujlaser.framing import ResponseFramer, error_code, parse_float, parse_int
+from ujlaser.metrics import LaserMetrics
+from ujlaser.scheduler import PeriodicScheduler
+from ujlaser.settings import LIMITED_SETTINGS, LIMIT_QUERIES, LIMITS, SETTINGS, changed_settings, commit_setting, parse_limits, setting_command, upload_values, validate_setting
+
+# Commands that change the laser's state, sending any of these invalidates the cached status
+_STATE_CHANGING_COMMANDS = ("EN", "FL", "EM", "RS")
+
+# pyserial's PARITY_* values by the names connect() accepts, so checking and passing them on doesn't need pyserial imported
+_PARITIES = {None: 'N', 'none': 'N', 'even': 'E', 'odd': 'O', 'mark': 'M', 'space': 'S'}
+
+# concurrent.futures.Future. pyserial and concurrent.futures (which pulls in logging) are most of the cost of importing this module,
+# so they are only imported once they are needed: serial when connect() opens a port, Future by _new_future().
+Future = None
+
+def _new_future():
+    global Future
+    if Future is None:
+        from concurrent.futures import Future
+    return Future()
 
 class LaserCommandError(Exception):
     pass
 
+def _reply_parser(parse):
+    """
+    Wraps a reply parser (such as framing.parse_float) for _query. The wrapped parser runs while the reply is still in the receive
+    buffer, so instead of raising it returns a LaserCommandError for an error reply, a missing reply or one parse can't read.
+    """
+    def parse_reply(frame):
+        if not frame:
+            return LaserCommandError("No response from the laser")
+        if frame[0] == 0x3F: # ASCII ?, an error code
+            return LaserCommandError(Laser.get_error_code_description(frame))
+        try:
+            return parse(frame)
+        except ValueError:
+            return LaserCommandError("Unexpected response from the laser: " + repr(bytes(frame)))
+    return parse_reply
+
+def _parse_flag(frame):
+    """Returns True if a reply is 1 (e.g. EN? on an armed laser)."""
+    return frame[0] == 0x31 # ASCII 1
+
+def _parse_str(frame):
+    """Decodes a text reply (such as the ID), without its \r terminator."""
+    return bytes(frame).rstrip(b"\r").decode("ascii")
+
+_INT_REPLY = _reply_parser(parse_int)
+_FLOAT_REPLY = _reply_parser(parse_float)
+_FLAG_REPLY = _reply_parser(_parse_flag)
+_STR_REPLY = _reply_parser(_parse_str)
+_STATUS_REPLY = _reply_parser(lambda frame: LaserStatusResponse(bytes(frame))) # interned by the reply bytes, so an unchanged status is the same object
+
+# Readings returned by Laser.get_telemetry(): name, query and reply parser, sent in this order in one batch
+_TELEMETRY = (("status", "SS?", _STATUS_REPLY),
+              ("fet_temp", "FT?", _FLOAT_REPLY),
+              ("resonator_temp", "TR?", _FLOAT_REPLY),
+              ("fet_voltage", "FV?", _FLOAT_REPLY),
+              ("diode_current", "IM?", _FLOAT_REPLY),
+              ("bank_voltage", "BV?", _FLOAT_REPLY),
+              ("shot_count", "SC?", _INT_REPLY))
+
 class LaserFireError(Exception):
     pass
 
 class KickerError(Exception):
     pass
 
-class LaserStatusResponse():
-    """This class is used to manipulate the SS? command and turn it into useful variables"""
-    def __init__(self, response):
-        """Parses the response string into a new LaserStatusResponseObject"""
+def _status_flag(bit, doc):
+    """Returns a read-only property that decodes one bit of the status word."""
+    return property(lambda self: bool(self & bit), doc=doc)
 
-        i = int(response) # slice off the \r at the end
-        self.laser_enabled = bool(i & 1)
-        self.laser_active = bool(i & 2)
-        self.diode_external_trigger = bool(i & 8)
-        self.external_interlock = bool(i & 64)
-        self.resonator_over_temp = bool(i & 128)
-        self.electrical_over_temp = bool(i & 256)
-        self.power_failure = bool(i & 512)
-        self.ready_to_enable = bool(i & 1024)
-        self.ready_to_fire = bool(i & 2048)
-        self.low_power_mode = bool(i & 4096)
-        self.high_power_mode = bool(i & 8192)
-
-    def __int__(self):
-        """Returns an integer representation of the laser status. Should be an ASCII number as shown in the user manual."""
-        i = 0
-        if self.laser_enabled:
-            i += 1
-        if self.laser_active:
-            i += 2
-        if self.diode_external_trigger:
-            i += 8
-        if self.external_interlock:
-            i += 64
-        if self.resonator_over_temp:
-            i += 128
-        if self.electrical_over_temp:
-            i += 256
-        if self.power_failure:
-            i += 512
-        if self.ready_to_enable:
-            i += 1024
-        if self.ready_to_fire:
-            i += 2048
-        if self.low_power_mode:
-            i += 4096
-        if self.high_power_mode:
-            i += 8192
-
-        return i
+class LaserStatusResponse(int):
+    """
+    This class is used to manipulate the SS? command and turn it into useful variables
+
+    The status is the 16 bit status word itself, an immutable int, and each flag is decoded from it only when it is read.
+    Identical status words are interned, so polling a laser whose status isn't changing doesn't create any new objects.
+    """
+    __slots__ = ()
+    _interned = {} # response (bytes, str or int) -> LaserStatusResponse
+
+    def __new__(cls, response):
+        """Parses the response string into a new LaserStatusResponseObject"""
+        try:
+            return cls._interned[response]
+        except (KeyError, TypeError): # TypeError: unhashable responses, such as a bytearray
+            pass
+
+        i = int(response) # int() ignores the \r at the end
+        status = cls._interned.get(i)
+        if status is None:
+            status = int.__new__(cls, i)
+        if 0 <= i <= 0xFFFF and len(cls._interned) < 4096: # only real status words, and a bounded number of ways of writing them
+            cls._interned[i] = status
+            try:
+                cls._interned[response] = status
+            except TypeError:
+                pass
+        return status
+
+    laser_enabled = _status_flag(1, "Laser is enabled (armed)")
+    laser_active = _status_flag(2, "Laser is firing")
+    diode_external_trigger = _status_flag(8, "Diode is triggered externally")
+    external_interlock = _status_flag(64, "External interlock is disconnected")
+    resonator_over_temp = _status_flag(128, "Resonator is over temperature")
+    electrical_over_temp = _status_flag(256, "Electronics are over temperature")
+    power_failure = _status_flag(512, "Power failure")
+    ready_to_enable = _status_flag(1024, "Laser is ready to be enabled")
+    ready_to_fire = _status_flag(2048, "Laser is ready to fire")
+    low_power_mode = _status_flag(4096, "Low power (energy) mode is selected")
+    high_power_mode = _status_flag(8192, "High power (energy) mode is selected")
+
+    def __reduce__(self):
+        return (LaserStatusResponse, (int(self),))
+
+    def __bool__(self):
+        """A status is always true, like the status object before it was an int, even when no flag is set (a status word of 0)."""
+        return True
+
+    def __repr__(self):
+        return "LaserStatusResponse(" + int.__repr__(self) + ")"
 
     def __str__(self):
         """Returns a status print out in human-readable format."""
@@ -76,6 +145,32 @@ class LaserStatusResponse():
 
         s += "Ready to fire: " + str(self.ready_to_fire) + "\n"
         s += "Ready to enable: " + str(self.ready_to_enable) + "\n"
+        return s
+
+
+class LaserSettings():
+    """
+    The settings staged by a Laser.settings() transaction.
+
+    Reading an attribute returns the staged value, or the laser's current value if it has not been staged. Assigning an attribute
+    validates the value and stages it, nothing is sent to the laser until the transaction ends.
+    """
+    def __init__(self, laser):
+        object.__setattr__(self, "_laser", laser)
+        object.__setattr__(self, "_staged", {})
+        object.__setattr__(self, "sent", []) # the commands sent when the transaction was committed
+
+    def __getattr__(self, name):
+        if name in self._staged:
+            return self._staged[name]
+        if name in Laser.SETTINGS:
+            return getattr(self._laser, name)
+        raise AttributeError("Unknown laser setting: " + name)
+
+    def __setattr__(self, name, value):
+        if name not in Laser.SETTINGS:
+            raise AttributeError("Unknown laser setting: " + name)
+        self._staged[name] = self._laser._validate_setting(name, value)
 
 
 class Laser:
@@ -90,8 +185,38 @@ class Laser:
     SINGLE_SHOT = 1
     BURST = 2
 
-    def __init__(self, pulseMode = 0, pulsePeriod = 0, repRate = 1, burstCount = 10, diodeCurrent = .1, energyMode = 0, pulseWidth = 10, diodeTrigger = 0):
+    # Constants for the response reader used by _send_command
+    SLEEP_READER = 0    # Sleep a fixed 10 ms after every write, then block in read_until
+    EVENT_READER = 1    # Wait on the port's file descriptor (or in_waiting) and return as soon as a full frame arrives
+
+    # Laser attribute and command keyword of every setting in upload order, and the command keywords the firmware reports limits
+    # for, see ujlaser.settings
+    SETTINGS = SETTINGS
+    LIMITS = LIMITS
+    _LIMITED_SETTINGS = LIMITED_SETTINGS
+
+    # Bounds (in seconds) on how often fire_thread polls the status while the laser is firing
+    FIRE_POLL_MIN = .01
+    FIRE_POLL_MAX = .5
+
+    def __init__(self, pulseMode = 0, pulsePeriod = 0, repRate = 1, burstCount = 10, diodeCurrent = .1, energyMode = 0, pulseWidth = 10, diodeTrigger = 0, readMode = 0, pipelined = False, ioThread = False, statusMaxAge = 0, keepaliveInterval = 1, scheduler = None, metrics = False, clock = None):
+        if not readMode in (self.SLEEP_READER, self.EVENT_READER):
+            raise ValueError("Invalid value for read mode! Laser.SLEEP_READER or Laser.EVENT_READER are accepted values.")
+
         self._ser = None
+        self.readMode = readMode
+        self.pipelined = pipelined # when True, _send_commands writes a whole batch of commands at once instead of one round trip per command
+        self.ioThread = ioThread # when True, a single I/O thread owns the serial port and every other thread submits commands to it through a queue
+        self._io_queue = queue.Queue()
+        self._io_thread = None
+        self._io_thread_lock = thread.Lock()
+        self.statusMaxAge = statusMaxAge # seconds a get_status() result may be reused for, 0 disables the status cache
+        self._status_lock = thread.Lock()
+        self._status_cache = None # (time the SS? was sent, LaserStatusResponse)
+        self._status_inflight = None # Future of the SS? query currently on the wire, shared by concurrent get_status() callers
+        self._status_generation = 0 # bumped whenever the cached status is invalidated
+        self._framer = ResponseFramer() # receive buffer of the event reader
+        self.metrics = LaserMetrics() if metrics else None # None when metrics are disabled, see get_metrics()
         self.pulseMode = pulseMode # NOTE: Pulse mode 0 = continuous is actually implemented as 2 = burst mode in this code.
         self.pulsePeriod = pulsePeriod
         self.repRate = repRate          # NOTE: The default repitition rate for the laser is 1 Hz not 10 Hz (10 is out of bounds aswell)
@@ -101,11 +226,20 @@ class Laser:
         self.pulseWidth = pulseWidth
         self.diodeTrigger = diodeTrigger
         self.burstDuration = burstCount/repRate
+        self._shadow = {} # last value of each setting the laser confirmed with OK, settings missing from it are unknown
+        self._limits = {} # (minimum, maximum) reported by the connected laser for each of Laser.LIMITS that has been read
+        self._id_reply = None # the laser's reply to ID?, what _resync() waits for
+        self._desynced = False # set when a reply didn't arrive in time, the link is resynchronised before the next write
 
         self.emergencyStopActive = False
-        self._kicker_status = None
+        self.keepaliveInterval = keepaliveInterval # the kicker never lets the serial line stay quiet for longer than this many seconds, 0 disables the kicker.
+                                                   # On by default, so shots of 3s or more aren't ended by the laser's communications safety timeout
+        self.clock = clock if clock is not None else Clock() # what the timing loops sleep and wait on, a VirtualClock runs them in simulated time
+        self._scheduler = scheduler # PeriodicScheduler the kicker runs on, None gives this Laser a scheduler thread of its own while connected
+        self._owns_scheduler = False
         self._kicker_active = False
-        self._kicker_request_status = False
+        self._kicker_job = None
+        self._last_traffic = 0 # self.clock.monotonic() of the last command written to the laser
         self._startup = True
         self._threads = []
         self._lock = thread.Lock() # this lock will be acquired every time the serial port is accessed.
@@ -113,6 +247,10 @@ class Laser:
         self.connected = False
         self._fireThread = None
         self.fire_threads = []
+        self.fireThread = None
+        self.fireError = None # the exception that ended the last fire_thread, None if it ran to completion
+        self.fire_polls = 0 # number of status polls fire_thread has made, for measuring bus load
+        self.fireStop = thread.Event() # set by emergency_stop(), whatever is timing a shot (fire_thread, a Campaign) waits on it
 
     def editConstants(self, pulseMode = 0, pulsePeriod = 0, repRate = 1, burstCount = 10, diodeCurrent = .1, energyMode = 0, pulseWidth = 10,  diodeTrigger = 0):
         """
@@ -146,90 +284,75 @@ class Laser:
         self.pulseWidth = pulseWidth
         self.diodeTrigger = diodeTrigger
         self.burstDuration = burstCount/repRate
-        self._kicker_status = None
         self.update_settings()
 
-    """
-    def _kicker(self):  # queries for status every second in order to kick the laser's communications safety timeout on shots >= 3s
-        #Queries for status every second in order to kick the laser's communications safety timeout on shots >= 3s
-        while True:
-            if self._kicker_active == False:                             # If kicker thread needs to be terminated, this will exit the thread
-                break
-            if self._kicker_request_status:                         # If a kicker status is requested, save them to a variable to be used in main code
-                self._kicker_status = self._send_command('SS?')
-            else:
-                self._kicker_status = None                                  # Don't keep old kicker values
-            time.sleep(.5)
-    """
+    def _kicker(self):
+        """
+        Periodic job that keeps the laser's communications safety timeout from ending shots of 3s or more.
+
+        The job runs every half keepaliveInterval and only sends a keepalive SS? when nothing else has been written for at least that
+        long, so the kicker adds no traffic while other commands are flowing. The status it receives goes into the status cache used
+        by get_status().
+        """
+        if self.clock.monotonic() - self._last_traffic >= self.keepaliveInterval / 2:
+            self._query_status()
 
     def fire_thread(self):
-        """This thread handles time keeping for how long the laser takes to fire"""
-        # This class has been optimized to handle instances where emergency stop command has been sent during firing
-        if self.pulseMode == self.CONTINUOUS:
-            timer_start = time.time()
-            while (time.time() - timer_start) <= (self.pulsePeriod):
-                status = self.get_status()      #TODO: Does Python have automatic garbage collection for all these objects?
+        """
+        This thread handles time keeping for how long the laser takes to fire.
+
+        The expected end of the shot is known from the pulse mode, pulse period, repetition rate and burst duration, so the status is
+        polled sparsely while the end is far off and more often as it gets close. The thread stops early if the laser reports that it
+        has finished firing, or as soon as emergency_stop() is called.
+        """
+        try:
+            clock = self.clock
+            end = clock.monotonic() + self._expected_fire_duration()
+            while True:
+                remaining = end - clock.monotonic()
+                if remaining <= 0:
+                    break
+                if clock.wait(self.fireStop, self._next_fire_poll(remaining)): # emergency stop
+                    break
+                status = self.get_status()
+                self.fire_polls += 1
                 if status.laser_active:
                     continue
                 elif not status.laser_enabled:
                     raise LaserFireError("Laser has become disabled")
                 elif not status.ready_to_fire:
                     raise LaserFireError("Laser is not armed")
-                elif not status.low_power_mode or not status.high_power_mode:
-                    raise LaserFireError("Laser is not in a proper power state")
-                else:
-                    raise LaserFireError("Laser in unexpected state")
-                time.sleep(.1)                  # Check every .1 seconds (Feel free to tune this as you see fit)
-        
+                break # the laser has finished firing on its own
+
+            if not self.emergencyStopActive:
+                self._send_command('FL 0')
+        except Exception as e:
+            self.fireError = e # for whoever waits on the thread, such as the ujlaser fire command
+            raise
+        finally:
+            if self.fireThread in self._threads:
+                self._threads.pop(self._threads.index(self.fireThread))
+
+    def _expected_fire_duration(self):
+        """Returns how long (in seconds) the laser is expected to fire for with the current settings."""
+        if self.pulseMode == self.CONTINUOUS:
+            return self.pulsePeriod
         elif self.pulseMode == self.SINGLE_SHOT:
-            timer_start = time.time()
-            while (time.time() - timer_start) <= (1 / self.repRate):
-                status = self.get_status()      #TODO: Does Python have automatic garbage collection for all these objects?
-                if status.laser_active:
-                    continue
-                elif not status.laser_enabled:
-                    raise LaserFireError("Laser has become disabled")
-                elif not status.ready_to_fire:
-                    raise LaserFireError("Laser is not armed")
-                elif not status.low_power_mode or not status.high_power_mode:
-                    raise LaserFireError("Laser is not in a proper power state")
-                else:
-                    raise LaserFireError("Laser in unexpected state")
-                #time.sleep(.01)
-                # No time.sleep since this will be an under 1 second operation
-
-        elif self.pulseMode == self.BURST:
-            timer_start = time.time()
-            while (time.time() - timer_start) <= (self.burstDuration):
-                status = self.get_status()      #TODO: Does Python have automatic garbage collection for all these objects?
-                if status.laser_active:
-                    continue
-                elif not status.laser_enabled:
-                    raise LaserFireError("Laser has become disabled")
-                elif not status.ready_to_fire:
-                    raise LaserFireError("Laser is not armed")
-                elif not status.low_power_mode or not status.high_power_mode:
-                    raise LaserFireError("Laser is not in a proper power state")
-                else:
-                    raise LaserFireError("Laser in unexpected state")
-                time.sleep(.1)                  # Check every .1 seconds (Feel free to tune this as you see fit)
-
-        if not self.emergencyStopActive:
-            self._send_command('FL 0')
-        
-        if self.fireThread in self._threads:
-            self._threads.pop(self._threads.index(self.fireThread))
+            return 1 / self.repRate
+        return self.burstDuration
+
+    def _next_fire_poll(self, remaining):
+        """Returns the delay before the next status poll of fire_thread, given the time remaining until the expected end of the shot."""
+        return min(remaining, self.FIRE_POLL_MAX, max(self.FIRE_POLL_MIN, remaining / 4)) # never sleep past the expected end
 
     def laser_refresh(self):
         """This function is called by the connect function whenever the user declares he wants the class variables to be reset upon connecting"""
         self.editConstants()
         self._startup = True
         self._threads = []
-        self._lock = thread.Lock() # this lock will be acquired every time the serial port is accessed.
         self._device_address = "LA"
-        self.connected = False
 
-    def _send_command(self, cmd):
+    def _send_command(self, cmd, parse=None):
         """
         Sends command to laser
 
@@ -237,6 +360,9 @@ class Laser:
         ----------
         cmd : string
             This contains the ASCII of the command to be sent. Should not include the prefix, address, delimiter, or terminator
+        parse : callable
+            Called with the response frame (a memoryview into the receive buffer, or None if the read timed out) while the port is
+            still owned, its result is returned instead of the response bytes. It must not keep the frame, and must not raise.
 
         Returns
         ----------
@@ -249,15 +375,312 @@ class Laser:
         if not self.connected:
             raise ConnectionError("Not connected to a serial port. Please call connect() before issuing any commands!")
 
-        # Form the complete command string, in order this is: prefix, address, delimiter, command, and terminator
-        cmd_complete = ";" + self._device_address + ":" + cmd + "\r"
+        if self.ioThread:
+            return self._submit([cmd], True, parse).result()
 
-        with self._lock: # make sure we're the only ones on the serial line
-            self._ser.write(cmd_complete.encode("ascii")) # write the complete command to the serial device
-            time.sleep(0.01)
-            response = self._ser.read_until("\r") # laser returns with <CR> = \r Note that this may timeout and return None
+        return self._locked_transact([cmd], parse)[0] # make sure we're the only ones on the serial line
 
-        return response
+    def _query(self, cmd, parse):
+        """
+        Sends a query and parses its reply straight out of the receive buffer.
+
+        Parameters
+        ----------
+        cmd : string
+            The query to send, in the same format accepted by _send_command
+        parse : callable
+            Turns the reply frame into a value, a parser wrapped by _reply_parser such as _FLOAT_REPLY.
+
+        Returns
+        ----------
+        value :
+            The parsed reply. Error replies (?1 to ?8), timeouts and malformed replies raise a LaserCommandError.
+        """
+        result = self._send_command(cmd, parse)
+        if isinstance(result, LaserCommandError):
+            raise result
+        return result
+
+    def _send_commands(self, cmds, pipelined=None):
+        """
+        Sends a batch of commands to the laser. In pipelined mode every command frame is written in a single write and the in-order replies are then matched back to each command, otherwise the commands are sent one at a time.
+
+        Parameters
+        ----------
+        cmds : list
+            A list of ASCII command strings, in the same format accepted by _send_command
+        pipelined : bool
+            Overrides self.pipelined for this batch
+
+        Returns
+        ----------
+        responses : list
+            The binary response for each command, in the same order as cmds. Error codes (?1 to ?8) are returned for the individual command that caused them. Empty commands are not sent and get a response of None.
+        """
+        if not (self.pipelined if pipelined is None else pipelined):
+            return [self._send_command(cmd) for cmd in cmds]
+
+        if not self.connected:
+            raise ConnectionError("Not connected to a serial port. Please call connect() before issuing any commands!")
+
+        if self.ioThread:
+            return self._submit(cmds, False, None).result()
+
+        return self._locked_transact(cmds)
+
+    def send_commands(self, cmds):
+        """
+        Sends a batch of commands in one pipelined write and waits for every reply.
+
+        Parameters
+        ----------
+        cmds : list
+            ASCII command strings without the address prefix or terminator, such as "BC 20" or "FT?"
+
+        Returns
+        ----------
+        responses : list
+            The binary reply to each command, in the same order as cmds. A command the laser refused gets its error code (?1 to ?8),
+            a command that wasn't answered before the timeout gets None.
+        """
+        return self._send_commands(cmds, pipelined=True)
+
+    def submit_command(self, cmd):
+        """
+        Queues a command for the laser without waiting for its response.
+
+        Parameters
+        ----------
+        cmd : string
+            The ASCII command to be sent, in the same format accepted by _send_command
+
+        Returns
+        ----------
+        future : concurrent.futures.Future
+            Completes with the binary response to the command. When the I/O thread is not enabled the command is sent right away and the returned future is already complete.
+        """
+        if not self.connected:
+            raise ConnectionError("Not connected to a serial port. Please call connect() before issuing any commands!")
+
+        if self.ioThread:
+            return self._submit([cmd], True, None)
+
+        future = _new_future()
+        try:
+            future.set_result(self._send_command(cmd))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _submit(self, cmds, single, parse):
+        """Puts a request on the I/O thread's queue, starting the thread if needed. The future completes with one response if single is True, otherwise with the list of responses. parse is applied to every response, see _send_command."""
+        future = _new_future()
+        with self._io_thread_lock: # disconnect() clears connected under this lock, so nothing is queued behind the thread's stop request
+            if not self.connected:
+                raise ConnectionError("Not connected to a serial port. Please call connect() before issuing any commands!")
+            if self._io_thread is None:
+                self._io_thread = thread.Thread(target=self._io_worker, name="ujlaser-io", daemon=True)
+                self._io_thread.start()
+            self._io_queue.put((cmds, single, future, parse))
+        return future
+
+    def _io_worker(self):
+        """
+        Body of the I/O thread. Takes requests off the queue and completes their futures until it receives None.
+        In pipelined mode every request waiting in the queue is written in a single batch.
+        """
+        io_queue = self._io_queue
+        running = True
+        while running:
+            request = io_queue.get()
+            if request is None:
+                break
+            batch = [request]
+            if self.pipelined:
+                while True:
+                    try:
+                        request = io_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is None:
+                        running = False
+                        break
+                    batch.append(request)
+
+            cmds = [cmd for request in batch for cmd in request[0]]
+            parsers = [request[3] for request in batch for _ in request[0]]
+            try:
+                # the lock is uncontended, but keeps connect() and disconnect() from pulling the port out from under us
+                responses = self._locked_transact(cmds, parsers)
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            i = 0
+            for request_cmds, single, future, _ in batch:
+                n = len(request_cmds)
+                future.set_result(responses[i] if single else responses[i:i + n])
+                i += n
+
+        # Fail anything that was queued after we were told to stop
+        while True:
+            try:
+                request = io_queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request[2].set_exception(ConnectionError("Serial port was disconnected"))
+
+    def _stop_io_thread(self):
+        """Stops the I/O thread once it has finished every request queued before this call."""
+        with self._io_thread_lock:
+            if self._io_thread is None:
+                return
+            self._io_queue.put(None)
+            if self._io_thread is not thread.current_thread():
+                self._io_thread.join()
+            self._io_thread = None
+
+    def _locked_transact(self, cmds, parse=None):
+        """Runs _transact while holding self._lock. With metrics enabled, also records how long the lock was waited for and held."""
+        metrics = self.metrics
+        if metrics is None:
+            with self._lock:
+                return self._transact(cmds, parse)
+
+        start = time.perf_counter()
+        with self._lock:
+            acquired = time.perf_counter()
+            metrics.lock_wait.observe(acquired - start)
+            try:
+                return self._transact(cmds, parse)
+            finally:
+                metrics.lock_hold.observe(time.perf_counter() - acquired)
+
+    def _transact(self, cmds, parse=None):
+        """
+        Writes every command frame in a single write, then reads one response per command. The caller must own the serial port,
+        either by holding self._lock or by being the I/O thread. Empty commands are not sent and get a response of None.
+
+        parse is applied to every response frame (see _send_command), or may be a list with a parser (or None) for each command.
+        Without one the response is returned as bytes.
+        """
+        frames = b"".join(self._frame_command(cmd) for cmd in cmds if len(cmd) != 0)
+        if len(frames) == 0:
+            return [None] * len(cmds)
+        if self._desynced:
+            self._resync()
+
+        for cmd in cmds:
+            if cmd[:2] in _STATE_CHANGING_COMMANDS and not "?" in cmd:
+                self._invalidate_status()
+                break
+
+        self._ser.write(frames) # write the complete commands to the serial device
+        self._last_traffic = self.clock.monotonic()
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.bytes_written += len(frames)
+            sent = time.perf_counter()
+        if self.readMode == self.SLEEP_READER:
+            self.clock.sleep(0.01)
+
+        read = self._read_frame_event if self.readMode == self.EVENT_READER else self._read_frame
+        if type(parse) != list:
+            parse = [parse] * len(cmds)
+        responses = []
+        silent = False # the laser answers in order, so once nothing at all arrives for a whole timeout the rest of the batch is lost too
+        for cmd, parser in zip(cmds, parse):
+            if len(cmd) == 0:
+                responses.append(None)
+                continue
+            frame = None if silent else read()
+            if not frame:
+                silent = self._desynced = True
+            if metrics is not None:
+                metrics.observe_reply(cmd, frame, time.perf_counter() - sent)
+            if parser is not None:
+                responses.append(parser(frame))
+            else:
+                responses.append(frame if frame is None or type(frame) == bytes else bytes(frame))
+        return responses
+
+    def _resync(self):
+        """
+        Called before the next write once a reply has not arrived in time. Replies are matched to commands by order, so a late reply
+        would be taken for the reply to the next command. Drops whatever has been received, then sends ID? and drops every frame up
+        to its reply (or, if the laser's ID isn't known, until a read times out). Must be called with the serial port owned, see _transact.
+        """
+        self._desynced = False
+        self._framer.clear()
+        reset_input_buffer = getattr(self._ser, "reset_input_buffer", None)
+        if reset_input_buffer is not None:
+            reset_input_buffer()
+
+        if self._id_reply is not None:
+            self._ser.write(self._frame_command("ID?"))
+            self._last_traffic = self.clock.monotonic()
+        while True:
+            frame = self._read_frame()
+            if not frame:
+                self._desynced = self._id_reply is not None # the ID? went unanswered too, try again before the next write
+                return
+            if self._id_reply is not None and bytes(frame) == self._id_reply:
+                return
+
+    def _frame_command(self, cmd):
+        """Forms the complete command frame, in order this is: prefix, address, delimiter, command, and terminator"""
+        return (";" + self._device_address + ":" + cmd + "\r").encode("ascii")
+
+    def _read_frame(self):
+        """Reads the next response frame with the selected reader, as bytes or a memoryview. Must be called with self._lock held."""
+        if self.readMode == self.EVENT_READER:
+            return self._read_frame_event()
+        return self._ser.read_until(b"\r") # laser returns with <CR> = \r Note that this may timeout and return None
+
+    def _read_frame_event(self):
+        """
+        Reads a single \r terminated frame from the serial port without any fixed delay.
+        Blocks on the port's file descriptor when it has one, otherwise polls in_waiting. Must be called with self._lock held.
+
+        Returns
+        ----------
+        response : memoryview
+            The frame received from the laser, including the '\r' terminator, as a view into the receive buffer that is only valid
+            until the next read. If the port's timeout expires first, whatever was received is returned (None if nothing was).
+        """
+        framer = self._framer
+        frame = framer.next_frame() # a reply that arrived with an earlier one needs no waiting at all
+        if frame is not None:
+            return frame
+
+        ser = self._ser
+        deadline = None if ser.timeout is None else time.monotonic() + ser.timeout
+        try:
+            fd = ser.fileno()
+        except (AttributeError, IOError, ValueError): # not every serial-like object is backed by a file descriptor (e.g. FakeSerialLaser)
+            fd = None
+
+        while frame is None:
+
+            waiting = ser.in_waiting
+            if waiting:
+                framer.fill(ser, waiting)
+                frame = framer.next_frame()
+                continue
+
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return framer.take_partial()
+
+            if fd is not None:
+                select.select([fd], [], [], remaining)
+            else:
+                time.sleep(0.0002 if remaining is None else min(0.0002, remaining))
+        return frame
 
     def connect(self, port_number, baud_rate=115200, timeout=1, parity=None, refresh=False):
         """
@@ -265,8 +688,8 @@ class Laser:
 
         Parameters
         ----------
-        port_number : int
-            This is the port number for the laser
+        port_number : str or serial-like object
+            This is the port number for the laser, or an already open serial object (anything with write and read methods, such as FakeSerialLaser.Serial)
 
         baud_rate : int
             Bits per second on serial connection
@@ -279,89 +702,95 @@ class Laser:
 
         """
         with self._lock:
-            #if port_number not in serial.tools.list_ports.comports():
-            #    raise ValueError(f"Error: port {port_number} is not available")
-            
-            if isinstance(port_number,serial.Serial):
-                self._ser = port_number
-            else:
-                self._ser = serial.Serial(port=port_number)
-            
-            if baud_rate and isinstance(baud_rate, int):
-                self._ser.baudrate = baud_rate
-            else:
+            if not baud_rate or not isinstance(baud_rate, int):
                 raise ValueError('Error: baud_rate parameter must be an integer')
-            if timeout and isinstance(timeout, int):
-                self._ser.timeout = timeout
-            else:
+            if not timeout or not isinstance(timeout, int):
                 raise ValueError('Error: timeout parameter must be an integer')
-            if not parity or parity == 'none':
-                self._ser.parity = serial.PARITY_NONE
-            elif parity == 'even':
-                self._ser.parity = serial.PARITY_EVEN
-            elif parity == 'odd':
-                self._ser.parity = serial.PARITY_ODD
-            elif parity == 'mark':
-                self._ser.parity = serial.PARITY_MARK
-            elif parity == 'space':
-                self._ser.parity = serial.PARITY_SPACE
-            else:
+            if parity not in _PARITIES:
                 raise ValueError("Error: parity must be None, \'none\', \'even\', \'odd\', \'mark\', \'space\'")
-            
+
+            if hasattr(port_number, "write") and hasattr(port_number, "read"):
+                self._ser = port_number
+                self._ser.baudrate = baud_rate
+                self._ser.timeout = timeout
+                self._ser.parity = _PARITIES[parity]
+            else: # opened already configured, rather than opened with pyserial's defaults and then reconfigured one setting at a time
+                import serial
+                self._ser = serial.Serial(port=port_number, baudrate=baud_rate, timeout=timeout, parity=_PARITIES[parity])
+
+            self._invalidate_status()
+            self._shadow.clear() # a newly connected laser's settings are unknown
+            self._limits = {}
+            self._id_reply = None
+            self._desynced = False
             self.connected = True            
             
-            if refresh == True:
-                self.laser_refresh()
+        try: # read the laser's limits once per connection, so the setters can check values without a round trip
+            self.get_limits()
+        except (LaserCommandError, ValueError):
+            pass # an unresponsive or unusual laser is only checked against the fixed rules
 
-            if self._startup:  # start kicking the laser's WDT
-                #self._kicker_thread_control(0)
-                self._startup = False
+        if refresh == True: # outside the lock, refreshing sends the settings to the laser
+            self.laser_refresh()
+
+        if self.keepaliveInterval and not self._kicker_active and getattr(self._ser, "keepalive", True) is not False:  # start kicking the laser's WDT, unless the port opts out
+            self._kicker_thread_control(0)
+        self._startup = False
 
     def disconnect(self):
         if not self.connected:
             return
+        with self._io_thread_lock:
+            self.connected = False # from here on commands are refused, rather than starting a new I/O thread
+        if self._kicker_active:
+            self._kicker_thread_control(1)
+        self._stop_io_thread()
         self._ser.close()
-        self.connected = False
         self._ser = None
+        self._framer.clear()
+        self._invalidate_status()
+        self._shadow.clear()
+        self._limits = {}
+        self._id_reply = None
 
-    """
     def _kicker_thread_control(self, action):
-        
-        A control center for the kicker function. This allows for the kicker thread to be started, killed, and restarted.
+        """
+        A control center for the kicker function. This allows for the kicker job to be started, stopped, and restarted on the scheduler.
 
         Parameters
         ----------
         action : int
-            0 = Start new kicker thread, 1 = kill active kicker thread
-
-        time : float
-            Amount of time needed for kicker
+            0 = Start the kicker, 1 = stop the active kicker
 
         Returns
         -------
         response : bool
             Returns True for valid action command. Raises an error otherwise.
-        
+        """
         if action == 0 and self._kicker_active == False:
             self._kicker_active = True
-            self.kicker_thread = thread.Thread(target=self.kicker_thread)
-            self.kicker_thread.start()
-            self._threads.append(self.kicker_thread)
+            if self._scheduler is None: # a keepalive blocked on a dead port must not hold up the keepalives of other lasers
+                self._scheduler = PeriodicScheduler(name="ujlaser-kicker", clock=self.clock)
+                self._owns_scheduler = True
+            self._kicker_job = self._scheduler.schedule(self.keepaliveInterval / 2, self._kicker) # a failed keepalive is simply retried on the next run
             return True
 
         elif action == 1 and self._kicker_active == True:
             self._kicker_active = False
-            self.kicker_thread.join()
-            if self.kicker_thread in self._threads:
-                self._threads.pop(self._threads.index(self.kicker_thread))
+            self._kicker_job.cancel()
+            self._kicker_job = None
+            if self._owns_scheduler:
+                self._scheduler.stop()
+                self._scheduler = None
+                self._owns_scheduler = False
             return True
         
-        elif action != 0 or action != 1:
+        elif action != 0 and action != 1:
             raise KickerError("Invalid parameter")
 
         else:
             raise KickerError("Kicker state does not comply with action command")
-    """
+
     def fire_laser(self):
         """
             Sends commands to laser to have it fire
@@ -384,26 +813,80 @@ class Laser:
             self._send_command('FL 0')  # Aborts if laser fails to fire
             raise LaserCommandError('Laser Failed to Fire')
         else:
+            self.emergencyStopActive = False
+            self.fireStop.clear()
+            self.fireError = None
             self.fireThread = thread.Thread(target=self.fire_thread)
             self.fireThread.start() # Fire thread starts a timer based off of the pulse mode. It'll go through the timer then set Fire Laser to 0. The thread is used so the user can call other commands such as emergency stop.
             self._threads.append(self.fireThread)
 
-    def get_status(self):
+    def get_status(self, max_age=None):
         """
         Obtains the status of the laser
 
+        When the status cache is enabled, a status that was queried less than max_age seconds ago is returned without touching the
+        serial port, and concurrent callers share a single SS? query. Sending EN, FL, EM or RS invalidates the cached status.
+
+        Parameters
+        ----------
+        max_age : float
+            The oldest cached status (in seconds) that is acceptable. Defaults to statusMaxAge, 0 always queries the laser.
+
         Returns
         -------
         status : LaserStatusResponse object
                 Returns a LaserStatusResponse object created from the SS? command's response that is received.
         """
-        response = self._send_command('SS?')
-        response = str(response[:-1].decode('ascii'))
-
-        if response[0] == "?": # Check to see if we got an error instead. NOTE: This originally had len(response) < 5, but I don't see the purpose of this and it causes errors.
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        else:
-            return LaserStatusResponse(response)
+        if max_age is None:
+            max_age = self.statusMaxAge
+        if max_age <= 0:
+            return self._query_status()
+
+        with self._status_lock:
+            cached = self._status_cache
+            if cached is not None and self.clock.monotonic() - cached[0] <= max_age:
+                return cached[1]
+            future = self._status_inflight
+            leader = future is None
+            if leader:
+                future = self._status_inflight = _new_future()
+
+        if not leader: # someone else already has an SS? on the wire, share its result
+            return future.result()
+
+        try:
+            status = self._query_status()
+        except BaseException as e: # even a KeyboardInterrupt must not leave the callers sharing this query waiting forever
+            with self._status_lock:
+                if self._status_inflight is future:
+                    self._status_inflight = None
+            future.set_exception(e if isinstance(e, Exception) else LaserCommandError("Status query was interrupted"))
+            raise
+
+        with self._status_lock:
+            if self._status_inflight is future:
+                self._status_inflight = None
+        future.set_result(status)
+        return status
+
+    def _invalidate_status(self):
+        """Drops the cached status, and detaches any SS? query in flight so that later callers don't share its (now stale) result."""
+        with self._status_lock:
+            self._status_generation += 1
+            self._status_cache = None
+            self._status_inflight = None
+
+    def _query_status(self):
+        """Sends SS? to the laser and parses the response. The result always refreshes the status cache, unless a state changing command was sent in the meantime."""
+        with self._status_lock:
+            generation = self._status_generation
+        sent = self.clock.monotonic()
+
+        status = self._query('SS?', _STATUS_REPLY)
+        with self._status_lock:
+            if generation == self._status_generation: # don't cache a status that a state changing command has made stale
+                self._status_cache = (sent, status)
+        return status
 
     def is_armed(self):
         """
@@ -413,11 +896,7 @@ class Laser:
         armed : boolean
             True if the laser is armed. False if the laser is not armed.
         """
-        response = self._send_command('EN?')
-        if response[:-1] == b"?":
-            raise LaserCommandError(Laser.get_error_code_description(response))
-
-        return response[0] == b'1' # This has been tested on the driver box
+        return self._query('EN?', _FLAG_REPLY) # This has been tested on the driver box
 
     def get_fet_temp(self):
         """
@@ -428,10 +907,7 @@ class Laser:
         fet : float
             Returns the float value of the FET temperature in Celsius.
         """
-        response = self._send_command('FT?')
-        if response[0] == b"?":
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        return float(response[:-1].decode('ascii'))
+        return self._query('FT?', _FLOAT_REPLY)
 
     def get_resonator_temp(self):
         """
@@ -442,10 +918,7 @@ class Laser:
         resonator_temp : float
             Returns the float value of the resonator temperature in Celsius.
         """
-        response = self._send_command('TR?')
-        if response[0] == b"?":
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        return float(response.decode('ascii'))
+        return self._query('TR?', _FLOAT_REPLY)
 
     def get_fet_voltage(self):
         """
@@ -456,10 +929,7 @@ class Laser:
         fet_voltage : float
             Returns the float value of the FET voltage
         """
-        response = self._send_command('FV?')
-        if response[0] == b"?":
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        return float(response.decode('ascii'))    #TODO: All responce[:-4] does is returns b'', what is the purpose of this... It should be returning the actual data, something like responce [:-1] would remove the \r and leave just data
+        return self._query('FV?', _FLOAT_REPLY)
 
     def get_diode_current(self):
         """
@@ -470,10 +940,7 @@ class Laser:
         diode_current : float
             Returns the float value of the diode current
         """
-        response = self._send_command('IM?')
-        if response[0] == b"?":
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        return float(response.decode('ascii'))
+        return self._query('IM?', _FLOAT_REPLY)
 
     def get_bank_voltage(self):
         """
@@ -484,11 +951,7 @@ class Laser:
         bank_voltage : float
             Returns the float value of the laser's bank voltage.
         """
-        response = self._send_command('BV?')
-        if response[0] == b'?':
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        response_str = response.decode('ascii')
-        return float(response_str)
+        return self._query('BV?', _FLOAT_REPLY)
 
     def get_laser_ID(self):
         """
@@ -499,11 +962,7 @@ class Laser:
         ID : str
             Returns a string containing the laser's ID information
         """
-        response = self._send_command('ID?')
-        if response[0] == b'?':
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        response_str = str(response[:-1].decode('ascii'))
-        return response_str
+        return self._query('ID?', _STR_REPLY)
 
     def get_latched_status(self):
         """
@@ -515,11 +974,7 @@ class Laser:
             Returns a string containing the laser's latched status
         """
         #TODO: Not especially sure what this returns. Returns b'0\r' when the remote interlock is in, and returns b'64\r' when the remote interlock is out.
-        response = self._send_command('LS?')
-        if response[0] == b'?':
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        response_str = str(response[:-1].decode('ascii'))
-        return response_str
+        return self._query('LS?', _STR_REPLY)
 
     def get_system_shot_count(self):
         """
@@ -530,11 +985,35 @@ class Laser:
         system_SC : int
             Returns the system shot count since factory build.
         """
-        response = self._send_command('SC?')
-        if response[0] == b'?':
-            raise LaserCommandError(Laser.get_error_code_description(response))
-        response_str = str(response.decode('ascii'))
-        return int(response_str)
+        return self._query('SC?', _INT_REPLY)
+
+    def get_telemetry(self, readings=None):
+        """
+        Reads the status and every reading (SS?, FT?, TR?, FV?, IM?, BV? and SC?) in one pipelined batch, a single round trip.
+
+        Parameters
+        ----------
+        readings : iterable
+            Names of the readings to take, defaults to all of them
+
+        Returns
+        -------
+        telemetry : dict
+            status (a LaserStatusResponse), fet_temp, resonator_temp, fet_voltage, diode_current, bank_voltage and shot_count (the
+            system shot count). A reading the laser answered with an error, or didn't answer, is None.
+        """
+        wanted = _TELEMETRY
+        if readings is not None:
+            readings = set(readings)
+            wanted = [reading for reading in _TELEMETRY if reading[0] in readings]
+            if len(wanted) != len(readings):
+                raise ValueError("Unknown telemetry readings: " + ", ".join(sorted(readings - {name for name, _, _ in wanted})))
+        replies = self._send_commands([query for _, query, _ in wanted], pipelined=True)
+        telemetry = {}
+        for (name, _, parse), reply in zip(wanted, replies):
+            value = parse(reply)
+            telemetry[name] = None if isinstance(value, LaserCommandError) else value
+        return telemetry
 
     def emergency_stop(self):
         """Immediately sends command to laser to stop firing
@@ -545,12 +1024,12 @@ class Laser:
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
         self.emergencyStopActive = True
-        if self.fireThread not in self._threads:    # Checking if fireThread is an active thread
-            response = self._send_command('FL 0')
-            if response == b"OK\r":
-                return True
-            else:
-                raise LaserCommandError(Laser.get_error_code_description(response))
+        self.fireStop.set() # wake up fire_thread, it won't send its own FL 0 now
+        response = self._send_command('FL 0')
+        if response == b"OK\r":
+            return True
+        else:
+            raise LaserCommandError(Laser.get_error_code_description(response))
 
     def arm(self):
         """Sends command to laser to arm. Returns True on nominal response.
@@ -594,12 +1073,11 @@ class Laser:
         valid : bool
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
-        if not mode in (0,1,2) or not type(mode) == int:
-            raise ValueError("Invalid value for pulse mode! 0, 1, or 2 are accepted values.")
+        mode = self._validate_setting("pulseMode", mode)
 
         response = self._send_command("PM " + str(mode))
         if response == b"OK\r":
-            self.pulseMode = mode
+            self._commit_setting("pulseMode", mode)
             return True
         raise LaserCommandError(Laser.get_error_code_description(response))
 
@@ -616,12 +1094,11 @@ class Laser:
         valid : bool
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
-        #TODO: We must find the pulse period MIN and MAX restrictions when we get the laser control box.
-        #TODO: Once found, add these restrictions into the function so we don't send over invalid commands.
-        #TODO: Also, we need to see what the laser's default pulse period is set to.
+        period = self._validate_setting("pulsePeriod", period)
+
         response = self._send_command("PE " + str(period))
         if response == b"OK\r":
-            self.pulsePeriod = float(period)
+            self._commit_setting("pulsePeriod", period)
             return True
         raise LaserCommandError(Laser.get_error_code_description(response))
         
@@ -633,17 +1110,7 @@ class Laser:
         range : tuple
             Item at index 0 is the minimum period, and item at index 1 is the maximum period.
         """
-        min_response = self._send_command("PE:MIN?")
-        if min_response[0] == b"?":
-            raise LaserCommandError(Laser.get_error_code_description(min_response))
-        minimum = float(min_response)
-
-        max_response = self._send_command("PE:MAX?")
-        if max_response[0] == b"?":
-            raise LaserCommandError(Laser.get_error_code_description(max_response))
-        maximum = float(max_response)
-            
-        return (minimum, maximum)
+        return self._get_limit("PE")
 
     def set_diode_trigger(self, trigger):
         """Sets the diode trigger mode. 0 = Software/internal. 1 = Hardware/external trigger. Returns True on nominal response.
@@ -658,12 +1125,11 @@ class Laser:
         valid : bool
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
-        if trigger != 0 and trigger != 1 or not type(trigger) == int:
-            raise ValueError("Invalid value for trigger mode! 0 or 1 are accepted values.")
+        trigger = self._validate_setting("diodeTrigger", trigger)
 
         response = self._send_command("DT " + str(trigger))
         if response == b"OK\r":
-            self.diodeTrigger = trigger
+            self._commit_setting("diodeTrigger", trigger)
             return True
         raise LaserCommandError(Laser.get_error_code_description(response))
 
@@ -680,15 +1146,11 @@ class Laser:
         valid : bool
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
-
-        if type(width) != int and type(width) != float or width <= 0:
-            raise ValueError("Pulse width must be a positive, non-zero number value (no strings)!")
-
-        width = float(width)
+        width = self._validate_setting("pulseWidth", width)
 
         response = self._send_command("DW " + str(width))
         if response == b"OK\r":
-            self.pulseWidth = width
+            self._commit_setting("pulseWidth", width)
             return True
         raise LaserCommandError(Laser.get_error_code_description(response))
 
@@ -705,13 +1167,11 @@ class Laser:
         valid : bool
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
-        if count <= 0 or not type(count) == int:
-            raise ValueError("Burst count must be a positive, non-zero integer!")
+        count = self._validate_setting("burstCount", count)
 
         response = self._send_command("BC " + str(count))
         if response == b"OK\r":
-            self.burstCount = count
-            self.burstDuration = self.burstCount / self.repRate
+            self._commit_setting("burstCount", count)
             return True
         raise LaserCommandError(Laser.get_error_code_description(response))
 
@@ -728,13 +1188,11 @@ class Laser:
         valid : bool
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
-        if not type(rate) == int or rate < 1 or rate > 5:
-            raise ValueError("Laser repetition rate must be a positive integer from 1 to 5!")
+        rate = self._validate_setting("repRate", rate)
 
         response = self._send_command("RR " + str(rate))
         if response == b"OK\r":
-            self.repRate = rate
-            self.burstDuration = self.burstCount / self.repRate
+            self._commit_setting("repRate", rate)
             return True
         raise LaserCommandError(Laser.get_error_code_description(response))
 
@@ -746,16 +1204,55 @@ class Laser:
         range : tuple
             Item at index 0 is the minimum repitition rate, and item at index 1 is the maximum repitition rate.
         """
-        min_response = self._send_command("RR:MIN?")
-        if min_response[0] == b"?":
+        return self._get_limit("RR")
+
+    def get_limits(self, refresh=False):
+        """Returns the minimum and maximum the laser allows for each of Laser.LIMITS.
+
+        The limits are read once per connection, by connect(), in one batch after ID?. If ID? goes unanswered the batch stops
+        there, so a dead link fails after a single timeout. The ID? reply is kept to resynchronise the link after a timeout.
+
+        The limits are cached per connection rather than shared between connections keyed by the ID? string: the ID only names
+        the model and firmware, and two lasers with the same ID may still report different limits.
+
+        Parameters
+        ----------
+        refresh : bool
+            Read the limits from the laser again, even if they are already known.
+
+        Returns
+        -------
+        limits : dict
+            (minimum, maximum) keyed by command keyword. A bound the laser does not report (such as FT:MIN) is None.
+        """
+        if not refresh and all(key in self._limits for key in self.LIMITS):
+            return dict(self._limits)
+
+        responses = self._send_commands(LIMIT_QUERIES, pipelined=True)
+        response = responses[0]
+        if not response or response[:1] == b"?":
+            raise LaserCommandError("No response from the laser" if not response else Laser.get_error_code_description(response))
+        self._id_reply = bytes(response)
+
+        limits = parse_limits(responses)
+        self._limits = dict(limits)
+        return limits
+
+    def _get_limit(self, key):
+        """Returns the (minimum, maximum) of one of Laser.LIMITS, only asking the laser for it if it hasn't been read on this connection."""
+        if key in self._limits and None not in self._limits[key]:
+            return self._limits[key]
+
+        min_response, max_response = self._send_commands([key + ":MIN?", key + ":MAX?"])
+        if min_response[:1] == b"?":
             raise LaserCommandError(Laser.get_error_code_description(min_response))
         minimum = float(min_response)
 
-        max_response = self._send_command("RR:MAX?")
-        if max_response[0] == b"?":
+        if max_response[:1] == b"?":
             raise LaserCommandError(Laser.get_error_code_description(max_response))
         maximum = float(max_response)
-            
+
+        self._limits[key] = (minimum, maximum)
         return (minimum, maximum)
 
     def set_diode_current(self, current):
@@ -771,13 +1268,11 @@ class Laser:
         valid : bool
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
-        if (type(current) != int and type(current) != float) or current <= 0:
-            raise ValueError("Diode current must be a positive, non-zero number!")
+        current = self._validate_setting("diodeCurrent", current)
 
         response = self._send_command("DC " + str(current))
         if response == b"OK\r":
-            self.diodeCurrent = current
-            self.energyMode = 0 # Whenever diode current is adjusted manually, the energy mode is set to manual.
+            self._commit_setting("diodeCurrent", current)
             return True
         raise LaserCommandError(Laser.get_error_code_description(response))
 
@@ -794,15 +1289,11 @@ class Laser:
         valid : bool
             If the command sent to the laser was processed properly, this should show as True. Otherwise an error will be raised.
         """
-        if type(mode) != int:
-            raise ValueError("Energy mode must be an integer!")
-
-        if not mode in (0, 1, 2):
-            raise ValueError("Valid values for energy mode are 0, 1 and 2!")
+        mode = self._validate_setting("energyMode", mode)
 
         response = self._send_command("EM " + str(mode))
         if response == b"OK\r":
-            self.energyMode = mode
+            self._commit_setting("energyMode", mode)
             return True
         raise LaserCommandError(Laser.get_error_code_description(response))
 
@@ -816,6 +1307,7 @@ class Laser:
         """
         responce = self._send_command('RS')
         if responce == b'OK\r':
+            self._shadow.clear() # the laser is back to its own defaults, which may not match ours
             self.editConstants()    # Refreshing all constants back to their default states if response is valid
             return True
         raise LaserCommandError(Laser.get_error_code_description(responce))
@@ -823,42 +1315,123 @@ class Laser:
 
     def update_settings(self):
         # cmd format, ignore brackets => ;[Address]:[Command String][Parameters]\r
-        """Updates laser settings"""
-        cmd_strings = list()
-        cmd_strings.append('RR ' + str(self.repRate))
-        cmd_strings.append('BC ' + str(self.burstCount))
-        cmd_strings.append('DC ' + str(self.diodeCurrent))
-        cmd_strings.append('EM ' + str(self.energyMode))
-        cmd_strings.append('PM ' + str(self.pulseMode))
-        cmd_strings.append('DW ' + str(self.pulseWidth))
-        cmd_strings.append('DT ' + str(self.pulseMode))
-
-        for i in cmd_strings:
-            self._send_command(i)
+        """Uploads the laser settings held by this object (every setting but the pulse period). Only the settings that differ from the
+        last values the laser confirmed are sent.
+
+        Returns
+        -------
+        responses : list
+            The laser's response to each settings command, in the order they were sent. Empty if nothing had changed.
+        """
+        return self._upload_settings(upload_values(self))[1]
+
+    @contextlib.contextmanager
+    def settings(self):
+        """Starts a settings transaction. Settings assigned inside the with block are validated right away and sent together when it
+        ends, in a single write, and only those that differ from the last values the laser confirmed. Nothing is sent if the block
+        raises.
+
+            with laser.settings() as s:
+                s.repRate = 5
+                s.burstCount = 20
+
+        The laser object and the shadow of confirmed values are only updated if the laser answers OK to every command. Otherwise a
+        LaserCommandError is raised and the settings that were sent are treated as unknown, so they are sent again next time.
+
+        Yields
+        ------
+        settings : LaserSettings
+            The staged settings. After the transaction, settings.sent lists the commands that were sent.
+        """
+        staged = LaserSettings(self)
+        yield staged
+        sent, responses = self._upload_settings(staged._staged, pipelined=True, atomic=True)
+        staged.sent.extend(sent)
+
+    def _upload_settings(self, values, pipelined=None, atomic=False):
+        """
+        Sends the settings in values (keyed by Laser attribute name) that differ from the shadow of confirmed values.
+
+        With atomic False, every setting the laser answers OK to is committed. With atomic True, the settings are only committed if
+        the laser answers OK to all of them, and a LaserCommandError is raised otherwise.
+
+        Returns
+        -------
+        result : tuple
+            (commands sent, responses), in the order they were sent.
+        """
+        changed = changed_settings(values, self._shadow)
+        cmds = [setting_command(name, values[name]) for name in changed]
+        if len(cmds) == 0:
+            return [], []
+        responses = self._send_commands(cmds, pipelined)
+
+        if atomic:
+            failed = [(cmd, response) for cmd, response in zip(cmds, responses) if response != b"OK\r"]
+            if failed:
+                for name in changed:
+                    self._shadow.pop(name, None) # the laser may or may not have applied it
+                cmd, response = failed[0]
+                raise LaserCommandError("Settings were not applied, " + cmd + " failed: " + Laser.get_error_code_description(response))
+
+        for name, response in zip(changed, responses):
+            if response == b"OK\r":
+                self._commit_setting(name, values[name])
+        return cmds, responses
+
+    def _validate_setting(self, name, value):
+        """Checks a value for one of the settings in Laser.SETTINGS against the rules and the connected laser's limits. Returns the value as it will be sent, or raises a ValueError."""
+        return validate_setting(name, value, self._limits)
+
+    def _commit_setting(self, name, value):
+        """Records a setting the laser has confirmed, both on this object and in the shadow of confirmed values."""
+        commit_setting(self, name, value)
+
+    # Description of each ?N error code, keyed by N
+    ERROR_CODES = {
+        1: "Command not recognized.",
+        2: "Missing command keyword.",
+        3: "Invalid command keyword.",
+        4: "Missing Parameter",
+        5: "Invalid Parameter",
+        6: "Query only. Command needs a question mark.",
+        7: "Invalid query. Command does not have a query function.",
+        8: "Command unavailable in current system state.",
+    }
+
+    def get_metrics(self):
+        """
+        Returns a snapshot of the command latency, lock contention, traffic and error metrics of this laser.
+
+        Returns
+        -------
+        snapshot : dict
+            Everything LaserMetrics.snapshot() returns, plus fire_polls (the status polls fire_thread has made). None if the Laser was
+            created with metrics=False.
+        """
+        if self.metrics is None:
+            return None
+        snapshot = self.metrics.snapshot()
+        snapshot["fire_polls"] = self.fire_polls
+        return snapshot
 
     @staticmethod
     def get_error_code_description(code):
         """
         A function used to understand what the incoming error from our laser represents
+
+        Parameters
+        ----------
+        code : bytes
+            The laser's error reply, such as b'?5' or b'?5\r' (a str or memoryview works too)
         """
-        if code == b'?1':
-            return "Command not recognized."
-        elif code == b'?2':
-            return "Missing command keyword."
-        elif code == b'?3':
-            return "Invalid command keyword."
-        elif code == b'?4':
-            return "Missing Parameter"
-        elif code == b'?5':
-            return "Invalid Parameter"
-        elif code == b'?6':
-            return "Query only. Command needs a question mark."
-        elif code == b'?7':
-            return "Invalid query. Command does not have a query function."
-        elif code == b'?8':
-            return "Command unavailable in current system state."
-        else:
-            return "Error description not found, response code given: " + str(code)
+        if isinstance(code, str):
+            code = code.encode("ascii", "replace")
+        description = Laser.ERROR_CODES.get(error_code(code))
+        if description is not None:
+            return description
+        return "Error description not found, response code given: " + str(bytes(code) if isinstance(code, memoryview) else code)
 
 def list_available_ports():
+    import serial.tools.list_ports # slow to import, and rarely needed
     return serial.tools.list_ports.comports()
@@ -0,0 +1,127 @@
+"""
+Counters and latency histograms describing where a Laser spends its time on the serial line.
+
+Metrics are recorded by the thread that owns the serial port, while it holds the port lock, so recording never needs a lock of its
+own. Snapshots are taken without locking and may be a few updates behind.
+"""
+import bisect
+
+from ujlaser.framing import error_code
+
+
+class Histogram:
+    """Counts observations (in seconds) into fixed buckets, and keeps their total and maximum."""
+
+    # Upper bounds of the buckets in seconds. Observations above the last bound go into a final overflow bucket.
+    BUCKETS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+    def __init__(self, buckets=None):
+        """
+        Parameters
+        ----------
+        buckets : tuple
+            Increasing upper bounds of the buckets in seconds. Defaults to Histogram.BUCKETS.
+        """
+        self.buckets = tuple(self.BUCKETS if buckets is None else buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Records one observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q quantile (0 to 1), the maximum if it is in the overflow bucket, or None if empty."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and seen > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """Returns the histogram as a dict of plain values."""
+        return {
+            "count": self.count,
+            "sum_s": self.total,
+            "mean_s": self.total / self.count if self.count else None,
+            "max_s": self.max,
+            "p50_s": self.quantile(.5),
+            "p99_s": self.quantile(.99),
+            "buckets_s": self.buckets,
+            "counts": list(self.counts),
+        }
+
+
+class LaserMetrics:
+    """
+    The metrics of one Laser: round trip latency per command keyword, time spent waiting for and holding the port lock, bytes
+    written and read, replies per ?N error code and reads that timed out.
+    """
+    def __init__(self):
+        self.commands = {} # command keyword (e.g. "SS", "RR:MIN") -> Histogram of round trip times
+        self.lock_wait = Histogram()
+        self.lock_hold = Histogram()
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.errors = {code: 0 for code in range(1, 9)} # replies with each ?N error code
+        self.timeouts = 0 # replies that never arrived (or arrived incomplete)
+
+    def observe_reply(self, cmd, frame, seconds):
+        """
+        Records the reply to one command.
+
+        Parameters
+        ----------
+        cmd : string
+            The command, without prefix, address or terminator. Its keyword (the text before any space or ?) names its histogram.
+        frame : bytes or memoryview
+            The reply frame, None if the read timed out
+        seconds : float
+            Time from writing the command (or the batch it was pipelined in) to receiving its reply
+        """
+        if frame is None or len(frame) == 0 or frame[-1] != 0x0D:
+            self.timeouts += 1
+        if frame is not None:
+            self.bytes_read += len(frame)
+            code = error_code(frame)
+            if code:
+                self.errors[code] = self.errors.get(code, 0) + 1
+        keyword = cmd.split(" ", 1)[0].rstrip("?")
+        histogram = self.commands.get(keyword)
+        if histogram is None:
+            histogram = self.commands[keyword] = Histogram()
+        histogram.observe(seconds)
+
+    def reset(self):
+        """Clears every metric."""
+        self.__init__()
+
+    def snapshot(self):
+        """
+        Returns every metric as a dict of plain values, safe to keep or serialize.
+
+        Returns
+        -------
+        snapshot : dict
+            commands (a histogram snapshot per command keyword), lock_wait and lock_hold (histogram snapshots), bytes_written,
+            bytes_read, errors (count per error code) and timeouts.
+        """
+        return {
+            "commands": {keyword: histogram.snapshot() for keyword, histogram in list(self.commands.items())},
+            "lock_wait": self.lock_wait.snapshot(),
+            "lock_hold": self.lock_hold.snapshot(),
+            "bytes_written": self.bytes_written,
+            "bytes_read": self.bytes_read,
+            "errors": dict(self.errors),
+            "timeouts": self.timeouts,
+        }
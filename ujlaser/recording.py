@@ -0,0 +1,325 @@
+"""
+Records what goes over a laser's serial link to a file, and replays recorded sessions to a Laser without the laser.
+
+Record by wrapping the port, from the start of a connection or on a laser that is already connected:
+    l.connect(RecordingSerial(serial.Serial('/dev/ttyUSB0'), 'session.ujlr'))
+    record(l, 'session.ujlr')
+
+Replay by connecting to the recording, and making the same calls in the same order:
+    l.connect(ReplaySerial('session.ujlr'))
+
+connect() reads the laser's limits on every connection, so a session recorded from connect() replays from connect(). The kicker's
+keepalives go out whenever the line has been quiet, so they would land at different points of a recording and of its replay. Both
+ports turn the kicker off (the fire thread's status polls keep the line alive during shots), unless recorded with keepalive=True,
+which records the keepalives like any other command and only replays with strict=False.
+
+A recording file starts with an 8 byte header, then holds one record per session start, write and read. Each record is a 13 byte
+little endian header (kind, time.monotonic_ns() timestamp, payload length) followed by the payload. Records are only ever appended,
+through a buffered file, so recording costs one struct.pack and a memory copy per write and read.
+"""
+import collections
+import struct
+import threading as thread
+import time
+
+from ujlaser.clock import Clock
+
+MAGIC = b"UJLR\x01\x00\x00\x00" # file type and format version
+
+SESSION = ord("S") # a new recording session, the payload is the wall clock time it started at as 8 byte time.time_ns()
+WRITE = ord("W")   # bytes written to the laser
+READ = ord("R")    # bytes read from the laser, timestamped when the read returned
+
+_RECORD = struct.Struct("<BqI")
+_WALL_TIME = struct.Struct("<q")
+
+Record = collections.namedtuple("Record", ["kind", "time_ns", "data"])
+
+class ReplayMismatchError(Exception):
+    pass
+
+
+def read_records(path):
+    """
+    Reads every record of a recording file, oldest first.
+
+    A record cut short at the end of the file, such as the last one written before a crash, is left out.
+
+    Parameters
+    ----------
+    path : str
+        The recording file
+
+    Returns
+    -------
+    records : list
+        Record(kind, time_ns, data) tuples, kind is SESSION, WRITE or READ.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("{} is not a ujlaser recording".format(path))
+    records = []
+    offset = len(MAGIC)
+    end = len(data)
+    while offset + _RECORD.size <= end:
+        kind, time_ns, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if offset + length > end:
+            break
+        records.append(Record(kind, time_ns, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+class RecordingSerial:
+    """
+    Wraps a serial port (or serial-like object), appending everything written to and read from it to a recording file.
+
+    Anything else, such as in_waiting, timeout or fileno(), goes straight to the wrapped port, so a Laser reads it the same way it
+    reads the port itself. Closing the port also closes the recording.
+    """
+    def __init__(self, ser, path, buffer_size=65536, keepalive=False):
+        """
+        Parameters
+        ----------
+        ser : serial.Serial or serial-like object
+            The port to record
+        path : str
+            The recording file. Sessions are appended if it already exists.
+        buffer_size : int
+            Bytes of records kept in memory before they are written to the file
+        keepalive : bool
+            Let a Laser connected through this port run its kicker. The recording then only replays with strict=False.
+        """
+        log = open(path, "ab", buffering=buffer_size)
+        if log.tell() == 0:
+            log.write(MAGIC)
+        log.write(_RECORD.pack(SESSION, time.monotonic_ns(), _WALL_TIME.size) + _WALL_TIME.pack(time.time_ns()))
+        object.__setattr__(self, "_ser", ser)
+        object.__setattr__(self, "_log", log)
+        object.__setattr__(self, "keepalive", keepalive)
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+    def __setattr__(self, name, value): # settings such as timeout and baudrate belong to the wrapped port
+        setattr(self._ser, name, value)
+
+    def _record(self, kind, data):
+        if data:
+            self._log.write(_RECORD.pack(kind, time.monotonic_ns(), len(data)) + data)
+
+    def write(self, data):
+        self._record(WRITE, data)
+        return self._ser.write(data)
+
+    def read(self, size=1):
+        data = self._ser.read(size)
+        self._record(READ, data)
+        return data
+
+    def readinto(self, b):
+        readinto = getattr(self._ser, "readinto", None)
+        if readinto is None:
+            data = self.read(len(b))
+            b[:len(data)] = data
+            return len(data)
+        count = readinto(b)
+        if count:
+            self._record(READ, bytes(b[:count]))
+        return count
+
+    def read_until(self, *args, **kwargs):
+        data = self._ser.read_until(*args, **kwargs)
+        self._record(READ, data)
+        return data
+
+    def readline(self, *args, **kwargs):
+        data = self._ser.readline(*args, **kwargs)
+        self._record(READ, data)
+        return data
+
+    def flush_recording(self):
+        """Writes the buffered records to the file."""
+        self._log.flush()
+
+    def close(self):
+        """Closes the port and the recording."""
+        try:
+            self._ser.close()
+        finally:
+            self._log.close()
+
+def record(laser, path, buffer_size=65536, keepalive=False):
+    """
+    Starts recording the serial link of a connected Laser. The recording stops when the laser is disconnected.
+
+    Unless keepalive is True the laser's kicker is stopped, see RecordingSerial.
+
+    Returns
+    -------
+    ser : RecordingSerial
+        The wrapped port, which is now the laser's port.
+    """
+    with laser._lock:
+        if laser._ser is None:
+            raise ValueError("The laser must be connected before its link can be recorded")
+        laser._ser = RecordingSerial(laser._ser, path, buffer_size, keepalive)
+    if not keepalive and laser._kicker_active:
+        laser._kicker_thread_control(1)
+    return laser._ser
+
+
+class ReplaySerial:
+    """
+    A serial-like object that answers a Laser with the replies of a recorded session.
+
+    Every write must match the next recorded write, which releases the bytes that were read after it in the recording. With
+    realtime=True those bytes arrive as long after the write as they did in the recording, otherwise they arrive at once. Reads
+    honour timeout the same way pyserial does (None waits forever, 0 never waits). A Laser connected to a replay runs no kicker.
+    """
+    keepalive = False
+    def __init__(self, path, session=-1, realtime=True, strict=True, timeout=None, clock=None):
+        """
+        Parameters
+        ----------
+        path : str or list
+            The recording file, or a list of its records (see read_records)
+        session : int
+            Which session of the file to replay, by index (the last one by default)
+        realtime : bool
+            Deliver replies with the recorded timing, instead of as fast as possible
+        strict : bool
+            Raise ReplayMismatchError when a write differs from the recorded one. Otherwise the recorded reply is served anyway.
+        timeout : float
+            Read timeout in seconds, the Laser sets this when it connects
+        clock : ujlaser.clock.Clock
+            What reads wait on, give a VirtualClock to replay the recorded timing in simulated time
+        """
+        records = read_records(path) if isinstance(path, str) else path
+        sessions = [[]]
+        for r in records:
+            if r.kind == SESSION:
+                if sessions[-1]:
+                    sessions.append([])
+            else:
+                sessions[-1].append(r)
+
+        # (bytes written, [(nanoseconds after the write, bytes read), ...]) for every write of the session
+        self._exchanges = collections.deque()
+        for r in sessions[session]:
+            if r.kind == WRITE:
+                written_at = r.time_ns
+                self._exchanges.append((r.data, []))
+            elif r.kind == READ and self._exchanges:
+                self._exchanges[-1][1].append((r.time_ns - written_at, r.data))
+
+        self.realtime = realtime
+        self.strict = strict
+        self.timeout = timeout
+        self.baudrate = None
+        self.parity = None
+        self.clock = clock if clock is not None else Clock()
+        self._rxBuffer = bytearray()
+        self._pending = collections.deque() # (time on self.clock the bytes arrive, bytes) not yet in the receive buffer
+        self._lock = thread.Lock()
+        self._isOpen = True
+
+    @property
+    def is_open(self):
+        return self._isOpen
+
+    @property
+    def remaining(self):
+        """Number of recorded writes that haven't been replayed yet."""
+        return len(self._exchanges)
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._release()
+            return len(self._rxBuffer)
+
+    def open(self):
+        self._isOpen = True
+
+    def close(self):
+        self._isOpen = False
+
+    def reset_input_buffer(self):
+        with self._lock:
+            del self._rxBuffer[:]
+            self._pending.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if not self._exchanges:
+            raise ReplayMismatchError("Write of {!r} after the end of the recording".format(bytes(data)))
+        written, replies = self._exchanges.popleft()
+        if self.strict and bytes(data) != written:
+            raise ReplayMismatchError("Wrote {!r}, the recording has {!r}".format(bytes(data), written))
+        now = self.clock.monotonic()
+        with self._lock:
+            for offset_ns, reply in replies:
+                self._pending.append((now + offset_ns / 1e9 if self.realtime else now, reply))
+            self._release()
+        return len(data)
+
+    def _release(self):
+        """Moves the bytes whose time has come into the receive buffer. Must be called with self._lock held."""
+        pending = self._pending
+        if pending:
+            now = self.clock.monotonic()
+            while pending and pending[0][0] <= now:
+                self._rxBuffer += pending.popleft()[1]
+
+    def _read(self, ready, size):
+        """Waits until ready(buffer) gives the number of bytes to take, or the timeout expires, then takes them."""
+        deadline = None if self.timeout is None else self.clock.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                self._release()
+                n = ready(self._rxBuffer)
+                if n is None:
+                    now = self.clock.monotonic()
+                    remaining = None if deadline is None else deadline - now
+                    if self._pending and (remaining is None or remaining > 0):
+                        wait = self._pending[0][0] - now if remaining is None else min(self._pending[0][0] - now, remaining)
+                    elif self.realtime and remaining is not None and remaining > 0:
+                        wait = remaining # nothing more arrives before the next write, which can't happen while this read blocks
+                    elif remaining is None:
+                        raise ReplayMismatchError("Read with no timeout, and nothing left to arrive before the next write")
+                    else: # timed out, or replaying as fast as possible and nothing more is coming
+                        n = len(self._rxBuffer) if size is None else min(size, len(self._rxBuffer))
+                if n is not None:
+                    data = bytes(self._rxBuffer[:n])
+                    del self._rxBuffer[:n]
+                    return data
+            self.clock.sleep(max(wait, 0))
+
+    def read(self, size=1):
+        return self._read(lambda buffer: size if len(buffer) >= size else None, size)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def read_until(self, expected=b"\n", size=None):
+        def ready(buffer):
+            end = buffer.find(expected)
+            if end != -1:
+                return end + len(expected) if size is None else min(end + len(expected), size)
+            if size is not None and len(buffer) >= size:
+                return size
+            return None
+        return self._read(ready, size)
+
+    def readline(self, size=None):
+        return self.read_until(b"\n", size)
@@ -2,6 +2,9 @@
 Taken from:
 https://stackoverflow.com/questions/474528/what-is-the-best-way-to-repeatedly-execute-a-function-every-x-seconds#474543
 Allows for a timer to be set every _interval_ seconds to execute a function.
+
+NOTE: This starts a new thread on every tick and drifts by the run time of the function.
+ujlaser.scheduler.PeriodicScheduler runs periodic jobs on a single thread without drifting, and is used by the library instead.
 """
 from threading import Timer
 
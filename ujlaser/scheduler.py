@@ -0,0 +1,174 @@
+"""
+Runs many periodic jobs (keepalives, telemetry, watchdogs) on a single worker thread.
+
+Deadlines are absolute times on the monotonic clock, so a job's period does not drift by how long the job takes to run.
+"""
+import heapq
+import itertools
+import threading as thread
+
+from ujlaser.clock import Clock
+
+
+class PeriodicJob:
+    """A handle on a job added to a PeriodicScheduler. Counts how the job has been running and can cancel it."""
+    def __init__(self, scheduler, interval, function, args, kwargs, overrun):
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.overrun = overrun
+        self.runs = 0       # number of times the job has run
+        self.skipped = 0    # number of runs skipped because the job fell behind (overrun = SKIP)
+        self.errors = 0     # number of runs that raised an exception
+        self.last_error = None
+        self.cancelled = False
+        self._scheduler = scheduler
+
+    def cancel(self):
+        """Stops the job from running again. A run already in progress is allowed to finish."""
+        self._scheduler.cancel(self)
+
+
+class PeriodicScheduler:
+    """
+    Runs periodic jobs on one worker thread, ordered by a heap of absolute monotonic deadlines.
+
+    Jobs share the worker thread, so they should be short. A job that overruns its next deadline is handled by its overrun policy:
+    SKIP drops the missed runs and carries on at the next deadline on the original grid, CATCH_UP runs the missed deadlines back to back.
+    """
+    SKIP = "skip"
+    CATCH_UP = "catch_up"
+
+    def __init__(self, name="ujlaser-scheduler", clock=None):
+        self.name = name
+        self.clock = clock if clock is not None else Clock()
+        self._heap = [] # (deadline, sequence number, job)
+        self._sequence = itertools.count() # breaks ties between equal deadlines so jobs are never compared
+        self._condition = thread.Condition()
+        self._thread = None
+        self._running = False
+
+    def schedule(self, interval, function, *args, overrun=SKIP, start=None, **kwargs):
+        """
+        Adds a job that calls function(*args, **kwargs) every interval seconds.
+
+        Parameters
+        ----------
+        interval : float
+            Period of the job in seconds
+        function : callable
+            The function to call
+        overrun : str
+            PeriodicScheduler.SKIP or PeriodicScheduler.CATCH_UP, what to do when the job falls behind its deadlines
+        start : float
+            Absolute time of the first run on the scheduler's clock (time.monotonic() by default). Defaults to one interval from now.
+
+        Returns
+        -------
+        job : PeriodicJob
+            A handle that can be used to cancel the job.
+        """
+        if interval <= 0:
+            raise ValueError("Job interval must be a positive, non-zero number!")
+        if overrun not in (self.SKIP, self.CATCH_UP):
+            raise ValueError("Overrun policy must be PeriodicScheduler.SKIP or PeriodicScheduler.CATCH_UP")
+
+        job = PeriodicJob(self, interval, function, args, kwargs, overrun)
+        deadline = self.clock.monotonic() + interval if start is None else start
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._sequence), job))
+            if not self._running:
+                self._running = True
+                self._thread = thread.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return job
+
+    def cancel(self, job):
+        """Stops a job from running again."""
+        with self._condition:
+            job.cancelled = True
+            self._heap = [entry for entry in self._heap if entry[2] is not job]
+            heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def stop(self):
+        """
+        Cancels every job and stops the worker thread. Jobs added afterwards start a new worker thread.
+
+        Called from one of the scheduler's own jobs, stop() can't wait for the thread it is running on: the jobs are cancelled, but
+        the worker thread only exits once the calling job returns.
+
+        Returns
+        -------
+        stopped : bool
+            True once the worker thread has exited, False when called from one of the scheduler's own jobs.
+        """
+        with self._condition:
+            for _, _, job in self._heap:
+                job.cancelled = True
+            self._heap = []
+            self._running = False
+            worker = self._thread
+            self._thread = None
+            self._condition.notify()
+        if worker is thread.current_thread():
+            return False
+        if worker is not None:
+            worker.join()
+        return True
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self):
+        """Body of the worker thread."""
+        condition = self._condition
+        clock = self.clock
+        while True:
+            with condition:
+                while True:
+                    if not self._running:
+                        return
+                    if not self._heap:
+                        clock.wait_condition(condition)
+                        continue
+                    deadline, _, job = self._heap[0]
+                    delay = deadline - clock.monotonic()
+                    if delay > 0:
+                        clock.wait_condition(condition, delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    break
+
+            try: # the lock is released while the job runs, so jobs may schedule or cancel jobs
+                job.function(*job.args, **job.kwargs)
+            except Exception as e:
+                job.errors += 1
+                job.last_error = e
+            job.runs += 1
+
+            deadline += job.interval
+            now = clock.monotonic()
+            if deadline <= now and job.overrun == self.SKIP:
+                missed = int((now - deadline) // job.interval) + 1
+                job.skipped += missed
+                deadline += missed * job.interval
+
+            with condition:
+                if self._running and not job.cancelled:
+                    heapq.heappush(self._heap, (deadline, next(self._sequence), job))
+
+
+_default_scheduler = None
+_default_scheduler_lock = thread.Lock()
+
+def get_default_scheduler():
+    """Returns the PeriodicScheduler shared by every Laser and TelemetrySampler that isn't given its own."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = PeriodicScheduler()
+        return _default_scheduler
@@ -0,0 +1,132 @@
+"""
+The laser's settings: the command that sets each one, the checks a value must pass before it is sent, and the bookkeeping of the
+values the laser has confirmed (the shadow registers). Laser and AsyncLaser both go through these functions, so they accept and
+reject exactly the same values.
+"""
+from ujlaser.framing import error_code, parse_float
+
+# Laser attribute and command keyword of every setting, in the order they are uploaded. DC comes before EM because setting the
+# diode current switches the laser to manual energy mode, while the low and high power modes set their own diode current.
+SETTINGS = {
+    "repRate": "RR",
+    "burstCount": "BC",
+    "diodeCurrent": "DC",
+    "energyMode": "EM",
+    "pulseMode": "PM",
+    "pulseWidth": "DW",
+    "diodeTrigger": "DT",
+    "pulsePeriod": "PE",
+}
+
+# Command keywords the firmware reports :MIN? and :MAX? limits for, and the setting each one limits
+LIMITS = ("PE", "RR", "DC", "DW", "FT", "TR")
+LIMITED_SETTINGS = {"pulsePeriod": "PE", "repRate": "RR", "diodeCurrent": "DC", "pulseWidth": "DW"}
+
+# What connect() sends to read the limits: ID? first, so a dead link is noticed before waiting on the rest
+LIMIT_QUERIES = ["ID?"] + [key + bound for key in LIMITS for bound in (":MIN?", ":MAX?")]
+
+
+def validate_setting(name, value, limits=None):
+    """
+    Checks a value for one of the settings in SETTINGS.
+
+    Parameters
+    ----------
+    name : str
+        The setting's Laser attribute name
+    value :
+        The value to check
+    limits : dict
+        (minimum, maximum) reported by the connected laser, keyed by command keyword. Only the limits it holds are checked.
+
+    Returns
+    -------
+    value :
+        The value as it will be sent. Raises a ValueError if it isn't valid.
+    """
+    if name == "pulseMode":
+        if not value in (0,1,2) or not type(value) == int:
+            raise ValueError("Invalid value for pulse mode! 0, 1, or 2 are accepted values.")
+    elif name == "pulsePeriod":
+        if type(value) != int and type(value) != float or value <= 0:
+            raise ValueError("Pulse period must be a positive, non-zero number!")
+        value = float(value)
+    elif name == "diodeTrigger":
+        if value != 0 and value != 1 or not type(value) == int:
+            raise ValueError("Invalid value for trigger mode! 0 or 1 are accepted values.")
+    elif name == "pulseWidth":
+        if type(value) != int and type(value) != float or value <= 0:
+            raise ValueError("Pulse width must be a positive, non-zero number value (no strings)!")
+        value = float(value)
+    elif name == "burstCount":
+        if not type(value) == int or value <= 0:
+            raise ValueError("Burst count must be a positive, non-zero integer!")
+    elif name == "repRate":
+        if not type(value) == int or value < 1 or value > 5:
+            raise ValueError("Laser repetition rate must be a positive integer from 1 to 5!")
+    elif name == "diodeCurrent":
+        if (type(value) != int and type(value) != float) or value <= 0:
+            raise ValueError("Diode current must be a positive, non-zero number!")
+    elif name == "energyMode":
+        if type(value) != int:
+            raise ValueError("Energy mode must be an integer!")
+        if not value in (0, 1, 2):
+            raise ValueError("Valid values for energy mode are 0, 1 and 2!")
+    else:
+        raise ValueError("Unknown laser setting: " + str(name))
+
+    if limits and name in LIMITED_SETTINGS and LIMITED_SETTINGS[name] in limits:
+        minimum, maximum = limits[LIMITED_SETTINGS[name]]
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise ValueError("{} {} is outside of the laser's range of {} to {}!".format(name, value, minimum, maximum))
+    return value
+
+def setting_command(name, value):
+    """Returns the command that sets a setting, such as "RR 5"."""
+    return SETTINGS[name] + " " + str(value)
+
+def upload_values(laser):
+    """Returns the settings update_settings() uploads, keyed by attribute name: every setting but the pulse period, and not the diode
+    current in the low and high energy modes (they set their own, and sending it would switch back to manual mode)."""
+    values = {name: getattr(laser, name) for name in SETTINGS if name != "pulsePeriod"}
+    if laser.energyMode != 0:
+        del values["diodeCurrent"]
+    return values
+
+def changed_settings(values, shadow):
+    """Returns the names of the settings in values that differ from the shadow of values the laser confirmed, in upload order."""
+    return [name for name in SETTINGS if name in values and (name not in shadow or shadow[name] != values[name])]
+
+def commit_setting(laser, name, value):
+    """Records a setting the laser has confirmed, both on the laser object (a Laser or an AsyncLaser) and in its shadow of confirmed values."""
+    shadow = laser._shadow
+    setattr(laser, name, value)
+    shadow[name] = value
+    if name in ("burstCount", "repRate"):
+        laser.burstDuration = laser.burstCount / laser.repRate
+    elif name == "diodeCurrent":
+        laser.energyMode = 0 # Whenever diode current is adjusted manually, the energy mode is set to manual.
+        shadow["energyMode"] = 0
+    elif name == "energyMode" and value != 0:
+        shadow.pop("diodeCurrent", None) # the low and high energy modes choose their own diode current
+
+def parse_limit(response):
+    """Returns the limit in a :MIN? or :MAX? response, or None if the laser did not report one."""
+    if response is None or error_code(response):
+        return None
+    try:
+        return parse_float(response)
+    except ValueError:
+        return None
+
+def parse_limits(responses):
+    """
+    Turns the replies to LIMIT_QUERIES into the laser's limits.
+
+    Returns
+    -------
+    limits : dict
+        (minimum, maximum) keyed by command keyword. A bound the laser does not report (such as FT:MIN) is None.
+    """
+    bounds = [parse_limit(response) for response in responses[1:]]
+    return {key: (bounds[2 * i], bounds[2 * i + 1]) for i, key in enumerate(LIMITS)}
@@ -0,0 +1,195 @@
+import array
+
+from ujlaser.clock import Clock
+from ujlaser.scheduler import PeriodicScheduler, get_default_scheduler
+
+
+class RingBuffer:
+    """
+    A fixed size, preallocated history of (timestamp, value) samples backed by arrays.
+
+    Every sample is stored twice, at index i and at index i + capacity, so that the latest N samples always sit next to each other
+    in memory and can be handed out as memoryview slices without copying.
+    """
+    def __init__(self, capacity, typecode='d'):
+        """
+        Parameters
+        ----------
+        capacity : int
+            The number of samples kept, older samples are overwritten.
+        typecode : str
+            The array typecode used to store values ('d' for floats, 'L' for status words)
+        """
+        if not type(capacity) == int or capacity <= 0:
+            raise ValueError("Ring buffer capacity must be a positive, non-zero integer!")
+        self.capacity = capacity
+        self._times = array.array('d', bytes(2 * capacity * array.array('d').itemsize))
+        self._values = array.array(typecode, bytes(2 * capacity * array.array(typecode).itemsize))
+        self._next = 0 # index in [0, capacity) the next sample is written to
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        """Adds a sample, overwriting the oldest one if the buffer is full."""
+        i = self._next
+        j = i + self.capacity
+        self._times[i] = self._times[j] = timestamp
+        self._values[i] = self._values[j] = value
+        self._next = 0 if i + 1 == self.capacity else i + 1
+        if self._count < self.capacity:
+            self._count += 1
+
+    def latest(self, n=None):
+        """
+        Returns the latest n samples, oldest first, as zero-copy views into the buffer.
+
+        The views keep reflecting the buffer, so they are only stable until the samples they cover are overwritten. Copy them
+        (e.g. with list() or .tolist()) to keep the values around.
+
+        Parameters
+        ----------
+        n : int
+            Number of samples to return. Defaults to every sample in the buffer.
+
+        Returns
+        -------
+        samples : tuple
+            (timestamps, values), two memoryviews of equal length. Timestamps are from the monotonic clock the samples were taken on.
+        """
+        if n is None or n > self._count:
+            n = self._count
+        end = self._next + self.capacity
+        return memoryview(self._times)[end - n:end], memoryview(self._values)[end - n:end]
+
+    def last(self):
+        """Returns the most recent (timestamp, value) sample, or None if the buffer is empty."""
+        if self._count == 0:
+            return None
+        i = self._next + self.capacity - 1
+        return self._times[i], self._values[i]
+
+
+class TelemetrySampler:
+    """
+    Polls a Laser's telemetry channels in the background, each at its own rate, and keeps their history in ring buffers.
+    Reading the history never touches the serial port.
+
+    Sampling is one job on a PeriodicScheduler, ticking at the rate of the fastest channel. Every tick reads the channels that are
+    due in one pipelined batch (Laser.get_telemetry()), so they share a single round trip and a single timestamp. Deadlines are
+    absolute, so a slow sample does not push back the ones after it, and samples missed while the laser was slow to answer are
+    skipped rather than sent in a burst to catch up. Timestamps are from the laser's clock.
+    """
+    # channel name: array typecode, channels are named after the readings of Laser.get_telemetry()
+    CHANNELS = {
+        "status": 'L',
+        "fet_temp": 'd',
+        "resonator_temp": 'd',
+        "fet_voltage": 'd',
+        "diode_current": 'd',
+        "bank_voltage": 'd',
+    }
+
+    # Default sampling rates in Hz
+    DEFAULT_RATES = {"status": 20, "fet_temp": 1, "resonator_temp": 1, "fet_voltage": 1, "diode_current": 1, "bank_voltage": 1}
+
+    def __init__(self, laser, rates=None, history=1024, scheduler=None):
+        """
+        Parameters
+        ----------
+        laser : Laser
+            The connected laser to sample
+        rates : dict
+            Sampling rate in Hz for each channel to sample, keyed by channel name (see TelemetrySampler.CHANNELS). Defaults to DEFAULT_RATES.
+        history : int
+            Number of samples kept for each channel
+        scheduler : PeriodicScheduler
+            The scheduler to sample on. Defaults to the shared scheduler, or to a scheduler of the sampler's own when the laser runs
+            on a simulated clock.
+        """
+        if rates is None:
+            rates = self.DEFAULT_RATES
+        for channel, rate in rates.items():
+            if channel not in self.CHANNELS:
+                raise ValueError("Unknown telemetry channel: " + str(channel))
+            if rate <= 0:
+                raise ValueError("Sampling rate for " + channel + " must be a positive, non-zero number!")
+
+        self.laser = laser
+        self.clock = laser.clock
+        self.rates = dict(rates)
+        self.buffers = {channel: RingBuffer(history, self.CHANNELS[channel]) for channel in rates}
+        self.errors = {channel: 0 for channel in rates} # number of failed samples per channel
+        self._scheduler = scheduler
+        self._own_scheduler = None
+        self._job = None
+        self._due = {} # channel: time on self.clock its next sample is due
+
+    def start(self):
+        """Starts sampling in the background. Every channel takes its first sample right away."""
+        if self._job is not None:
+            return
+        scheduler = self._scheduler
+        if scheduler is None:
+            if type(self.clock) is Clock:
+                scheduler = get_default_scheduler()
+            else: # the ticks have to run on the laser's clock
+                scheduler = self._own_scheduler = PeriodicScheduler(name="ujlaser-telemetry", clock=self.clock)
+        now = scheduler.clock.monotonic()
+        self._due = {channel: now for channel in self.rates}
+        self._job = scheduler.schedule(1 / max(self.rates.values()), self._tick, overrun=PeriodicScheduler.SKIP, start=now)
+
+    def stop(self):
+        """Stops sampling. A sample already being taken is allowed to finish. History is kept."""
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        if self._own_scheduler is not None:
+            self._own_scheduler.stop()
+            self._own_scheduler = None
+
+    def latest(self, channel, n=None):
+        """Returns zero-copy views (timestamps, values) of the latest n samples of a channel, see RingBuffer.latest."""
+        return self.buffers[channel].latest(n)
+
+    def last(self, channel):
+        """Returns the most recent (timestamp, value) sample of a channel, or None if there isn't one yet."""
+        return self.buffers[channel].last()
+
+    def _tick(self):
+        """Scheduler job, samples the channels that are due. A channel is due within half the tick of its deadline."""
+        now = self.clock.monotonic()
+        slack = 0.5 / max(self.rates.values())
+        due = [channel for channel, deadline in self._due.items() if deadline - slack <= now]
+        for channel in due:
+            deadline = self._due[channel] + 1 / self.rates[channel]
+            self._due[channel] = deadline if deadline - slack > now else now + 1 / self.rates[channel] # skip the missed samples
+        if due:
+            self.sample(*due)
+
+    def sample(self, *channels):
+        """
+        Takes one sample of the given channels (every channel by default) right away, in one round trip, and stores them.
+
+        Returns
+        -------
+        values : dict
+            The sampled value of each channel, None for a channel the laser could not be read for.
+        """
+        channels = channels or tuple(self.rates)
+        try:
+            telemetry = self.laser.get_telemetry(channels)
+        except Exception:
+            telemetry = {}
+        timestamp = self.clock.monotonic()
+        values = {}
+        for channel in channels:
+            value = telemetry.get(channel)
+            if value is None:
+                self.errors[channel] += 1
+            else:
+                value = int(value) if channel == "status" else value
+                self.buffers[channel].append(timestamp, value)
+            values[channel] = value
+        return values
@@ -0,0 +1,264 @@
+"""
+A long term, append-only history of a laser's telemetry, kept on disk in memory-mapped segment files.
+
+Every sample is a fixed width 64 byte record: the time (time.time()), the SS? status word, FT, TR, FV, IM, BV and the SC shot count.
+Records are appended to the newest segment file of the store's directory, and a new segment is started once it is full. Each segment
+starts with a small header holding how many records it has and the time of its first and last one, so reads only look at the
+segments that overlap the time range asked for, and find the range within a segment by binary search.
+
+    store = TelemetryStore('/var/lib/ujlaser/laser1')
+    scheduler.schedule(1, store.sample, laser) # one pipelined round trip per sample
+    history = store.read(time.time() - 3600)   # the last hour, as a NumPy structured array
+    history["fet_temp"]
+
+NumPy is optional. Appending and records() work without it, read() and views() need it.
+"""
+import collections
+import math
+import mmap
+import os
+import struct
+import threading as thread
+import time
+
+try:
+    import numpy
+except ImportError: # only read() and views() need NumPy
+    numpy = None
+
+# Field names, in the order of Record
+FIELDS = ("time", "fet_temp", "resonator_temp", "fet_voltage", "diode_current", "bank_voltage", "shot_count", "status")
+
+MISSING_STATUS = 0xFFFFFFFF # stored when the status word couldn't be read, missing readings are NaN and a missing shot count is -1
+
+Record = collections.namedtuple("Record", FIELDS)
+
+_RECORD = struct.Struct("<6dqI4x") # 64 bytes, every field aligned to its size
+_HEADER = struct.Struct("<8sIIQQdd16x") # magic, record size, reserved, capacity, count, first time, last time, padding to 64 bytes
+_HEADER_STATE = struct.Struct("<Qdd") # count, first time, last time, updated after every append
+_HEADER_STATE_OFFSET = 24
+_TIME = struct.Struct("<d")
+_MAGIC = b"UJLTLM\x00\x01"
+
+if numpy is not None:
+    DTYPE = numpy.dtype({"names": list(FIELDS),
+                         "formats": ["<f8"] * 6 + ["<i8", "<u4"],
+                         "offsets": [0, 8, 16, 24, 32, 40, 48, 56],
+                         "itemsize": _RECORD.size})
+
+
+class _Segment:
+    """One memory-mapped segment file: a header followed by room for capacity records."""
+    def __init__(self, path, capacity=None, readonly=False):
+        """Opens the segment at path, or creates it with room for capacity records if capacity is given."""
+        self.path = path
+        if capacity is not None: # written under another name first, so readers never find a segment without its header
+            with open(path + ".new", "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _RECORD.size, 0, capacity, 0, math.nan, math.nan))
+                f.truncate(_HEADER.size + capacity * _RECORD.size) # sparse, the disk fills as records are added
+            os.rename(path + ".new", path)
+        with open(path, "rb" if readonly else "r+b") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        magic, record_size, _, self.capacity, _, _, _ = _HEADER.unpack_from(self.map)
+        if magic != _MAGIC or record_size != _RECORD.size:
+            self.map.close()
+            raise ValueError("{} is not a telemetry segment".format(path))
+        self.refresh()
+
+    def refresh(self):
+        """Reads the number of records and the time range from the header, for segments another process is appending to."""
+        self.count, self.first, self.last = _HEADER_STATE.unpack_from(self.map, _HEADER_STATE_OFFSET)
+
+    def append(self, record):
+        """Writes a record, then updates the header, so a reader never sees a record that isn't complete."""
+        count = self.count
+        self.map[_HEADER.size + count * _RECORD.size:_HEADER.size + (count + 1) * _RECORD.size] = record
+        timestamp = _TIME.unpack_from(record)[0]
+        self.count = count + 1
+        if count == 0:
+            self.first = timestamp
+        self.last = timestamp
+        _HEADER_STATE.pack_into(self.map, _HEADER_STATE_OFFSET, self.count, self.first, self.last)
+
+    def search(self, timestamp):
+        """Returns the index of the first record at or after timestamp."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if _TIME.unpack_from(self.map, _HEADER.size + middle * _RECORD.size)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, start, end):
+        """Returns the (first, last + 1) record indices of the records from start up to (not including) end."""
+        return (0 if start is None else self.search(start)), (self.count if end is None else self.search(end))
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError: # NumPy views are still using the mapping, it is unmapped once they are gone
+            pass
+
+
+class TelemetryStore:
+    """
+    An append-only telemetry history in a directory of memory-mapped segment files, see the module description.
+
+    Timestamps must not go backwards, as reads rely on every segment being sorted by time. A store can be read by other processes
+    while it is written to, by opening it with readonly=True.
+    """
+    def __init__(self, directory, segment_size=64 * 2**20, readonly=False):
+        """
+        Parameters
+        ----------
+        directory : str
+            The directory holding the segment files, created if it doesn't exist
+        segment_size : int
+            Size in bytes of each new segment file. 64 MiB holds about a million records, 12 days of samples every second.
+        readonly : bool
+            Only read the store, for example while another process writes to it
+        """
+        if segment_size < _HEADER.size + _RECORD.size:
+            raise ValueError("Segment size must be at least {} bytes".format(_HEADER.size + _RECORD.size))
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.readonly = readonly
+        self._lock = thread.Lock()
+        self._segments = []
+        self._load_segments()
+
+    def _segment_path(self, index):
+        return os.path.join(self.directory, "segment-{:08d}.ujlt".format(index))
+
+    def _load_segments(self):
+        """Opens segment files that aren't open yet, and re-reads the header of the newest one we already had."""
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("segment-") and name.endswith(".ujlt"))
+        if self._segments:
+            self._segments[-1].refresh()
+        for name in names[len(self._segments):]:
+            self._segments.append(_Segment(os.path.join(self.directory, name), readonly=self.readonly))
+
+    def __len__(self):
+        return sum(segment.count for segment in self._segments)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, timestamp=None, status=None, fet_temp=None, resonator_temp=None, fet_voltage=None, diode_current=None,
+               bank_voltage=None, shot_count=None):
+        """
+        Adds a record. Readings that are None are stored as missing.
+
+        Parameters
+        ----------
+        timestamp : float
+            Seconds since the epoch, time.time() by default. Must not be before the last record's.
+        """
+        if self.readonly:
+            raise ValueError("The telemetry store was opened read only")
+        if timestamp is None:
+            timestamp = time.time()
+        nan = math.nan
+        record = _RECORD.pack(timestamp,
+                              nan if fet_temp is None else fet_temp,
+                              nan if resonator_temp is None else resonator_temp,
+                              nan if fet_voltage is None else fet_voltage,
+                              nan if diode_current is None else diode_current,
+                              nan if bank_voltage is None else bank_voltage,
+                              -1 if shot_count is None else shot_count,
+                              MISSING_STATUS if status is None else int(status))
+        with self._lock:
+            segments = self._segments
+            if segments and segments[-1].count and timestamp < segments[-1].last:
+                raise ValueError("Telemetry timestamps must not go backwards")
+            if not segments or segments[-1].count == segments[-1].capacity:
+                capacity = (self.segment_size - _HEADER.size) // _RECORD.size
+                segments.append(_Segment(self._segment_path(len(segments)), capacity))
+            segments[-1].append(record)
+
+    def sample(self, laser):
+        """
+        Reads SS?, FT?, TR?, FV?, IM?, BV? and SC? from a connected Laser in one pipelined batch (Laser.get_telemetry()) and appends
+        them as a record. Error replies and timeouts are stored as missing readings.
+        """
+        telemetry = laser.get_telemetry()
+        timestamp = time.time()
+        with self._lock:
+            if self._segments and timestamp < self._segments[-1].last: # the wall clock was stepped back, keep the history sorted
+                timestamp = self._segments[-1].last
+        self.append(timestamp, **telemetry)
+
+    def _ranges(self, start, end):
+        """Yields (segment, first index, last index + 1) for every segment with records from start up to (not including) end."""
+        with self._lock:
+            if self.readonly:
+                self._load_segments()
+            segments = list(self._segments)
+        for segment in segments:
+            if segment.count == 0 or (start is not None and segment.last < start) or (end is not None and segment.first >= end):
+                continue
+            first, last = segment.range(start, end)
+            if first < last:
+                yield segment, first, last
+
+    def records(self, start=None, end=None):
+        """
+        Yields the records from start up to (not including) end, oldest first, as Record tuples. Works without NumPy.
+
+        Parameters
+        ----------
+        start, end : float
+            Times in seconds since the epoch. None reads from the first record, or up to the last one.
+        """
+        for segment, first, last in self._ranges(start, end):
+            offset = _HEADER.size + first * _RECORD.size
+            for values in _RECORD.iter_unpack(segment.map[offset:_HEADER.size + last * _RECORD.size]):
+                yield Record._make(values)
+
+    def views(self, start=None, end=None):
+        """
+        Returns the records from start up to (not including) end as zero-copy, read-only NumPy structured arrays, one per segment
+        the range covers. Fields are named as in FIELDS. The arrays read straight from the memory-mapped files.
+        """
+        if numpy is None:
+            raise ImportError("TelemetryStore.views() needs NumPy, use records() without it")
+        views = []
+        for segment, first, last in self._ranges(start, end):
+            view = numpy.frombuffer(segment.map, DTYPE, last - first, _HEADER.size + first * _RECORD.size)
+            view.flags.writeable = False
+            views.append(view)
+        return views
+
+    def read(self, start=None, end=None):
+        """
+        Returns the records from start up to (not including) end as a single NumPy structured array. It is a zero-copy view when the
+        range is within one segment, and a copy when it spans several.
+        """
+        views = self.views(start, end)
+        if len(views) == 1:
+            return views[0]
+        if not views:
+            return numpy.empty(0, DTYPE)
+        return numpy.concatenate(views)
+
+    def flush(self):
+        """Writes the records to disk. Without it, they reach the disk whenever the operating system writes the mapped pages back."""
+        with self._lock:
+            for segment in self._segments:
+                segment.map.flush()
+
+    def close(self):
+        """Flushes (unless read only) and closes every segment."""
+        if not self.readonly:
+            self.flush()
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
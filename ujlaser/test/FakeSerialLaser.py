@@ -1,13 +1,24 @@
 import threading
-import time
+from operator import attrgetter
+
+from ujlaser.clock import Clock
 
 class Serial:
     """
     The Serial class is meant to be used inplace of the Serial() call used in laser_control.
+
+    Responses wait in a byte buffer until they are read, like the receive buffer of a real port. Reads block until enough data
+    has arrived or the timeout expires, with the same timeout semantics as pyserial (None waits forever, 0 never waits).
     """
-    def __init__(self, port=None,baudrate=9600,parity='PARITY_NONE',stopbits='STOPBITS_ONE',timeout=None,xonxoff=False,rtscts=False,write_timeout=None,dsrdtr=False,inter_byte_timeout=None,exclusive=None):
+    def __init__(self, port=None,baudrate=9600,parity='PARITY_NONE',stopbits='STOPBITS_ONE',timeout=None,xonxoff=False,rtscts=False,write_timeout=None,dsrdtr=False,inter_byte_timeout=None,exclusive=None,verbose=True,clock=None):
         """
         NOTE: All these 'serial' values passed through the init are just here for placeholding. I cannot literally emulate something such as a baud rate in this emulator.
+        The exception is timeout, which reads honour the same way pyserial does.
+
+        verbose : bool
+            Print every command received. Turn this off when pushing a lot of commands through the fake.
+        clock : ujlaser.clock.Clock
+            What the arming and firing timers sleep on. Give the same VirtualClock as the Laser to run them in simulated time.
 
         This is where all of the placeholder serial commands and the laser variable _initializeVars() function get called to set up all class variables.
         """
@@ -22,10 +33,23 @@ class Serial:
         self.dsrdtr = dsrdtr
         self.inter_byte_timeout = inter_byte_timeout
         self.exclusive = exclusive
+        self.verbose = verbose
+        self._clock = clock if clock is not None else Clock()
         self._isOpen = True
+        self._rxReady = threading.Condition() # held while a command is processed or the buffer is read, notified when responses are added
+        self._rxBuffer = bytearray()          # Responses waiting to be read
         self._initializeVars()
         self._systemShotCount = 0
-        
+
+    @property
+    def in_waiting(self):
+        """ Mocks pyserial's in_waiting, the number of bytes waiting in the fake 'RX port' """
+        return len(self._rxBuffer)
+
+    @property
+    def is_open(self):
+        return self._isOpen
+
     def isOpen(self):
         """ Checks if fake serial port is open"""
         return self._isOpen
@@ -40,356 +64,112 @@ class Serial:
         self._isOpen = False
         return None
 
+    def reset_input_buffer(self):
+        """ Mocks pyserial's reset_input_buffer(), drops every response that hasn't been read """
+        with self._rxReady:
+            del self._rxBuffer[:]
+
+    def reset_output_buffer(self):
+        """ Mocks pyserial's reset_output_buffer(). Commands are processed as soon as they are written, so there is never anything to drop """
+        return None
+
+    def flush(self):
+        """ Mocks pyserial's flush(). Commands are processed as soon as they are written, so there is never anything to wait for """
+        return None
+
     def clearSerial(self):
         """
         This is a debugging only command that is not included in pyserial. The purpose of this function is to clear out a clogged 'RX port' (basically meaning clearing all of the data that our fake serial has recieved)
         """
-        self._sendData = ''
+        self.reset_input_buffer()
         return None
 
 
     def write(self, command):
         """
-        The write function is meant to do most of the heavy lifting in this class. 
-        It is meant to mimic the write function from pyserial, but it has been heavily modified to process incoming laser commands.
+        The write function is meant to do most of the heavy lifting in this class.
+        It is meant to mimic the write function from pyserial, but it processes incoming laser commands and queues the laser's responses.
 
-        There will be a comment listed around every significant line or lines of code.
-        This comment will give a basic understaning of what is occuring in the code, and what laser values the line(s) are modifying.
+        Every \\r (or \\n) terminated command frame in the data is processed in order, the way the laser does when several commands
+        are written at once. Trailing data without a terminator is answered with ?1, as the laser never sees the end of the command.
 
         Parameters
         ----------
         command : bytes
-            This is an ascii encoded string containing the command you would like to send to the laser
+            This is an ascii encoded string containing the command(s) you would like to send to the laser
+
+        Returns
+        -------
+        count : int
+            The number of bytes written
         """
-        # Here I need to implement all of the stuff
         if self._isOpen == False:                                               # You don't have to open the port anymore
             raise PortError('Port Not Opened')
-        
-        if type(command) == bytes:
-            commandDecoded = str((repr(command.decode('ascii')))).replace("u'", "").replace("'", "")      # Lines 62-66 check that the incoming command is indeed in bytes (The u' was something i had to replace since I was getting an issue on mac?)
-            print("Laser recieved command: {}".format(commandDecoded))          # If it's in bytes, we will decode the command in ascii and get the raw representation of the ascii string
-        else:
+        if not isinstance(command, (bytes, bytearray)):
             raise TypeError('{} is not a byte format'.format(type(command)))
 
-        strip = commandDecoded.split(':', 1)
-        strippedCMD = []
-        strippedCMD.append(strip[0])
-        try:
-            newlineIndex = strip[1].index("\\n")
-        except:
-            newlineIndex = -1
-            
-        try:
-            carriageReturnIndex = strip[1].index("\\r")                         # Lines 68-95 focus on manipulation of the raw string we just recieved
-        except:                                                                 # In this block of code, we extract a list of the following things:
-            carriageReturnIndex = -1                                            # strippedCMD = [laser address, command]
-        
-        if carriageReturnIndex != -1 and newlineIndex == -1:
-            strip = strip[1].split("\\r")
-            strippedCMD.append(strip[0])
-            
-        elif carriageReturnIndex == -1 and newlineIndex != -1:
-            strip = strip[1].split("\\n")
-            strippedCMD.append(strip[0])
-            
-        elif carriageReturnIndex != -1 and newlineIndex != -1:
-            strip = strip[1].replace('\\r', '').replace('\\n', '')
-            strippedCMD.append(strip)
-
-        else:
-            self._sendBytes('?1')                                   # Command not recognized
-            return None
-
-        # Check for valid command
-        if strippedCMD[0] == ';LA':                                         # Making sure proper laser address is listed
-            query = strippedCMD[1].find('?')
-            
-            if query != -1:                                                 #---Query Commands-------------------------------------------------------------------------------
-                queryList = strippedCMD[1].split('?')
-                queryCMD = queryList[0]
-            
-                if queryCMD == 'BC':                                        # Burst Count - Retursn number of shots to be fired when firing mode is set to burst (default is 10)
-                    self._sendBytes(str(self._burstCount))
-
-                elif queryCMD == 'BV':                                      # Bank Voltage - Returns current diode driver bank voltage
-                    self._sendBytes(str(self._bankVoltage))
-
-                elif queryCMD == 'DT':                                      # Diode Trigger Mode - Returns trigger value (0 = internal, 1 = external)
-                    self._sendBytes(str(self._diodeTrigger))
-
-                elif queryCMD == 'DC':                                      # Diode Current - Returns the amperage value for diode current
-                    self._sendBytes(str(self._diodeCurrent))
-
-                elif queryCMD == 'DC:MIN':                                  # Returns Min Diode Current Value
-                    self._sendBytes(str(self._diodeCurrentMIN))
-
-                elif queryCMD == 'DC:MAX':                                  # Returns Max Diode Current Value
-                    self._sendBytes(str(self._diodeCurrentMAX))
-
-                elif queryCMD == 'DW':                                      # Diode Width - Returns the diode pulse width
-                    self._sendBytes(str(self._diodeWidth))
-
-                elif queryCMD == 'DW:MIN':                                  # Min Diode Width
-                    self._sendBytes(str(self._diodeWidthMIN))
-
-                elif queryCMD == 'DW:MAX':                                  # Max Diode Width
-                    self._sendBytes(str(self._diodeWidthMAX))
-
-                elif queryCMD == 'EC':                                      # Echo (not sure what this does) - Returns if echo characters are on or off (0 = off, 1 = on)
-                    self._sendBytes(str(self._echo))
-
-                elif queryCMD == 'EM':                                      # Energy Mode - Current power mode on laser (0 = manual, 1 = low power, 2 = high power)
-                    self._sendBytes(str(self._energyMode))
-
-                elif queryCMD == 'EN':                                      # Enable - Returns armed state value (0 = disabled, 1 = enabled)
-                    self._sendBytes(str(self._enable))
-
-                elif queryCMD == 'FL':                                      # Fire Laser - Returns laser state value (0 = laser inactive, 1 = laser active)
-                    self._sendBytes(str(self._fireLaser))
-
-                elif queryCMD == 'FT':                                      # FET Tempurature - Returns temp. in degrees Celsius
-                    self._sendBytes(str(self._FETtemp))
-
-                elif queryCMD == 'FT:MAX':                                  # Returns Max FET Tempurature
-                    self._sendBytes(str(self._FETtempMAX))
+        frames = bytes(command).replace(b'\n', b'\r').split(b'\r')
+        unterminated = frames.pop()
+        with self._rxReady:
+            for frame in frames:
+                if frame:                                                       # \r\n terminators leave an empty frame behind
+                    self._sendBytes(self._processCommand(frame.decode('ascii')))
+            if unterminated:
+                self._sendBytes('?1')                                           # Command not recognized
+            self._rxReady.notify_all()
+        return len(command)
+
+    def _processCommand(self, command):
+        """
+        Runs a single command (without its terminator) on the fake laser.
 
-                elif queryCMD == 'FV':                                      # Returns FET Voltage
-                    self._sendBytes(str(self._FETvolts))
+        Parameters
+        ----------
+        command : str
+            The command frame, such as ';LA:SS?'
 
-                elif queryCMD == 'ID':                                      # Returns connected laser device ID
-                    self._sendBytes(str('QC,MicroJewel,00101,1.0-0.0.0.8'))
+        Returns
+        -------
+        response : str
+            The laser's response, without the terminator
+        """
+        if self.verbose:
+            print("Laser recieved command: {}".format(command))
+
+        address, colon, body = command.partition(':')
+        if address != ';LA' or not colon:                                       # Making sure proper laser address is listed
+            return '?2' if address == '' else '?1'                              # Missing command keyword / Command not recognized
+
+        if '?' in body:                                                         #---Query Commands---
+            query = self._QUERIES.get(body.split('?', 1)[0])
+            if query is None:
+                return '?7'                                                     # Error Code for invalid query command
+            return str(query(self))
+
+        words = body.split()
+        if len(words) == 0:
+            return '?2'                                                         # Missing command keyword
+        action = self._ACTIONS.get(words[0])
+
+        if len(words) == 1:
+            if words[0] == 'RS':                                                # Reset - Resets all variables to factory default
+                self._initializeVars()
+                return 'OK'
+            return '?5' if action is not None else '?3'                         # Invalid parameter / Invalid command keyword
+
+        if action is None:                                                      #---Action Commands---
+            return '?6' if words[0] in self._QUERIES else '?1'                  # Query only command, query needs a question mark / Command not recognized
+        if len(words) > 2:
+            return '?5'                                                         # Invalid parameter
+        try:
+            return action(self, words[1])
+        except ValueError:
+            return '?5'                                                         # Invalid parameter
 
-                elif queryCMD == 'IM':                                      # Returns Diode Current Measurement - in Amps
-                    self._sendBytes(str(self._currentMeasurement))
-
-                elif queryCMD == 'LS':                                      # Latched Status - Returns latched system status
-                    self._sendBytes(str(self._latchedStatus))
-
-                elif queryCMD == 'PE':                                      # Pulse Period - Returns the current set pulse period
-                    self._sendBytes(str(self._pulsePeriod))
-
-                elif queryCMD == 'PE:MIN':                                  # Pulse Period Min - Returns the minimum pulse period allowed
-                    self._sendBytes(str(self._pulsePeriodMIN))
-
-                elif queryCMD == 'PE:MAX':                                  # Pulse Period Max - Returns the maximum pulse period allowed
-                    self._sendBytes(str(self._pulsePeriodMAX))
-
-                elif queryCMD == 'PM':                                      # Pulse Mode - Returns the current set pulse mode (0 = continuous, 1 = single shot, 2 = burst)
-                    self._sendBytes(str(self._pulseMODE))
-
-                elif queryCMD == 'RC':                                      # Recall Settings - Returns settings from user bin 1-6. 0 = recall factory defaults
-                    self._sendBytes(str(self._recallSettings))
-
-                elif queryCMD == 'RR':                                      # repetition Rate - Returns the current repetition rate (default = 1 Hz)
-                    self._sendBytes(str(self._repetitionRate))
-
-                elif queryCMD == 'RR:MIN':                                  # repetition Rate Min - Returns minimum allowed repetition rate (1 Hz)
-                    self._sendBytes(str(self._repetitionRateMIN))
-
-                elif queryCMD == 'RR:MAX':                                  # repetition Rate Max - Returns maximum allowed repititon rate (5 Hz)
-                    self._sendBytes(str(self._repetitionRateMAX))
-
-                elif queryCMD == 'SC':                                      # System Shot Count - Returns the number of shots stored on the system since factory build
-                    self._sendBytes(str(self._systemShotCount))
-
-                elif queryCMD == 'SS':                                      # System Status - Returns a 16 bit decimal value relaying information on the laser's current state
-                    self._HPM == '0'
-                    decimal = self._packingSSBinary()
-                    self._sendBytes(decimal)
-                    self._HPM == '1'
-
-                elif queryCMD == 'SV':                                      # Save Settings - Returns user save settings bin 1-6
-                    self._sendBytes(str(self._saveSettings))
-
-                elif queryCMD == 'TR':                                      # Resonator Thermistor Tempurature - Returns temp. in degrees Celsius
-                    self._sendBytes(str(self._thermistorTemp))
-
-                elif queryCMD == 'TR:MIN':                                  # Resonator Thermistor Tempurature Min - Returns minimum temp.
-                    self._sendBytes(str(self._thermistorTempMIN))
-
-                elif queryCMD == 'TR:MAX':                                  # Resonator Thermistor Tempurature Max - Returns maximum temp.
-                    self._sendBytes(str(self._thermistorTempMAX))
-
-                elif queryCMD == 'UC':                                      # User Shot Count - Returns user shot count value
-                    self._sendBytes(str(self._userShotCount))
-
-                else:
-                    self._sendBytes('?7')                           # Error Code for invalid query command
-
-
-
-            elif len(strippedCMD[1].split()) == 2:                          #---Action Commands------------------------------------------------------------------------------
-                actionCMD = strippedCMD[1].split()
-                if actionCMD[0] == 'BC':                                    # Burst Count - Allows you to edit the laser's burst count
-                    if 1 <= int(actionCMD[1]) <= 65535:
-                        self._burstCount = int(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'DC':                                  # Diode Current - Allows you to edit the laser's diode current
-                    if self._diodeCurrentMIN <= float(actionCMD[1]) <= self._diodeCurrentMAX:
-                        self._diodeCurrent = float(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'DT':                                  # Diode Trigger - Allows you to change diode trigger value (0 = internal, 1 = external)
-                    if int(actionCMD[1]) == 1 or int(actionCMD[1]) == 0:
-                        self._diodeTrigger = int(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'DW':                                  # Diode Width - Allows you to edit the laser's diode width
-                    if self._diodeWidthMIN <= int(actionCMD[1]) <= self._diodeWidthMAX:
-                        self._diodeWidth = int(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'EC':                                  # Echo - Allows you to change between echo characters on and off (0 = off, 1 = on)
-                    if int(actionCMD[1]) == 0 or int(actionCMD[1]) == 1:
-                        self._echo = int(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'EM':                                  # Energy Mode - Allows you to change laser energy modes (0 = manual, 1 = low power, 2 = high power)
-                    if int(actionCMD[1]) == 0:
-                        self._energyMode = int(actionCMD[1])
-                        self._HPM = '0'
-                        self._LPM = '0'
-                        self._sendBytes('OK')
-                    elif int(actionCMD[1]) == 1:
-                        self._energyMode = int(actionCMD[1])
-                        self._LPM = '1'
-                        self._HPM = '0'
-                        self._sendBytes('OK')
-                    elif int(actionCMD[1]) == 2:
-                        self._energyMode = int(actionCMD[1])
-                        self._LPM = '0'
-                        self._HPM = '1'
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'EN':                                  # Enable - Allows you to arm and disarm laser (0 = disarm/disable, 1 = arm/enable)
-                    if self._RTE == '1' and actionCMD[1] == '1':
-                        if self._arming or self._enable == 1:
-                            self._sendBytes('?8')
-                        else:
-                            self._t2 = threading.Thread(target=self._armingTimer)
-                            self._t2.start()
-                            self._sendBytes('OK')
-                    elif self._RTE == '0' and actionCMD[1] == '1':
-                        self._sendBytes('?8')                       # Command unavailable in current system state
-                    elif actionCMD[1] == '0' and self._enable == 1:
-                        self._enable = 0
-                        self._LE = '0'
-                        self._RTF = '0'
-                        self._sendBytes('OK')
-                    elif actionCMD[1] == '0' and self._enable == 0:
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?8')                       # Command unavailable in current system state
-
-                elif actionCMD[0] == 'FL':                                  # Fire Laser - Allows you to fire and stop firing the laser (0 = stop firing, 1 = fire)
-<<<<<<< HEAD
-                    if int(actionCMD[1]) == 1 and self._RTF == '1' and (self._energyMode == 0 or self._energyMode == 2) and self._LE == '1' and self._RTE == '1':
-                        if self._firing:
-                            self._sendBytes('?8')
-                        else:
-                            self._t3 = threading.Thread(target=self._firingTimer)
-                            self._t3.start()
-                            self._sendBytes('OK')
-                    elif int(actionCMD[1]) == 0:
-                        if self._LA == '0':
-                            self._sendBytes('?8')
-                        else:
-                            self._LA = '0'
-                            self._fireLaser = 0
-                            self._sendBytes('OK')
-=======
-                    if self._RTF == '1' and (self._energyMode == 0 or self._energyMode == 2) and self._LE == '1' and self._RTE == '1':
-                        self._t3.start()
-                        self._sendBytes('OK')
->>>>>>> master
-                    else:
-                        self._sendBytes('?8')                       # Command unavailable in current system state
-                        
-                elif actionCMD[0] == 'PE':                                  # Pulse Period - Allows you to set the laser's pulse period
-                    if self._pulsePeriodMIN <= float(actionCMD[1]) <= self._pulsePeriodMAX:
-                        self._pulsePeriod = float(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'PM':                                  # Pulse Mode - Allows you to change the laser's pulse mode (0 = continuous, 1 = single shot, 2 = burst)
-                    if int(actionCMD[1]) == 0 or int(actionCMD[1]) == 1 or int(actionCMD[1]) == 2: 
-                        self._pulseMODE = int(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'RC':                                  # Recall Settings - Allows for changing recall settigns (bin 1-6) (0 = recall factory defaults)
-                    if 1 <= int(actionCMD[1]) <= 6:
-                        self._recallSettings = int(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'RR':                                  # repetition Rate - Allows for changing the repetition rate (defaults to 1 Hz)
-                    if self._repetitionRateMIN <= int(actionCMD[1]) <= self._repetitionRateMAX:
-                        self._repetitionRate = float(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'SV':                                  # Save Settigns - Allows for changing the save settings (bin 1-6)
-                    if 1 <= int(actionCMD[1]) <= 6:
-                        self._saveSettings = int(actionCMD[1])
-                        self._sendBytes('OK')
-                    else:
-                        self._sendBytes('?5')                       # Invalid parameter
-
-                elif actionCMD[0] == 'UC':                                  # User Shot Count - Can be cleared issuing a 0
-                    self._userShotCount = int(actionCMD[1])
-                    self._sendBytes('OK')
-
-                elif actionCMD[0] == 'BV' or actionCMD [0] == 'DC:MIN' or actionCMD [0] == 'DC:MAX' or actionCMD [0] == 'DW:MIN' or actionCMD [0] == 'DW:MAX' or actionCMD [0] == 'FT' or actionCMD [0] == 'FT:MAX' or actionCMD [0] == 'FV' or actionCMD [0] == 'ID' or actionCMD [0] == 'IM' or actionCMD [0] == 'LS' or actionCMD [0] == 'PE:MIN' or actionCMD [0] == 'PE:MAX' or actionCMD [0] == 'RR:MIN' or actionCMD [0] == 'RR:MAX' or actionCMD [0] == 'SC' or actionCMD [0] == 'SS' or actionCMD [0] == 'TR:MIN' or actionCMD [0] == 'TR:MAX':
-                    self._sendBytes('?6')                           # Query only command, query needs a question mark
-
-                else:
-                    self._sendBytes('?1')                           # Command not recognized
-
-            elif len(strippedCMD[1].split()) == 1:
-                actionCMD = strippedCMD[1].split()
-                if actionCMD[0] == 'RS':                                    # Reset - Resets all variables to factory default
-                    self._initializeVars()
-                    self._sendBytes('OK')
-
-                elif actionCMD[0] == 'BC' or actionCMD[0] == 'DC' or actionCMD[0] == 'DT' or actionCMD[0] == 'DW' or actionCMD[0] == 'EC' or actionCMD[0] == 'EM' or actionCMD[0] == 'EN' or actionCMD[0] == 'FL' or actionCMD[0] == 'PE' or actionCMD[0] == 'PM' or actionCMD[0] == 'RC' or actionCMD[0] == 'RR' or actionCMD[0] == 'SV' or actionCMD[0] == 'UC':
-                    self._sendBytes('?5')                           # Invalid parameter
-                
-                elif actionCMD[0] == '':
-                    self._sendBytes('?2')                           # Missing command keyword
-                    
-                else:
-                    self._sendBytes('?3')                           # Invalid command keyword
-                
-        else:
-            if strippedCMD[0] == '':
-                self._sendBytes('?2')                               # Missing command keyword
-            else: 
-                self._sendBytes('?1')                               # Command not recognized
-          
-        return None
 
+    def read(self, n=1):
+        """ This function mocks the pyserial read() function, it takes in the number of bytes that you would like to recieve
 
-    def read(self, n=1):                    # Needs fixed so it doesn't send \n
-        """ This function mocks the pyserial read() function, it takes in the number of bytes that you would like to recieve 
-        
         Parameters
         ----------
         n : int
@@ -398,94 +178,80 @@ class Serial:
         Returns
         -------
         response : bytes
-            Encodes a responce string in ascii.
+            Up to n bytes. Fewer (possibly none) if the timeout expired first.
         """
-        if self._sendData == '':            # Check if send data is empty
-            return None
-        
-        elif self._sendData == '\n':        # Check if '\n' is all that's left in the sendData string
-            self._sendData = ''
-            return None
-        
-        send = ''
-        for i in range(n):                  # Going through string character by character
-            if len(self._sendData) == 0:    # Break statement
-                break
-            if self._sendData[i] == '\n':
-                self._sendData = self._sendData[i+1:]
-            else:
-                send += self._sendData[i]
-                self._sendData = self._sendData[i+1:]
-        return send.encode('ascii')
-
-
-    def readline(self):                 
-        """This function mocks the pyserial readline() fucntion. It reads a singular line of sendData 
-        
+        with self._rxReady:
+            if len(self._rxBuffer) < n:
+                self._waitFor(lambda: len(self._rxBuffer) >= n)
+            return self._take(n)
+
+    def readinto(self, b):
+        """ This function mocks the pyserial readinto() function, it reads up to len(b) bytes into b and returns how many it read """
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        """This function mocks the pyserial readline() fucntion. It reads a singular response, up to and including its \\r terminator
+
         Returns
         -------
         response : bytes
-            Encodes a responce string in ascii.
+            The response, or whatever was received if the timeout expired first.
         """
-        if self._sendData == '':
-            return None
-        elif self._sendData == '\n':
-            self._sendData = ''
-            return None
-
-        newlineIndex = self._sendData.index("\n")
-            
-        send = self._sendData[0:newlineIndex]
-        self._sendData = self._sendData[newlineIndex+1:]
-        return send.encode('ascii')
-
-
-    def read_until(self, expected):
-        """ This function mocks the pyserial read_until() function. It teads until the provided character is found (until that character's index value)
-        
+        return self.read_until(b'\r')
+
+
+    def read_until(self, expected=b'\n', size=None):
+        """ This function mocks the pyserial read_until() function. It reads until the provided terminator is found (including it)
+
         Parameters
         ----------
-        expected : str
-            The expected string you would like to read until
+        expected : bytes
+            The terminator you would like to read until
+        size : int
+            The most bytes to read, even if the terminator hasn't been found
 
         Returns
         -------
         response : bytes
-            Encodes a responce string in ascii.
+            Everything up to and including the terminator, or whatever was received if the timeout expired first.
         """
-        if self._sendData == '':
-            return None
-        elif self._sendData == '\n':
-            self._sendData = ''
-            return None
-
-        firstNewLine = self._sendData.index("\n")
-        expectedIndex = self._sendData.index(expected)
-        
-        if firstNewLine < expectedIndex:
-            if firstNewLine == 0:
-                send = self._sendData[1:expectedIndex+1]
-                self._sendData = self._sendData[expectedIndex+1:]
-            else:
-                send = self._sendData[0:firstNewLine] + self._sendData[firstNewLine+1:expectedIndex]
-                self._sendData = self._sendData[expectedIndex+1:]
-
-        else:
-            send = self._sendData[0:expectedIndex+1]
-            self._sendData = self._sendData[expectedIndex+1:]
-
-        return send.encode('ascii')
+        if type(expected) == str:           # pyserial expects a bytes terminator, accept both here
+            expected = expected.encode('ascii')
+
+        with self._rxReady:
+            buffer = self._rxBuffer
+            end = buffer.find(expected)
+            if end == -1 and (size is None or len(buffer) < size):
+                self._waitFor(lambda: buffer.find(expected) != -1 or (size is not None and len(buffer) >= size))
+                end = buffer.find(expected)
+            n = len(buffer) if end == -1 else end + len(expected)
+            return self._take(n if size is None else min(n, size))
+
+    def _waitFor(self, ready):
+        """Waits until ready() is true or the timeout expires. Must be called with self._rxReady held."""
+        if self.timeout is None:
+            self._rxReady.wait_for(ready)
+        elif self.timeout > 0:
+            self._rxReady.wait_for(ready, self.timeout)
+
+    def _take(self, n):
+        """Removes and returns up to n bytes from the front of the receive buffer. Must be called with self._rxReady held."""
+        data = bytes(self._rxBuffer[:n])
+        del self._rxBuffer[:n]              # deleting from the front of a bytearray just moves its start, so this doesn't copy the rest
+        return data
 
 
     def _sendBytes(self, sendValue):
-        """Formats a string into sendData string
-        
+        """Queues a response in the receive buffer
+
         Parameters
         ----------
         sendValue : str
-            Puts the response values into the send data string
+            The response to send, without the terminator
         """
-        self._sendData += '{}\r\n'.format(str(sendValue))   # Places the carriage return along with a newline that I'm using to split off commands (newline's kinda unnecessary but I'm using it anyways )
+        self._rxBuffer += (str(sendValue) + '\r').encode('ascii')
         return None
 
 
@@ -500,14 +266,8 @@ class Serial:
         decimal : int
             Returns the decimal value of the ascii encoded string
         """
-        SixteenBit = list(self._spare + self._spare + self._HPM + self._LPM + self._RTF + self._RTE + self._PF + self._EOT + self._ROT + self._EI + self._reserved + self._reserved + self._DET + self._reserved + self._LA + self._LE)
-        power = 0
-        decimal = 0
-        for i in reversed(range(len((SixteenBit)))):        # Converting 16 bit string into 16 bit decimal value
-            if SixteenBit[i] == '1':
-                decimal += 2**power
-            power += 1
-        return decimal
+        SixteenBit = self._spare + self._spare + self._HPM + self._LPM + self._RTF + self._RTE + self._PF + self._EOT + self._ROT + self._EI + self._reserved + self._reserved + self._DET + self._reserved + self._LA + self._LE
+        return int(SixteenBit, 2)
 
 
 
@@ -522,11 +282,11 @@ class Serial:
     def _initializeVars(self):
         """
         This funciton houses all of our class variables that are laser specific.
-        
+
         These variables are not in the __init__ function since they need to be resetable
         """
-        self._sendData = ''
-        
+        del self._rxBuffer[:]   # A reset drops the responses that haven't been read
+
         #---Laser Settings------------------------------------------------
         self._burstCount = 10
         self._bankVoltage = 0
@@ -549,7 +309,7 @@ class Serial:
         self._FETvolts = 0      # Voltage
         self._currentMeasurement = 0
         self._latchedStatus = 0
-        
+
         self._pulsePeriod = 0
         self._pulsePeriodMIN = 0
         self._pulsePeriodMAX = 3
@@ -564,13 +324,10 @@ class Serial:
         self._thermistorTempMAX = 10000000
         self._userShotCount = 0
 
-<<<<<<< HEAD
         self._emergencyStop = False
         self._arming = False
         self._firing = False
 
-=======
->>>>>>> master
 
         ### System Status Below ###
         # This goes 15 -> 0 byte order (16 bit decimal value)
@@ -594,17 +351,128 @@ class Serial:
         #self._t2 = threading.Thread(target=self._armingTimer)       # Arm timer thread
         #self._t3 = threading.Thread(target=self._firingTimer)       # Laser Fire timer thread
 
+    ### Action Commands ###
+    def _setting(attribute, parse, valid):
+        """Makes the action for a plain setting: the parameter is parsed with parse, and stored in attribute if valid(self, value)."""
+        def action(self, parameter):
+            value = parse(parameter)
+            if not valid(self, value):
+                return '?5'                                 # Invalid parameter
+            setattr(self, attribute, value)
+            return 'OK'
+        return action
+
+    def _setEnergyMode(self, parameter):
+        """ Energy Mode - Allows you to change laser energy modes (0 = manual, 1 = low power, 2 = high power) """
+        mode = int(parameter)
+        if not mode in (0, 1, 2):
+            return '?5'                                     # Invalid parameter
+        self._energyMode = mode
+        self._LPM = '1' if mode == 1 else '0'
+        self._HPM = '1' if mode == 2 else '0'
+        return 'OK'
+
+    def _setEnable(self, parameter):
+        """ Enable - Allows you to arm and disarm laser (0 = disarm/disable, 1 = arm/enable) """
+        if self._RTE == '1' and parameter == '1':
+            if self._arming or self._enable == 1:
+                return '?8'
+            self._t2 = threading.Thread(target=self._armingTimer)
+            self._t2.start()
+            return 'OK'
+        elif parameter == '0':
+            if self._enable == 1:
+                self._enable = 0
+                self._LE = '0'
+                self._RTF = '0'
+            return 'OK'
+        return '?8'                                         # Command unavailable in current system state
+
+    def _setFireLaser(self, parameter):
+        """ Fire Laser - Allows you to fire and stop firing the laser (0 = stop firing, 1 = fire) """
+        fire = int(parameter)
+        if fire == 1 and self._RTF == '1' and (self._energyMode == 0 or self._energyMode == 2) and self._LE == '1' and self._RTE == '1':
+            if self._firing:
+                return '?8'
+            self._t3 = threading.Thread(target=self._firingTimer)
+            self._t3.start()
+            return 'OK'
+        elif fire == 0:
+            if self._LA == '0':
+                return '?8'
+            self._LA = '0'
+            self._fireLaser = 0
+            return 'OK'
+        return '?8'                                         # Command unavailable in current system state
+
+    # Query keyword -> function of the fake laser returning the response
+    _QUERIES = {
+        'BC': attrgetter('_burstCount'),                    # Burst Count - Returns number of shots to be fired when firing mode is set to burst (default is 10)
+        'BV': attrgetter('_bankVoltage'),                   # Bank Voltage - Returns current diode driver bank voltage
+        'DT': attrgetter('_diodeTrigger'),                  # Diode Trigger Mode - Returns trigger value (0 = internal, 1 = external)
+        'DC': attrgetter('_diodeCurrent'),                  # Diode Current - Returns the amperage value for diode current
+        'DC:MIN': attrgetter('_diodeCurrentMIN'),
+        'DC:MAX': attrgetter('_diodeCurrentMAX'),
+        'DW': attrgetter('_diodeWidth'),                    # Diode Width - Returns the diode pulse width
+        'DW:MIN': attrgetter('_diodeWidthMIN'),
+        'DW:MAX': attrgetter('_diodeWidthMAX'),
+        'EC': attrgetter('_echo'),                          # Echo - Returns if echo characters are on or off (0 = off, 1 = on)
+        'EM': attrgetter('_energyMode'),                    # Energy Mode - Current power mode on laser (0 = manual, 1 = low power, 2 = high power)
+        'EN': attrgetter('_enable'),                        # Enable - Returns armed state value (0 = disabled, 1 = enabled)
+        'FL': attrgetter('_fireLaser'),                     # Fire Laser - Returns laser state value (0 = laser inactive, 1 = laser active)
+        'FT': attrgetter('_FETtemp'),                       # FET Tempurature - Returns temp. in degrees Celsius
+        'FT:MAX': attrgetter('_FETtempMAX'),
+        'FV': attrgetter('_FETvolts'),                      # Returns FET Voltage
+        'ID': lambda self: 'QC,MicroJewel,00101,1.0-0.0.0.8', # Returns connected laser device ID
+        'IM': attrgetter('_currentMeasurement'),            # Returns Diode Current Measurement - in Amps
+        'LS': attrgetter('_latchedStatus'),                 # Latched Status - Returns latched system status
+        'PE': attrgetter('_pulsePeriod'),                   # Pulse Period - Returns the current set pulse period
+        'PE:MIN': attrgetter('_pulsePeriodMIN'),
+        'PE:MAX': attrgetter('_pulsePeriodMAX'),
+        'PM': attrgetter('_pulseMODE'),                     # Pulse Mode - Returns the current set pulse mode (0 = continuous, 1 = single shot, 2 = burst)
+        'RC': attrgetter('_recallSettings'),                # Recall Settings - Returns settings from user bin 1-6. 0 = recall factory defaults
+        'RR': attrgetter('_repetitionRate'),                # repetition Rate - Returns the current repetition rate (default = 1 Hz)
+        'RR:MIN': attrgetter('_repetitionRateMIN'),
+        'RR:MAX': attrgetter('_repetitionRateMAX'),
+        'SC': attrgetter('_systemShotCount'),               # System Shot Count - Returns the number of shots stored on the system since factory build
+        'SS': _packingSSBinary,                             # System Status - Returns a 16 bit decimal value relaying information on the laser's current state
+        'SV': attrgetter('_saveSettings'),                  # Save Settings - Returns user save settings bin 1-6
+        'TR': attrgetter('_thermistorTemp'),                # Resonator Thermistor Tempurature - Returns temp. in degrees Celsius
+        'TR:MIN': attrgetter('_thermistorTempMIN'),
+        'TR:MAX': attrgetter('_thermistorTempMAX'),
+        'UC': attrgetter('_userShotCount'),                 # User Shot Count - Returns user shot count value
+    }
+
+    # Action keyword -> function of the fake laser and the parameter string returning the response
+    _ACTIONS = {
+        'BC': _setting('_burstCount', int, lambda self, v: 1 <= v <= 65535),
+        'DC': _setting('_diodeCurrent', float, lambda self, v: self._diodeCurrentMIN <= v <= self._diodeCurrentMAX),
+        'DT': _setting('_diodeTrigger', int, lambda self, v: v in (0, 1)),
+        'DW': _setting('_diodeWidth', float, lambda self, v: self._diodeWidthMIN <= v <= self._diodeWidthMAX),
+        'EC': _setting('_echo', int, lambda self, v: v in (0, 1)),
+        'EM': _setEnergyMode,
+        'EN': _setEnable,
+        'FL': _setFireLaser,
+        'PE': _setting('_pulsePeriod', float, lambda self, v: self._pulsePeriodMIN <= v <= self._pulsePeriodMAX),
+        'PM': _setting('_pulseMODE', int, lambda self, v: v in (0, 1, 2)),
+        'RC': _setting('_recallSettings', int, lambda self, v: 1 <= v <= 6),
+        'RR': _setting('_repetitionRate', float, lambda self, v: self._repetitionRateMIN <= v <= self._repetitionRateMAX),
+        'SV': _setting('_saveSettings', int, lambda self, v: 1 <= v <= 6),
+        'UC': _setting('_userShotCount', int, lambda self, v: True), # User Shot Count - Can be cleared issuing a 0
+    }
+    del _setting
+
     ### Threaded Timers ###
     def _warmupTimer(self):
         """NOTE: Not used"""
-        time.sleep(10)          # This function is unused unless I find a way to simulate the warmup period
+        self._clock.sleep(10)          # This function is unused unless I find a way to simulate the warmup period
 
     def _armingTimer(self):
         """
         Simulates the time it takes to arm the laser
         """
         self._arming = True
-        time.sleep(8)           # This function is meant to serve as a fake, threaded timer for 8 seconds which is the amount of time it takes for the laser to arm
+        self._clock.sleep(8)           # This function is meant to serve as a fake, threaded timer for 8 seconds which is the amount of time it takes for the laser to arm
         self._enable = 1
         self._LE = '1'
         self._RTF = '1'
@@ -618,20 +486,16 @@ class Serial:
         self._fireLaser = 1     # This function is meant to serve as a fake, threaded timer for the pulse period set to simulate the laser firing for that time period
         self._LA = '1'
         if self._pulseMODE == 0:
-            time.sleep(self._pulsePeriod)                       # Continuous pulsing
+            self._clock.sleep(self._pulsePeriod)                # Continuous pulsing
         elif self._pulseMODE == 1:
-            time.sleep(1 / self._repetitionRate)                  # Single pulse
+            self._clock.sleep(1 / self._repetitionRate)           # Single pulse
         elif self._pulseMODE == 2:
-            time.sleep(self._burstCount / self._repetitionRate)   # Burst pulses
+            self._clock.sleep(self._burstCount / self._repetitionRate) # Burst pulses
         self._userShotCount += 1
         self._systemShotCount += 1
         self._fireLaser = 0
         self._LA = '0'
-<<<<<<< HEAD
         self._firing = False
-=======
-
->>>>>>> master
 
 #---Error Types-----------------------------------------------------------------------------------
 
@@ -0,0 +1,1154 @@
+"""
+Benchmarks for the ujlaser library, run against the FakeSerialLaser emulator.
+
+Run from the root of the repository with:
+    python -m ujlaser.test.benchmark [--latency-ms 1] [--baud 115200] [--json results.json] [benchmark ...]
+
+The core paths (round trips, get_status, update_settings, fire and emergency stop) run over a simulated serial link with the given
+latency and baud rate. The emulator benchmark also runs them against the emulator process (ujlaser.test.emulator), through a
+pseudo-terminal and the real pyserial port, and the startup benchmark times a cold start (import, connect, first status) against it
+in fresh interpreters. --json writes every result, with the link settings and the git commit, so runs can be
+compared across commits.
+"""
+import argparse
+import collections
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from ujlaser import telemetrystore
+from ujlaser.campaign import Burst, Campaign, Configure, SingleShots
+from ujlaser.clock import VirtualClock
+from ujlaser.daemon import DaemonSerial, LaserDaemon
+from ujlaser.fleet import LaserFleet
+from ujlaser.lasercontrol import Laser, LaserCommandError, LaserStatusResponse
+from ujlaser.recording import RecordingSerial, ReplaySerial
+from ujlaser.repeatedtimer import RepeatedTimer
+from ujlaser.scheduler import PeriodicScheduler
+from ujlaser.telemetrystore import TelemetryStore
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+
+class _LinkSerial(fake_serial.Serial):
+    """
+    A FakeSerialLaser behind a simulated serial link. Every write takes latency seconds, plus the time the written frames and the
+    replies to them take to cross the link at baudrate (10 bits per byte, None for an infinitely fast link).
+    """
+    def __init__(self, latency=0.0, baudrate=None, **kwargs):
+        super().__init__(baudrate=baudrate, **kwargs)
+        self.latency = latency
+
+    def write(self, data):
+        waiting = self.in_waiting
+        result = super().write(data)
+        delay = self.latency
+        if self.baudrate:
+            delay += (len(data) + self.in_waiting - waiting) * 10 / self.baudrate
+        if delay > 0:
+            time.sleep(delay)
+        return result
+
+def _fake_laser(latency=0.0, baudrate=None, **kwargs):
+    """Returns a Laser object connected to a fresh FakeSerialLaser, behind a simulated link if latency or baudrate are given."""
+    l = Laser(**kwargs)
+    if latency or baudrate:
+        l._ser = _LinkSerial(latency, baudrate, timeout=1, verbose=False)
+    else:
+        l._ser = fake_serial.Serial(timeout=1, verbose=False)
+    l.connected = True
+    return l
+
+def _ready_to_fire(l):
+    """Skips the fake laser's 8 second arming time and sets it up to fire single shots."""
+    ser = l._ser
+    ser._enable, ser._LE, ser._RTF = 1, '1', '1'
+    l.set_pulse_mode(Laser.SINGLE_SHOT)
+    l.set_rep_rate(5) # 0.2 second shots
+
+class _CannedSerial:
+    """A serial-like object that answers every command frame with the same reply, instantly, to time the library on its own."""
+    timeout = 1
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.pending = b""
+
+    def write(self, data):
+        self.pending += self.reply * data.count(b"\r")
+
+    @property
+    def in_waiting(self):
+        return len(self.pending)
+
+    def read(self, n):
+        data, self.pending = self.pending[:n], self.pending[n:]
+        return data
+
+    def close(self):
+        pass
+
+def _summarize(samples):
+    """Turns a list of latencies (in seconds) into a dict of statistics (in milliseconds)."""
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean_ms": statistics.mean(samples) * 1e3,
+        "p50_ms": samples[len(samples) // 2] * 1e3,
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * .99))] * 1e3,
+        "max_ms": samples[-1] * 1e3,
+    }
+
+def bench_reader(n=200, latency=0.0, baudrate=None):
+    """
+    Compares the round trip latency and rate of _send_command('SS?') between the sleep and event response readers.
+
+    Parameters
+    ----------
+    n : int
+        Number of commands to time for each reader
+    latency, baudrate :
+        The simulated link, see _LinkSerial
+
+    Returns
+    -------
+    results : dict
+        Latency statistics, plus round trips per second, keyed by reader name.
+    """
+    results = {}
+    for name, mode in (("sleep", Laser.SLEEP_READER), ("event", Laser.EVENT_READER)):
+        l = _fake_laser(latency, baudrate, readMode=mode)
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            l._send_command('SS?')
+            samples.append(time.perf_counter() - start)
+        results[name] = _summarize(samples)
+        results[name]["throughput_per_s"] = n / sum(samples)
+    return results
+
+def bench_get_status(n=200, threads=4, latency=0.0, baudrate=None):
+    """
+    Measures get_status() throughput with the event reader, from one caller and from several callers sharing each SS? query.
+
+    Parameters
+    ----------
+    n : int
+        Number of get_status() calls made by each caller
+    threads : int
+        Number of concurrent callers in the shared case
+    latency, baudrate :
+        The simulated link, see _LinkSerial
+
+    Returns
+    -------
+    results : dict
+        Latency statistics, plus calls per second, keyed by case.
+    """
+    results = {}
+    for name, callers in (("1 caller", 1), ("{} callers".format(threads), threads)):
+        l = _fake_laser(latency, baudrate, readMode=Laser.EVENT_READER)
+        samples = [[] for _ in range(callers)]
+        barrier = threading.Barrier(callers + 1)
+
+        def caller(out):
+            barrier.wait()
+            for _ in range(n):
+                start = time.perf_counter()
+                l.get_status(0)
+                out.append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=caller, args=(out,)) for out in samples]
+        for w in workers:
+            w.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+
+        stats = _summarize([t for out in samples for t in out])
+        stats["throughput_per_s"] = callers * n / elapsed
+        results[name] = stats
+    return results
+
+def bench_daemon(clients=8, n=100, latency=0.0, baudrate=None):
+    """
+    Compares status reads from several processes' worth of callers: threads sharing one Laser object, and clients of a LaserDaemon
+    on localhost, which writes everything its clients are waiting for in one batch, with and without its status cache.
+
+    Parameters
+    ----------
+    clients : int
+        Number of concurrent callers
+    n : int
+        Number of get_status() calls made by each caller
+    latency, baudrate :
+        The simulated link, see _LinkSerial
+
+    Returns
+    -------
+    results : dict
+        Latency statistics, plus calls per second and the number of batches the daemon wrote, keyed by case.
+    """
+    def measure(status):
+        samples = [[] for _ in range(clients)]
+        barrier = threading.Barrier(clients + 1)
+
+        def caller(i):
+            barrier.wait()
+            for _ in range(n):
+                start = time.perf_counter()
+                status(i)
+                samples[i].append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=caller, args=(i,)) for i in range(clients)]
+        for w in workers:
+            w.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for w in workers:
+            w.join()
+        stats = _summarize([t for out in samples for t in out])
+        stats["throughput_per_s"] = clients * n / (time.perf_counter() - start)
+        return stats
+
+    results = {}
+    l = _fake_laser(latency, baudrate, readMode=Laser.EVENT_READER)
+    results["shared Laser"] = measure(lambda i: l.get_status(0))
+    for name, max_age in (("daemon", 0), ("daemon, 0.1 s cache", .1)):
+        with LaserDaemon(l, "tcp://127.0.0.1:0", status_max_age=max_age) as daemon:
+            lasers = []
+            for _ in range(clients):
+                client = Laser(readMode=Laser.EVENT_READER, keepaliveInterval=0)
+                client._ser = DaemonSerial(daemon.address)
+                client.connected = True
+                lasers.append(client)
+            results[name] = measure(lambda i: lasers[i].get_status(0))
+            results[name]["batches"] = daemon.batches
+            for client in lasers:
+                client.disconnect()
+    return results
+
+def bench_update_settings(n=20, latency=0.0, baudrate=None):
+    """
+    Compares the wall time of update_settings() with and without pipelining, for both response readers.
+
+    Parameters
+    ----------
+    n : int
+        Number of settings uploads to time for each configuration
+    latency, baudrate :
+        The simulated link, see _LinkSerial
+
+    Returns
+    -------
+    results : dict
+        Latency statistics keyed by configuration name.
+    """
+    results = {}
+    for reader, mode in (("sleep", Laser.SLEEP_READER), ("event", Laser.EVENT_READER)):
+        for pipelined in (False, True):
+            l = _fake_laser(latency, baudrate, readMode=mode, pipelined=pipelined)
+            samples = []
+            for _ in range(n):
+                l._shadow.clear() # forget what the laser confirmed, so every setting is sent
+                start = time.perf_counter()
+                l.update_settings()
+                samples.append(time.perf_counter() - start)
+            results[reader + ("/pipelined" if pipelined else "/serial")] = _summarize(samples)
+    return results
+
+def bench_campaign(latency=0.0, baudrate=None):
+    """
+    Compares the dead time between shots of a scripted sequence (5 bursts of 2 at 5 Hz, a diode current change, then 5 single shots
+    at 5 Hz) driven step by step with the setters, fire_laser() and fireThread.join(), and run as a Campaign.
+
+    Parameters
+    ----------
+    latency, baudrate :
+        The simulated link, see _LinkSerial
+
+    Returns
+    -------
+    results : dict
+        Planned and achieved seconds, and the mean time lost per shot in milliseconds, keyed by method.
+    """
+    planned = 5 * 2 / 5 + 5 / 5
+    results = {}
+
+    l = _fake_laser(latency, baudrate, readMode=Laser.EVENT_READER)
+    _ready_to_fire(l)
+    start = time.perf_counter()
+    l.set_pulse_mode(Laser.BURST)
+    l.set_burst_count(2)
+    for _ in range(5):
+        l.fire_laser()
+        l.fireThread.join()
+    l.set_diode_current(2.5)
+    l.set_pulse_mode(Laser.SINGLE_SHOT)
+    for _ in range(5):
+        l.fire_laser()
+        l.fireThread.join()
+    achieved = time.perf_counter() - start
+    results["step by step"] = {"planned_s": planned, "achieved_s": achieved, "lost_per_shot_ms": (achieved - planned) / 10 * 1e3}
+
+    l = _fake_laser(latency, baudrate, readMode=Laser.EVENT_READER)
+    _ready_to_fire(l)
+    campaign = Campaign(l, [Burst(2, rate=5, repeat=5), Configure(diodeCurrent=2.5), SingleShots(5, rate=5)])
+    start = time.perf_counter()
+    campaign.run()
+    achieved = time.perf_counter() - start
+    results["campaign"] = {"planned_s": planned, "achieved_s": achieved, "lost_per_shot_ms": (achieved - planned) / 10 * 1e3}
+    return results
+
+def bench_reconfigure(n=20):
+    """
+    Times changing three settings between shots: with one setter call per setting, with update_settings() (which only sends what
+    changed) and with a settings() transaction (which also sends it in one write).
+
+    Parameters
+    ----------
+    n : int
+        Number of reconfigurations to time for each method
+
+    Returns
+    -------
+    results : dict
+        Latency statistics keyed by method, for both response readers.
+    """
+    def setters(l, i):
+        l.set_rep_rate(1 + i % 5)
+        l.set_burst_count(10 + i)
+        l.set_pulse_width(10 + i)
+
+    def update_settings(l, i):
+        l.repRate, l.burstCount, l.pulseWidth = 1 + i % 5, 10 + i, 10 + i
+        l.update_settings()
+
+    def transaction(l, i):
+        with l.settings() as s:
+            s.repRate, s.burstCount, s.pulseWidth = 1 + i % 5, 10 + i, 10 + i
+
+    results = {}
+    for reader, mode in (("sleep", Laser.SLEEP_READER), ("event", Laser.EVENT_READER)):
+        for name, reconfigure in (("setters", setters), ("update_settings", update_settings), ("settings()", transaction)):
+            l = _fake_laser(readMode=mode)
+            l.update_settings()
+            samples = []
+            for i in range(n):
+                start = time.perf_counter()
+                reconfigure(l, i)
+                samples.append(time.perf_counter() - start)
+            results[reader + "/" + name] = _summarize(samples)
+    return results
+
+def bench_validation(n=200):
+    """
+    Times rejecting an out of range pulse period, with and without the laser's limits loaded.
+
+    Parameters
+    ----------
+    n : int
+        Number of rejected set_pulse_period() calls to time for each case
+
+    Returns
+    -------
+    results : dict
+        Latency statistics keyed by case.
+    """
+    results = {}
+    for name, load_limits in (("round trip (?5)", False), ("local (limits)", True)):
+        l = _fake_laser(readMode=Laser.SLEEP_READER)
+        if load_limits:
+            l.get_limits()
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            try:
+                l.set_pulse_period(50)
+            except (ValueError, LaserCommandError):
+                pass
+            samples.append(time.perf_counter() - start)
+        results[name] = _summarize(samples)
+    return results
+
+def bench_status_parse(n=10000):
+    """
+    Measures the time and memory spent turning SS? responses into LaserStatusResponse objects.
+
+    Parameters
+    ----------
+    n : int
+        Number of responses to parse in each case
+
+    Returns
+    -------
+    results : dict
+        For an unchanging status word and for a different word every poll: microseconds per parse, and the number of memory blocks
+        and bytes still allocated while every parsed status is kept alive (as a history buffer would).
+    """
+    results = {}
+    cases = (("identical", [b"3075\r"] * n), ("changing", [str(i).encode("ascii") + b"\r" for i in range(n)]))
+    for name, responses in cases:
+        LaserStatusResponse._interned.clear()
+        start = time.perf_counter()
+        for r in responses:
+            LaserStatusResponse(r)
+        elapsed = time.perf_counter() - start
+
+        LaserStatusResponse._interned.clear()
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        kept = [LaserStatusResponse(r) for r in responses]
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        diff = after.compare_to(before, "filename")
+        results[name] = {
+            "parse_us": elapsed / n * 1e6,
+            "blocks": sum(stat.count_diff for stat in diff) - 1, # not counting the list holding them
+            "bytes": sum(stat.size_diff for stat in diff) - sys.getsizeof(kept),
+            "status_bytes": sys.getsizeof(kept[0]),
+        }
+    return results
+
+def bench_framing(n=20000, batch=100):
+    """
+    Times the event reader's framing and parsing of replies on an instant, in-memory port.
+
+    Parameters
+    ----------
+    n : int
+        Number of calls to time for each case
+    batch : int
+        Number of SS? queries in the pipelined batch case
+
+    Returns
+    -------
+    results : dict
+        Microseconds per call, keyed by case.
+    """
+    cases = (
+        ("get_fet_temp()", b"25.5\r", lambda l: l.get_fet_temp(), n),
+        ("get_status()", b"3075\r", lambda l: l.get_status(), n),
+        ("{} pipelined SS?".format(batch), b"3075\r", lambda l: l._send_commands(["SS?"] * batch), n // batch),
+    )
+    results = {}
+    for name, reply, call, count in cases:
+        l = Laser(readMode=Laser.EVENT_READER, pipelined=True)
+        l._ser = _CannedSerial(reply)
+        l.connected = True
+        start = time.perf_counter()
+        for _ in range(count):
+            call(l)
+        results[name] = (time.perf_counter() - start) / count * 1e6
+    return results
+
+def bench_metrics(n=20000):
+    """
+    Measures the cost of recording metrics, on an instant, in-memory port where the library's own time is all there is.
+
+    Parameters
+    ----------
+    n : int
+        Number of get_fet_temp() calls to time for each case
+
+    Returns
+    -------
+    results : dict
+        Microseconds per call with metrics disabled and enabled, and microseconds per get_metrics() snapshot.
+    """
+    results = {}
+    for name, enabled in (("disabled", False), ("enabled", True)):
+        l = Laser(readMode=Laser.EVENT_READER, metrics=enabled)
+        l._ser = _CannedSerial(b"25.5\r")
+        l.connected = True
+        start = time.perf_counter()
+        for _ in range(n):
+            l.get_fet_temp()
+        results[name] = (time.perf_counter() - start) / n * 1e6
+    start = time.perf_counter()
+    for _ in range(n // 100):
+        l.get_metrics()
+    results["snapshot"] = (time.perf_counter() - start) / (n // 100) * 1e6
+    return results
+
+def bench_recording(n=20000):
+    """
+    Measures the cost of recording the serial link, and how fast a recording replays, on an instant, in-memory port.
+
+    Parameters
+    ----------
+    n : int
+        Number of get_fet_temp() calls to time for each case
+
+    Returns
+    -------
+    results : dict
+        Microseconds per call without and with recording, and replaying the recording as fast as possible.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.ujlr")
+        for name, recorded in (("plain", False), ("recording", True)):
+            l = Laser(readMode=Laser.EVENT_READER)
+            l._ser = RecordingSerial(_CannedSerial(b"25.5\r"), path) if recorded else _CannedSerial(b"25.5\r")
+            l.connected = True
+            start = time.perf_counter()
+            for _ in range(n):
+                l.get_fet_temp()
+            results[name] = (time.perf_counter() - start) / n * 1e6
+        l._ser.close()
+
+        l = Laser(readMode=Laser.EVENT_READER)
+        l._ser = ReplaySerial(path, realtime=False, timeout=1)
+        l.connected = True
+        start = time.perf_counter()
+        for _ in range(n):
+            l.get_fet_temp()
+        results["replay"] = (time.perf_counter() - start) / n * 1e6
+    return results
+
+def bench_telemetry_store(n=200000, window=3600):
+    """
+    Measures appending to a TelemetryStore and reading time ranges back, with the records one second apart.
+
+    Parameters
+    ----------
+    n : int
+        Number of records to append
+    window : int
+        Seconds of history each range read covers
+
+    Returns
+    -------
+    results : dict
+        Microseconds per append, per range read as a NumPy view (if NumPy is installed) and per range read as Record tuples.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        with TelemetryStore(directory, segment_size=64 * 2**16) as store: # several segments, so some reads span two
+            start = time.perf_counter()
+            for i in range(n):
+                store.append(i, status=1024, fet_temp=25.0, resonator_temp=24.0, fet_voltage=5.0, diode_current=.1, bank_voltage=48.0, shot_count=i)
+            results["append"] = (time.perf_counter() - start) / n * 1e6
+            starts = range(0, n - window, (n - window) // 50)
+            if telemetrystore.numpy is not None:
+                start = time.perf_counter()
+                for t in starts:
+                    store.read(t, t + window)["fet_temp"].mean()
+                results["read {} s, NumPy".format(window)] = (time.perf_counter() - start) / len(starts) * 1e6
+            start = time.perf_counter()
+            for t in starts:
+                sum(r.fet_temp for r in store.records(t, t + window))
+            results["read {} s, records".format(window)] = (time.perf_counter() - start) / len(starts) * 1e6
+    return results
+
+def bench_fire_latency(n=5, latency=0.0, baudrate=None):
+    """
+    Times fire_laser() from the call until the laser has reported itself active (fire_laser() returns once it has).
+
+    Parameters
+    ----------
+    n : int
+        Number of single shots to time for each reader. Each one takes 0.2 seconds on the fake laser.
+    latency, baudrate :
+        The simulated link, see _LinkSerial
+
+    Returns
+    -------
+    results : dict
+        Latency statistics keyed by reader name.
+    """
+    results = {}
+    for name, mode in (("sleep", Laser.SLEEP_READER), ("event", Laser.EVENT_READER)):
+        l = _fake_laser(latency, baudrate, readMode=mode)
+        _ready_to_fire(l)
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            l.fire_laser()
+            samples.append(time.perf_counter() - start)
+            l.fireThread.join()
+            l._ser._t3.join() # the fake refuses to fire again until the shot is over
+        results[name] = _summarize(samples)
+    return results
+
+def bench_emergency_stop(n=50, latency=0.0, baudrate=None):
+    """
+    Times emergency_stop() while another thread keeps the serial line busy re-sending every setting with update_settings().
+
+    Parameters
+    ----------
+    n : int
+        Number of emergency stops to time for each configuration
+    latency, baudrate :
+        The simulated link, see _LinkSerial
+
+    Returns
+    -------
+    results : dict
+        Latency statistics keyed by configuration name.
+    """
+    configs = (("lock", {}), ("lock/pipelined", {"pipelined": True}), ("io-thread", {"ioThread": True}))
+    results = {}
+    for name, kwargs in configs:
+        l = _fake_laser(latency, baudrate, readMode=Laser.EVENT_READER, **kwargs)
+        stop = threading.Event()
+
+        def busy():
+            while not stop.is_set():
+                l._shadow.clear()
+                l.update_settings()
+
+        worker = threading.Thread(target=busy)
+        worker.start()
+        samples = []
+        for _ in range(n):
+            time.sleep(.002) # land at a random point of the busy thread's traffic
+            l._ser._LA = '1' # pretend to be firing, so the stop is accepted
+            start = time.perf_counter()
+            l.emergency_stop()
+            samples.append(time.perf_counter() - start)
+        stop.set()
+        worker.join()
+        l.disconnect()
+        results[name] = _summarize(samples)
+    return results
+
+def bench_fake_serial(n=20000, batches=(1, 100)):
+    """
+    Measures how many commands per second the FakeSerialLaser itself can process, so it can be told apart from the library's cost.
+
+    Parameters
+    ----------
+    n : int
+        Number of SS? queries to push through the fake for each batch size
+    batches : tuple
+        Numbers of command frames written at once
+
+    Returns
+    -------
+    results : dict
+        Commands per second keyed by batch size, and the seconds taken to drain n replies one byte at a time.
+    """
+    results = {}
+    for batch in batches:
+        ser = fake_serial.Serial(timeout=1, verbose=False)
+        frames = b";LA:SS?\r" * batch
+        start = time.perf_counter()
+        for _ in range(n // batch):
+            ser.write(frames)
+            for _ in range(batch):
+                ser.read_until(b"\r")
+        results["batch of {}".format(batch)] = n / (time.perf_counter() - start)
+
+    ser = fake_serial.Serial(timeout=1, verbose=False)
+    ser.write(b";LA:SS?\r" * n)
+    start = time.perf_counter()
+    while ser.in_waiting:
+        ser.read(1)
+    results["bytewise drain s"] = time.perf_counter() - start
+    return results
+
+def bench_emulator(n=200, latency=0.0, baudrate=None):
+    """
+    Compares round trips and pipelined update_settings() between the simulated link and the emulator process, which is reached through
+    a pseudo-terminal and the real pyserial port. Linux only.
+
+    Parameters
+    ----------
+    n : int
+        Number of SS? round trips to time on each link
+    latency, baudrate :
+        The link: latency is the emulator's processing delay for each command, see _LinkSerial and emulator.Emulator
+
+    Returns
+    -------
+    results : dict
+        Latency statistics keyed by link and case, empty if the emulator can't run here.
+    """
+    if not sys.platform.startswith("linux"):
+        return {}
+    from ujlaser.test.emulator import EmulatorProcess
+
+    def measure(l, name):
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            l._send_command('SS?')
+            samples.append(time.perf_counter() - start)
+        results[name + " SS?"] = _summarize(samples)
+        results[name + " SS?"]["throughput_per_s"] = n / sum(samples)
+        samples = []
+        for _ in range(n // 10):
+            l._shadow.clear()
+            start = time.perf_counter()
+            l.update_settings()
+            samples.append(time.perf_counter() - start)
+        results[name + " settings"] = _summarize(samples)
+
+    results = {}
+    measure(_fake_laser(latency, baudrate, readMode=Laser.EVENT_READER, pipelined=True), "simulated")
+    with EmulatorProcess(baudrate, latency) as emulator:
+        l = Laser(readMode=Laser.EVENT_READER, pipelined=True)
+        l.connect(emulator.port)
+        measure(l, "pty")
+        l.disconnect()
+    return results
+
+# Run by bench_startup() in a fresh interpreter: prints the seconds taken to import lasercontrol, connect to the port given (if any)
+# and get the first status, and the number of modules the import loaded.
+_STARTUP_SCRIPT = """
+import sys, time
+modules = len(sys.modules)
+start = time.perf_counter()
+from ujlaser.lasercontrol import Laser
+imported = time.perf_counter()
+modules = len(sys.modules) - modules
+if len(sys.argv) < 2:
+    print(imported - start, 0, 0, modules)
+    sys.exit()
+l = Laser()
+l.connect(sys.argv[1])
+connected = time.perf_counter()
+l.get_status()
+print(imported - start, connected - imported, time.perf_counter() - connected, modules)
+l.disconnect()
+"""
+
+def bench_startup(n=20, latency=0.0, baudrate=None):
+    """
+    Times a cold start, each in a fresh interpreter: importing lasercontrol, connecting (which opens the port and reads the laser's
+    limits) and the first get_status(). On Linux the connection is to the emulator process, elsewhere only the import is timed.
+
+    Parameters
+    ----------
+    n : int
+        Number of fresh interpreters to start
+    latency, baudrate :
+        The link: latency is the emulator's processing delay for each command, see emulator.Emulator
+
+    Returns
+    -------
+    results : dict
+        Latency statistics for each phase and for all three together. The import's also holds the number of modules it loaded.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root + os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else root
+
+    def measure(port):
+        phases = []
+        for _ in range(n):
+            output = subprocess.check_output([sys.executable, "-c", _STARTUP_SCRIPT] + ([port] if port else []), env=env)
+            phases.append([float(value) for value in output.split()])
+        results = {"import": _summarize([p[0] for p in phases])}
+        results["import"]["modules"] = int(phases[-1][3])
+        if port:
+            results["connect"] = _summarize([p[1] for p in phases])
+            results["first get_status"] = _summarize([p[2] for p in phases])
+            results["total"] = _summarize([sum(p[:3]) for p in phases])
+        return results
+
+    subprocess.check_call([sys.executable, "-c", "import ujlaser.lasercontrol"], env=env) # so no run pays for writing the bytecode
+    if not sys.platform.startswith("linux"):
+        return measure(None)
+    from ujlaser.test.emulator import EmulatorProcess
+    with EmulatorProcess(baudrate, latency) as emulator:
+        return measure(emulator.port)
+
+def bench_simulated_hour(hours=1.0, burst=20, cool_down=40):
+    """
+    Runs arm, fire and cool down cycles on the fake laser in simulated time, with the Laser and the fake sharing a VirtualClock.
+
+    Parameters
+    ----------
+    hours : float
+        Simulated time to run cycles for
+    burst : float
+        Length of each burst in seconds, at 5 Hz
+    cool_down : float
+        Seconds between the end of a burst and the next arm
+
+    Returns
+    -------
+    results : dict
+        Simulated and real seconds taken, the speed up, and the number of cycles, keyed status polls and keepalives sent.
+    """
+    clock = VirtualClock()
+    l = Laser(readMode=Laser.EVENT_READER, clock=clock)
+    l.connect(fake_serial.Serial(timeout=1, verbose=False, clock=clock))
+    l.set_pulse_mode(Laser.BURST)
+    l.set_rep_rate(5)
+    l.set_burst_count(int(burst * 5))
+
+    start, real_start = clock.monotonic(), time.perf_counter()
+    cycles = 0
+    while clock.monotonic() - start < hours * 3600:
+        l.arm()
+        while not l.get_status(0).ready_to_fire:
+            clock.sleep(.25)
+        l.fire_laser()
+        l.fireThread.join()
+        l.disarm()
+        clock.sleep(cool_down)
+        cycles += 1
+    simulated, real = clock.monotonic() - start, time.perf_counter() - real_start
+    keepalives = l._kicker_job.runs
+    l.disconnect()
+    return {"simulated_s": simulated, "real_s": real, "speed_up": simulated / real, "cycles": cycles, "fire_polls": l.fire_polls, "kicker_runs": keepalives}
+
+def bench_concurrency(thread_counts=(8, 16), per_thread=200):
+    """
+    Compares command throughput and latency with many caller threads, between the shared lock and the dedicated I/O thread.
+
+    Parameters
+    ----------
+    thread_counts : tuple
+        The numbers of concurrent caller threads to test
+    per_thread : int
+        Number of SS? queries sent by each caller thread
+
+    Returns
+    -------
+    results : dict
+        Latency statistics, plus throughput in commands per second, keyed by configuration name.
+    """
+    configs = (("lock", {}), ("io-thread", {"ioThread": True}), ("io-thread/pipelined", {"ioThread": True, "pipelined": True}))
+    results = {}
+    for threads in thread_counts:
+        for name, kwargs in configs:
+            l = _fake_laser(readMode=Laser.EVENT_READER, **kwargs)
+            samples = [[] for _ in range(threads)]
+            barrier = threading.Barrier(threads + 1)
+
+            def caller(out):
+                barrier.wait()
+                for _ in range(per_thread):
+                    start = time.perf_counter()
+                    l._send_command('SS?')
+                    out.append(time.perf_counter() - start)
+
+            workers = [threading.Thread(target=caller, args=(out,)) for out in samples]
+            for w in workers:
+                w.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for w in workers:
+                w.join()
+            elapsed = time.perf_counter() - start
+            l.disconnect()
+
+            stats = _summarize([t for out in samples for t in out])
+            stats["throughput_per_s"] = threads * per_thread / elapsed
+            results["{}x{}".format(threads, name)] = stats
+    return results
+
+def bench_fire(duration=2.0, repRate=5):
+    """
+    Fires a burst on the fake laser and measures how hard fire_thread works to track it.
+
+    Parameters
+    ----------
+    duration : float
+        Length of the burst in seconds
+    repRate : int
+        Repetition rate of the burst in Hz
+
+    Returns
+    -------
+    results : dict
+        Number of SS? polls sent during the burst, the process CPU time used, and how long after the burst ended the fire thread noticed.
+    """
+    l = _fake_laser(readMode=Laser.EVENT_READER)
+    ser = l._ser
+    ser._enable, ser._LE, ser._RTF = 1, '1', '1' # skip the 8 second arming time
+    l.set_pulse_mode(Laser.BURST)
+    l.set_rep_rate(repRate)
+    l.set_burst_count(int(duration * repRate))
+
+    polls = [0]
+    write = ser.write
+    def counting_write(data):
+        polls[0] += data.count(b"SS?")
+        return write(data)
+    ser.write = counting_write
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    l.fire_laser()
+    ser._t3.join() # the fake's firing timer, ends when the burst does
+    burst_end = time.perf_counter()
+    l.fireThread.join()
+    done = time.perf_counter()
+    return {
+        "burst_s": burst_end - start,
+        "status_polls": polls[0],
+        "polls_per_s": polls[0] / (done - start),
+        "cpu_s": time.process_time() - cpu_start,
+        "detection_lag_ms": (done - burst_end) * 1e3,
+    }
+
+def bench_scheduler(period=0.01, duration=2.0, work=0.001):
+    """
+    Compares RepeatedTimer with PeriodicScheduler running one periodic job.
+
+    Parameters
+    ----------
+    period : float
+        Period of the job in seconds
+    duration : float
+        How long to run each timer for, in seconds
+    work : float
+        How long each run of the job takes, in seconds
+
+    Returns
+    -------
+    results : dict
+        Threads created, ticks, tick jitter against the ideal grid of deadlines and drift of the last tick, keyed by timer name.
+    """
+    def run(start_timer):
+        ticks = []
+        def job():
+            ticks.append(time.monotonic())
+            time.sleep(work)
+
+        started = [0]
+        thread_start = threading.Thread.start
+        def counting_start(t):
+            started[0] += 1
+            return thread_start(t)
+        threading.Thread.start = counting_start
+        try:
+            start = time.monotonic()
+            stop = start_timer(job, start)
+            time.sleep(duration)
+            stop()
+        finally:
+            threading.Thread.start = thread_start
+
+        errors = [abs(t - (start + (i + 1) * period)) for i, t in enumerate(ticks)]
+        return {
+            "threads_created": started[0],
+            "ticks": len(ticks),
+            "expected_ticks": int(duration / period),
+            "mean_jitter_ms": statistics.mean(errors) * 1e3,
+            "max_jitter_ms": max(errors) * 1e3,
+            "final_drift_ms": errors[-1] * 1e3,
+        }
+
+    def repeated_timer(job, start):
+        return RepeatedTimer(period, job).stop
+
+    def periodic_scheduler(job, start):
+        scheduler = PeriodicScheduler()
+        scheduler.schedule(period, job, start=start + period)
+        return scheduler.stop
+
+    return {"RepeatedTimer": run(repeated_timer), "PeriodicScheduler": run(periodic_scheduler)}
+
+def bench_fleet(sizes=(8, 32), rounds=20, link_delay=0.002):
+    """
+    Compares fleet-wide status snapshots taken one laser at a time with LaserFleet.get_status(), and measures emergency stop skew.
+
+    Parameters
+    ----------
+    sizes : tuple
+        The fleet sizes to test
+    rounds : int
+        Number of snapshots and emergency stops timed for each fleet size
+    link_delay : float
+        Seconds each fake laser takes to answer a command, standing in for the serial link and the laser's processing time
+
+    Returns
+    -------
+    results : dict
+        For each fleet size, snapshot wall time statistics for the sequential and fleet versions, and the start skew and
+        slowest per laser latency of the emergency stops.
+    """
+    results = {}
+    for size in sizes:
+        ports = []
+        for _ in range(size):
+            ser = fake_serial.Serial()
+            def slow_write(data, write=ser.write):
+                time.sleep(link_delay)
+                return write(data)
+            ser.write = slow_write
+            ports.append(ser)
+        fleet = LaserFleet()
+        fleet.connect(ports, keepaliveInterval=0, readMode=Laser.EVENT_READER)
+
+        sequential, parallel, skew, worst = [], [], [], []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for laser in fleet.lasers.values():
+                laser.get_status()
+            sequential.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            fleet.get_status()
+            parallel.append(time.perf_counter() - start)
+            summary = fleet.emergency_stop().summary()
+            skew.append(summary["start_skew_ms"])
+            worst.append(summary["max_ms"])
+        fleet.close()
+
+        results[size] = {
+            "sequential": _summarize(sequential),
+            "fleet": _summarize(parallel),
+            "estop_skew_ms": statistics.mean(skew),
+            "estop_max_ms": statistics.mean(worst),
+        }
+    return results
+
+def _print_results(title, results):
+    print(title)
+    for name, stats in results.items():
+        line = "  {:<24} mean {mean_ms:8.3f} ms  p50 {p50_ms:8.3f} ms  p99 {p99_ms:8.3f} ms  max {max_ms:8.3f} ms".format(name, **stats)
+        if "throughput_per_s" in stats:
+            line += "  {:10.0f} /s".format(stats["throughput_per_s"])
+        print(line)
+
+def _print_campaign(results):
+    print("5 bursts of 2, a diode current change, then 5 single shots, all at 5 Hz:")
+    for name, stats in results.items():
+        print("  {:<24} planned {planned_s:6.3f} s  achieved {achieved_s:6.3f} s  {lost_per_shot_ms:8.3f} ms lost per shot".format(name, **stats))
+
+def _print_startup(results):
+    _print_results("Cold start in a fresh interpreter ({} modules imported):".format(results["import"]["modules"]), results)
+
+def _print_status_parse(results):
+    print("Parsing 10000 SS? responses into LaserStatusResponse objects:")
+    for name, stats in results.items():
+        print("  {:<10} {parse_us:6.3f} us/parse  {blocks:6d} blocks  {bytes:9d} bytes kept  {status_bytes} bytes per status".format(name, **stats))
+
+def _print_us(title):
+    def print_us(results):
+        print(title)
+        for name, us in results.items():
+            print("  {:<24} {:8.2f} us/call".format(name, us))
+    return print_us
+
+def _print_fake_serial(results):
+    print("FakeSerialLaser on its own, SS? queries:")
+    for name, value in results.items():
+        print("  {:<24} {:10.0f} cmd/s".format(name, value) if name.startswith("batch") else "  {:<24} {:10.3f} s".format(name, value))
+
+def _print_simulated_hour(results):
+    print("Arm, 20 s burst and 40 s cool down cycles on a VirtualClock: {simulated_s:.0f} simulated s in {real_s:.2f} real s ({speed_up:.0f}x), {cycles} cycles, {fire_polls} fire polls, {kicker_runs} kicker runs".format(**results))
+
+def _print_scheduler(results):
+    print("Periodic job every 10 ms for 2 s, 1 ms of work per tick:")
+    for name, stats in results.items():
+        print("  {:<18} {threads_created:4d} threads  {ticks:4d}/{expected_ticks} ticks  jitter mean {mean_jitter_ms:7.3f} ms  max {max_jitter_ms:7.3f} ms  final drift {final_drift_ms:8.3f} ms".format(name, **stats))
+
+def _print_fleet(results):
+    for size, stats in results.items():
+        _print_results("Status snapshot of {} lasers, 2 ms link delay:".format(size), {"sequential": stats["sequential"], "LaserFleet": stats["fleet"]})
+        print("  emergency_stop: mean start skew {estop_skew_ms:.3f} ms, slowest laser {estop_max_ms:.3f} ms".format(**stats))
+
+def _print_fire(results):
+    print("fire_thread tracking a {burst_s:.2f} s burst: {status_polls} SS? polls ({polls_per_s:.0f}/s), {cpu_s:.2f} s CPU, end detected {detection_lag_ms:.1f} ms after the burst".format(**results))
+
+# Every benchmark: name -> (function, whether it runs over the simulated link, report printer), in the order they run
+BENCHMARKS = collections.OrderedDict([
+    ("round_trip", (bench_reader, True, lambda r: _print_results("_send_command('SS?') round trip:", r))),
+    ("get_status", (bench_get_status, True, lambda r: _print_results("get_status() throughput:", r))),
+    ("daemon", (bench_daemon, True, lambda r: _print_results("get_status() from 8 concurrent callers, through a LaserDaemon:", r))),
+    ("update_settings", (bench_update_settings, True, lambda r: _print_results("update_settings() wall time (7 commands):", r))),
+    ("fire_latency", (bench_fire_latency, True, lambda r: _print_results("fire_laser() until the laser reports active:", r))),
+    ("emergency_stop", (bench_emergency_stop, True, lambda r: _print_results("emergency_stop() while another thread uploads settings:", r))),
+    ("emulator", (bench_emulator, True, lambda r: _print_results("Simulated link against the emulator process on a pseudo-terminal:", r))),
+    ("campaign", (bench_campaign, True, _print_campaign)),
+    ("startup", (bench_startup, True, _print_startup)),
+    ("reconfigure", (bench_reconfigure, False, lambda r: _print_results("Changing 3 settings between shots:", r))),
+    ("validation", (bench_validation, False, lambda r: _print_results("Rejecting an out of range setting (sleep reader):", r))),
+    ("status_parse", (bench_status_parse, False, _print_status_parse)),
+    ("framing", (bench_framing, False, _print_us("Reply framing and parsing, event reader, instant port:"))),
+    ("metrics", (bench_metrics, False, _print_us("Metrics, get_fet_temp() on an instant port:"))),
+    ("recording", (bench_recording, False, _print_us("Recording the link, get_fet_temp() on an instant port:"))),
+    ("telemetry_store", (bench_telemetry_store, False, _print_us("TelemetryStore, 64 byte records one second apart:"))),
+    ("fake_serial", (bench_fake_serial, False, _print_fake_serial)),
+    ("simulated_hour", (bench_simulated_hour, False, _print_simulated_hour)),
+    ("concurrency", (bench_concurrency, False, lambda r: _print_results("Concurrent callers, SS? per call (threads x transport):", r))),
+    ("scheduler", (bench_scheduler, False, _print_scheduler)),
+    ("fleet", (bench_fleet, False, _print_fleet)),
+    ("fire_polls", (bench_fire, False, _print_fire)),
+])
+
+def _git_commit():
+    """Returns the commit the repository is at, or None if it can't be found."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(names=None, latency=0.0, baudrate=None):
+    """
+    Runs benchmarks and collects their results.
+
+    Parameters
+    ----------
+    names : list
+        Names of the benchmarks to run, keys of BENCHMARKS. Defaults to all of them.
+    latency : float
+        Seconds every write takes on the simulated link
+    baudrate : int
+        Speed of the simulated link, None for an infinitely fast one
+
+    Returns
+    -------
+    report : dict
+        The link settings, the environment (commit, Python version, platform) and the results of each benchmark, keyed by name.
+    """
+    names = list(BENCHMARKS) if names is None else names
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "link": {"latency_s": latency, "baudrate": baudrate},
+        "results": collections.OrderedDict(),
+    }
+    with contextlib.redirect_stdout(io.StringIO()): # FakeSerialLaser prints every command it receives
+        for name in names:
+            function, linked, _ = BENCHMARKS[name]
+            report["results"][name] = function(latency=latency, baudrate=baudrate) if linked else function()
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the ujlaser library against the FakeSerialLaser emulator.")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help="benchmarks to run, all by default: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency of every write on the simulated link, in milliseconds")
+    parser.add_argument("--baud", type=int, default=None, help="baud rate of the simulated link, infinitely fast by default")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE as JSON ('-' for standard output only)")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+
+    report = run(args.benchmarks or None, args.latency_ms / 1e3, args.baud)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    for name, results in report["results"].items():
+        BENCHMARKS[name][2](results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
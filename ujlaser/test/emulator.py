@@ -0,0 +1,208 @@
+"""
+A MicroJewel laser emulator that runs as its own process behind a pseudo-terminal, so the library reaches it through pyserial and
+termios exactly as it would reach the real laser. Linux only.
+
+Run from the root of the repository with:
+    python -m ujlaser.test.emulator [--baud 115200] [--delay-ms 0.5]
+
+The first line it prints is the path of its serial port, such as /dev/pts/5, which a Laser connects to unchanged:
+    l = Laser()
+    l.connect('/dev/pts/5')
+
+Commands are answered by a FakeSerialLaser. The link is throttled to the baud rate (10 bits per byte, as with 8N1): a command only
+reaches the laser once its last byte would have arrived, the laser takes the processing delay to answer it, and the reply is only
+written to the port once its last byte would have been sent.
+"""
+import argparse
+import heapq
+import os
+import queue
+import select
+import subprocess
+import sys
+import threading
+import time
+import tty
+
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+
+class Emulator:
+    """
+    Serves a FakeSerialLaser on a new pseudo-terminal, from threads of the calling process.
+
+    The emulator keeps its own handle on the terminal side of the pseudo-terminal open, so clients can open and close the port as often
+    as they like.
+    """
+    def __init__(self, baudrate=115200, delay=0.0, verbose=False):
+        """
+        Parameters
+        ----------
+        baudrate : int
+            Speed of the emulated link, None for an unthrottled one
+        delay : float
+            Seconds the laser takes to process each command before it starts to reply
+        verbose : bool
+            Print every command received, see FakeSerialLaser.Serial
+        """
+        self.baudrate = baudrate
+        self.delay = delay
+        self.laser = fake_serial.Serial(timeout=0, verbose=verbose)
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave) # no echo or line editing, and \r is passed through as is
+        self.port = os.ttyname(self._slave)
+        self._byte_time = 10 / baudrate if baudrate else 0.0
+        self._commands = queue.Queue() # (time the command's last byte arrived, command frame), None to stop
+        self._replies = []              # heap of (time the reply's last byte is sent, sequence number, reply)
+        self._replies_ready = threading.Condition()
+        self._sequence = 0
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Starts serving in background threads."""
+        for target in (self._receive, self._process, self._transmit):
+            t = threading.Thread(target=target, name="ujlaser-emulator" + target.__name__, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        """Stops serving and closes the pseudo-terminal."""
+        self._stop.set()
+        self._commands.put(None)
+        with self._replies_ready:
+            self._replies_ready.notify()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _receive(self):
+        """Reads commands from the port and works out when the last byte of each one would have arrived."""
+        pending = bytearray()
+        line_free = 0.0 # when the incoming line finishes receiving what has been read so far
+        while not self._stop.is_set():
+            if not select.select([self._master], [], [], 0.1)[0]:
+                continue
+            data = os.read(self._master, 4096)
+            start = max(time.monotonic(), line_free)
+            line_free = start + len(data) * self._byte_time
+            offset = len(pending)
+            pending += data
+            end = 0
+            for i in range(offset, len(pending)):
+                if pending[i] in b"\r\n":
+                    if i > end: # \r\n terminators leave an empty frame behind
+                        self._commands.put((start + (i + 1 - offset) * self._byte_time, bytes(pending[end:i + 1])))
+                    end = i + 1
+            del pending[:end]
+
+    def _process(self):
+        """Answers commands in order, each one delay seconds after it has arrived and the previous one has been answered."""
+        laser = self.laser
+        busy_until = 0.0
+        while True:
+            item = self._commands.get()
+            if item is None:
+                return
+            arrived, frame = item
+            busy_until = max(arrived, busy_until) + self.delay
+            _sleep_until(busy_until)
+            laser.write(frame)
+            reply = laser.read(laser.in_waiting)
+            with self._replies_ready:
+                heapq.heappush(self._replies, (busy_until, self._sequence, reply))
+                self._sequence += 1
+                self._replies_ready.notify()
+
+    def _transmit(self):
+        """Writes replies to the port once their last byte would have been sent over the outgoing line."""
+        line_free = 0.0
+        while True:
+            with self._replies_ready:
+                while not self._replies and not self._stop.is_set():
+                    self._replies_ready.wait()
+                if self._stop.is_set():
+                    return
+                ready, _, reply = heapq.heappop(self._replies)
+            line_free = max(ready, line_free) + len(reply) * self._byte_time
+            _sleep_until(line_free)
+            os.write(self._master, reply)
+
+def _sleep_until(deadline):
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+class EmulatorProcess:
+    """
+    Runs an emulator in a separate process, so it doesn't compete with the code under test for the interpreter. port is the path to
+    connect to. Use as a context manager, or call close() to stop the process.
+    """
+    def __init__(self, baudrate=115200, delay=0.0):
+        """
+        Parameters
+        ----------
+        baudrate : int
+            Speed of the emulated link, None for an unthrottled one
+        delay : float
+            Seconds the laser takes to process each command before it starts to reply
+        """
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = root + os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else root
+        command = [sys.executable, "-m", "ujlaser.test.emulator", "--baud", str(baudrate or 0), "--delay-ms", repr(delay * 1e3),
+                   "--exit-on-eof"]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.port = self._process.stdout.readline().decode("ascii").strip()
+        if not self.port:
+            self._process.wait()
+            raise RuntimeError("The laser emulator failed to start")
+
+    def close(self):
+        """Stops the emulator process."""
+        if self._process.poll() is None:
+            self._process.stdin.close() # the emulator exits when its standard input closes
+            try:
+                self._process.wait(5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emulates a MicroJewel laser on a pseudo-terminal and prints the path of its port.")
+    parser.add_argument("--baud", type=int, default=115200, help="baud rate the link is throttled to, 0 for no throttling")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="time the laser takes to process each command, in milliseconds")
+    parser.add_argument("--verbose", action="store_true", help="print every command received")
+    parser.add_argument("--exit-on-eof", action="store_true", help="stop when standard input is closed, instead of when interrupted")
+    args = parser.parse_args(argv)
+
+    with Emulator(args.baud or None, args.delay_ms / 1e3, args.verbose) as emulator:
+        print(emulator.port, flush=True)
+        try:
+            if args.exit_on_eof:
+                sys.stdin.buffer.read()
+            else:
+                threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
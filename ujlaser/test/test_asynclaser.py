@@ -0,0 +1,135 @@
+import asyncio
+import unittest
+from ujlaser.asynclaser import AsyncLaser, SyncLaser
+from ujlaser.lasercontrol import LaserCommandError, LaserFireError
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestAsyncLaser(unittest.TestCase):
+
+    def test_not_connected(self):
+        """AsyncLaser should raise a ConnectionError if a command is sent without being connected to a serial device."""
+        l = AsyncLaser()
+        with self.assertRaises(ConnectionError):
+            asyncio.run(l.get_status())
+
+    def test_concurrent_queries(self):
+        """Many queries may be outstanding at once, each one should get its own response back."""
+        async def run():
+            l = AsyncLaser()
+            await l.connect(fake_serial.Serial())
+            results = await asyncio.gather(l.get_status(), l.get_system_shot_count(), l.get_laser_ID(), l.get_fet_temp(), l.is_armed())
+            await l.disconnect()
+            return results
+
+        status, shot_count, laser_id, fet_temp, armed = asyncio.run(run())
+        assert int(status) == 1024
+        assert status.ready_to_enable
+        assert shot_count == 0
+        assert "MicroJewel" in laser_id
+        assert fet_temp == 0.0
+        assert armed == False
+
+    def test_setters(self):
+        """Setters should update the object's properties on an OK response, and raise errors on invalid values or error responses."""
+        async def run():
+            l = AsyncLaser()
+            ser = fake_serial.Serial()
+            await l.connect(ser)
+
+            assert await l.set_burst_count(20)
+            assert l.burstCount == ser._burstCount == 20
+            assert await l.set_rep_rate(5)
+            assert l.burstDuration == 4
+
+            with self.assertRaises(ValueError):
+                await l.set_rep_rate(10)
+
+            with self.assertRaises(ValueError):
+                await l.set_pulse_period(-1)
+            with self.assertRaises(ValueError):
+                await l.set_pulse_period(50) # Out of the range the fake laser reported when connecting
+            assert l.pulsePeriod == 0
+            assert await l.get_pulse_period_range() == l._limits["PE"]
+
+            l._limits.clear() # without the limits, the laser is left to refuse it
+            with self.assertRaises(LaserCommandError):
+                await l.set_pulse_period(50)
+            assert l.pulsePeriod == 0
+
+            assert await l.update_settings() == [b"OK\r"] * 5 # the burst count and repetition rate are already set
+            assert await l.update_settings() == []
+            await l.disconnect()
+
+        asyncio.run(run())
+
+    def test_resync_after_timeout(self):
+        """A reply that arrives after its command timed out shouldn't be taken for the reply to the next command."""
+        async def run():
+            l = AsyncLaser(metrics=True)
+            ser = fake_serial.Serial(verbose=False)
+            await l.connect(ser, timeout=.1)
+            await l.set_burst_count(20)
+
+            held = []
+            write = ser.write
+            def late_write(data):
+                if data.endswith(b"BC?\r") and not held:
+                    held.append(data) # answered only once something else is written
+                    return len(data)
+                if held and held[0] is not None:
+                    write(held[0])
+                    held[0] = None
+                return write(data)
+            ser.write = late_write
+
+            assert await l._send_command("BC?") is None
+            assert await l.get_system_shot_count() == 0
+            assert await l._send_command("BC?") == b"20\r"
+            assert l.get_metrics()["timeouts"] == 1
+            await l.disconnect()
+
+        asyncio.run(run())
+
+    def test_fire_disabled(self):
+        """A shot ended by the laser becoming disabled should be reported by wait_fire(), and still be followed by FL 0."""
+        async def run():
+            l = AsyncLaser()
+            ser = fake_serial.Serial(verbose=False)
+            await l.connect(ser)
+            ser._enable, ser._LE, ser._RTF = 1, '1', '1' # skip the 8 second arming time
+            await l.set_pulse_mode(AsyncLaser.BURST)
+            await l.set_rep_rate(5)
+            await l.set_burst_count(2)
+            await l.fire_laser()
+
+            writes = []
+            write = ser.write
+            ser.write = lambda data: (writes.append(data), write(data))[1]
+            ser._enable, ser._LE, ser._LA = 0, '0', '0' # disabled mid-shot
+            with self.assertRaises(LaserFireError):
+                await l.wait_fire()
+            assert writes[-1].endswith(b"FL 0\r")
+            await l.disconnect()
+
+        asyncio.run(run())
+
+    def test_sync_facade(self):
+        """SyncLaser should expose the AsyncLaser coroutines as blocking methods."""
+        l = SyncLaser()
+        l.connect(fake_serial.Serial())
+        assert l.connected
+        assert int(l.get_status()) == 1024
+        assert l.set_diode_trigger(1)
+        assert l.diodeTrigger == 1
+
+        l.editConstants(burstCount=5, repRate=2)
+        assert l.burstCount == l._ser._burstCount == 5 and l.burstDuration == 2.5
+        assert l.laser_reset()
+        assert l.burstCount == l._ser._burstCount == 10 and l.diodeTrigger == l._ser._diodeTrigger == 0
+        l.laser_refresh()
+        l.close()
+        assert not l.connected
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import threading
+import unittest
+from ujlaser.campaign import Burst, Campaign, Configure, Pause, SingleShots
+from ujlaser.clock import VirtualClock
+from ujlaser.lasercontrol import Laser, LaserCommandError
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestCampaign(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock(idle=.005) # generous, so that a slow machine never looks idle
+        self.laser = Laser(readMode=Laser.EVENT_READER, clock=self.clock, keepaliveInterval=0)
+        self.laser.connect(fake_serial.Serial(timeout=1, verbose=False, clock=self.clock))
+
+    def tearDown(self):
+        self.laser.disconnect()
+
+    def arm(self):
+        self.laser.arm()
+        while not self.laser.get_status(0).ready_to_fire:
+            self.clock.sleep(.25)
+
+    def test_validation(self):
+        """Every invalid step should be reported at once, before anything is sent to the laser."""
+        with self.assertRaises(ValueError) as raised:
+            Campaign(self.laser, [Burst(20, rate=5), Burst(20, rate=10), Configure(diodeCurrent=-1), SingleShots(0, rate=5), Pause(1), "FL 1"])
+        message = str(raised.exception)
+        for step in ("step 2", "step 3", "step 4", "step 6"):
+            assert step in message, message
+        assert "step 1 " not in message and "step 5 " not in message
+
+        with self.assertRaises(LaserCommandError): # not armed
+            Campaign(self.laser, [Burst(5, rate=5)]).run()
+
+    def test_run(self):
+        """A campaign should fire every shot with its own settings, back to back, and report planned against achieved time."""
+        self.arm()
+        campaign = Campaign(self.laser, [Burst(5, rate=5, repeat=3), Configure(diodeCurrent=2.5), Pause(2), SingleShots(4, rate=2)])
+        report = campaign.run()
+
+        assert [r.shots for r in report] == [3, 0, 0, 4]
+        assert [r.planned for r in report] == [3.0, 0.0, 2.0, 2.0]
+        for r in report:
+            assert r.planned <= r.achieved <= r.planned + .05 * (r.shots + 1), r
+        assert self.laser._ser._diodeCurrent == 2.5 and self.laser._ser._pulseMODE == Laser.SINGLE_SHOT
+        assert self.laser._ser._userShotCount == 7
+        summary = report.summary()
+        assert summary["shots"] == 7 and not summary["aborted"]
+
+    def test_emergency_stop(self):
+        """An emergency stop from another thread should end the campaign in the middle of a burst."""
+        self.arm()
+        campaign = Campaign(self.laser, [Burst(50, rate=5, repeat=10)])
+        stopper = threading.Thread(target=lambda: (self.clock.sleep(25), self.laser.emergency_stop()))
+        stopper.start()
+        report = campaign.run()
+        stopper.join()
+        assert report.aborted and report[0].shots == 2
+        assert 25 <= report[0].achieved <= 26
+        assert self.laser._ser._LA == '0'
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from ujlaser import cli
+from ujlaser.clock import VirtualClock
+from ujlaser.lasercontrol import Laser
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock(idle=.005)
+        self.laser = Laser(readMode=Laser.EVENT_READER, clock=self.clock, keepaliveInterval=0)
+        self.laser.connect(fake_serial.Serial(timeout=1, verbose=False, clock=self.clock))
+
+    def tearDown(self):
+        self.laser.disconnect()
+
+    def run_cli(self, *argv):
+        """Runs the command on the fake laser, returns its exit status and what it printed."""
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            status = cli.main(list(argv), laser=self.laser)
+        return status, out.getvalue()
+
+    def test_commands(self):
+        """The subcommands should arm, fire with the laser's own settings, stop and report, and fail with a message when refused."""
+        status, out = self.run_cli("--json", "status")
+        assert status == 0 and json.loads(out) == dict(json.loads(out), status=1024, ready_to_enable=True, laser_enabled=False)
+
+        self.laser._ser._pulseMODE = Laser.BURST # set behind the Laser object's back, fire should time the burst from the laser's settings
+        self.laser._ser._burstCount = 4
+        self.laser._ser._repetitionRate = 2
+        assert self.run_cli("fire")[0] == 1 # not armed
+        assert self.run_cli("arm", "--wait", "10") == (0, "Laser armed\n")
+        start = self.clock.monotonic()
+        assert self.run_cli("fire") == (0, "Fired\n")
+        assert 2 <= self.clock.monotonic() - start <= 2.5
+        assert self.laser._ser._userShotCount == 1
+
+        status, out = self.run_cli("--json", "telemetry")
+        telemetry = json.loads(out)
+        assert telemetry["status"] & 1 and telemetry["shot_count"] == self.laser._ser._systemShotCount
+
+        status, out = self.run_cli("estop", "--disarm") # the fake refuses FL 0 when it isn't firing
+        assert status == 0 and out.startswith("Laser is not firing") and out.endswith(", laser disarmed\n")
+        assert not self.laser.get_status(0).laser_enabled
+
+    def test_fire_failure(self):
+        """fire should report an error and fail when the laser stops firing because it became disabled during the shot."""
+        assert self.run_cli("arm", "--wait", "10")[0] == 0
+        ser = self.laser._ser
+        ser._pulseMODE = Laser.BURST # 10 s
+        status = type(ser)._QUERIES["SS"]
+        polls = []
+        def disabled_mid_shot(fake):
+            if getattr(fake, "_t3", None) is not None: # FL 1 was accepted
+                polls.append(fake)
+            return 1024 if len(polls) > 1 else status(fake) # active for fire_laser's check, disabled for the fire thread
+        ser._QUERIES = dict(ser._QUERIES, SS=disabled_mid_shot)
+        with mock.patch("threading.excepthook"): # the fire thread still raises the error, as well as recording it
+            status_code, out = self.run_cli("fire")
+        assert status_code == 1 and "Fired" not in out
+        assert "ujlaser: error: Laser has become disabled" in out
+
+    def test_batch(self):
+        """A batch file should be sent in one write, with a result for each command line and a failing status if any was refused."""
+        writes = []
+        write = self.laser._ser.write
+        self.laser._ser.write = lambda data: (writes.append(data), write(data))[1]
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("# burst setup\nBC 20\n\nRR 5\nBC?\nXX 1\n")
+        try:
+            status, out = self.run_cli("batch", f.name)
+            assert len(writes) == 1
+            assert status == 1
+            lines = [line.split("\t") for line in out.splitlines()]
+            assert lines[:3] == [["2", "BC 20", "OK"], ["4", "RR 5", "OK"], ["5", "BC?", "20"]]
+            assert lines[3][:3] == ["6", "XX 1", "?1"]
+
+            status, out = self.run_cli("--json", "batch", f.name)
+            results = [json.loads(line) for line in out.splitlines()]
+            assert [r["ok"] for r in results] == [True, True, True, False] and results[3]["error"]
+        finally:
+            os.remove(f.name)
+
+    def test_monitor(self):
+        """monitor should sample at a steady rate, print telemetry every sample and a status line only when the status changes."""
+        self.laser.arm() # ready to fire after 8 s
+        out = io.StringIO()
+        start = self.clock.monotonic()
+        cli.monitor(self.laser, rate=2, count=21, out=out)
+        assert 10 <= self.clock.monotonic() - start <= 10.5
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert sum(line["type"] == "telemetry" for line in lines) == 21
+        changes = [line for line in lines if line["type"] == "status"]
+        assert len(changes) == 2, changes
+        assert changes[0]["previous"] is None and changes[0]["set"] == ["ready_to_enable"]
+        assert changes[1]["set"] == ["laser_enabled", "ready_to_fire"] and changes[1]["cleared"] == []
+
+        self.laser._ser._QUERIES = dict(self.laser._ser._QUERIES, SS=lambda fake: 0x10000 | 1024) # never interned, a new object every sample
+        out = io.StringIO()
+        cli.monitor(self.laser, rate=2, count=5, telemetry=False, out=out)
+        assert len(out.getvalue().splitlines()) == 1 # the status only changed on the first sample
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "the emulator needs Linux pseudo-terminals")
+    def test_console_command(self):
+        """python -m ujlaser.cli should connect to a port by path and print the laser's status."""
+        from ujlaser.test.emulator import EmulatorProcess
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        with EmulatorProcess() as emulator:
+            out = subprocess.check_output([sys.executable, "-m", "ujlaser.cli", "--json", "status"], cwd=root,
+                                          env=dict(os.environ, UJLASER_PORT=emulator.port))
+        assert json.loads(out)["status"] == 1024
+        result = subprocess.run([sys.executable, "-m", "ujlaser.cli", "--port", "/nonexistent", "status"], cwd=root,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert result.returncode == 1 and result.stderr.startswith(b"ujlaser: error:")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+from ujlaser.clock import VirtualClock
+from ujlaser.lasercontrol import Laser
+from ujlaser.scheduler import PeriodicScheduler
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestClock(unittest.TestCase):
+
+    def test_virtual_clock(self):
+        """Sleeps and waits should end at exactly their simulated deadline, in deadline order, without waiting in real time."""
+        clock = VirtualClock(idle=.005) # generous, so that a slow machine never looks idle
+        woken = []
+
+        def sleeper(seconds):
+            clock.sleep(seconds)
+            woken.append((seconds, clock.monotonic()))
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=sleeper, args=(seconds,)) for seconds in (30, 10, 20)]
+        for t in threads:
+            t.start()
+        clock.sleep(3600)
+        for t in threads:
+            t.join()
+        assert woken == [(10, 10), (20, 20), (30, 30)]
+        assert clock.monotonic() == 3600
+        assert time.monotonic() - start < 5
+
+        event = threading.Event()
+        assert not clock.wait(event, 5)
+        assert clock.monotonic() == 3605
+        setter = threading.Thread(target=lambda: (clock.sleep(2), event.set()))
+        setter.start()
+        assert clock.wait(event, 10)
+        assert clock.monotonic() == 3607
+        setter.join()
+
+        clock.advance(1.5)
+        assert clock.monotonic() == 3608.5
+
+        scheduler = PeriodicScheduler(clock=clock)
+        job = scheduler.schedule(1, lambda: None)
+        clock.sleep(100.5)
+        scheduler.stop()
+        assert job.runs == 100 and job.skipped == 0
+
+    def test_simulated_laser(self):
+        """A Laser and fake laser sharing a VirtualClock should arm, fire a long burst and keep the link alive in simulated time."""
+        clock = VirtualClock(idle=.005) # generous, so that a slow machine never looks idle
+        l = Laser(readMode=Laser.EVENT_READER, clock=clock)
+        l.connect(fake_serial.Serial(timeout=1, verbose=False, clock=clock))
+
+        start = time.monotonic()
+        l.arm()
+        armed = clock.monotonic()
+        while not l.get_status(0).ready_to_fire:
+            clock.sleep(.25)
+        assert 8 <= clock.monotonic() - armed <= 8.5
+
+        l.set_pulse_mode(Laser.BURST)
+        l.set_rep_rate(5)
+        l.set_burst_count(300) # a minute long burst
+        fired = clock.monotonic()
+        l.fire_laser()
+        l.fireThread.join()
+        assert 60 <= clock.monotonic() - fired <= 60.5
+        assert 0 < l.fire_polls < 200
+        assert l._kicker_job.runs >= 100 # every half second of simulated time
+        assert time.monotonic() - start < 30
+        l.disconnect()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from ujlaser import cli
+from ujlaser.daemon import DaemonSerial, LaserDaemon
+from ujlaser.lasercontrol import Laser
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.received = [] # every command the fake laser received, in order
+        self.delay = 0.0
+        ser = fake_serial.Serial(timeout=1, verbose=False)
+        write = ser.write
+        def recording_write(data):
+            self.received.extend(frame.partition(b":")[2].decode() for frame in data.split(b"\r") if frame)
+            if self.delay:
+                time.sleep(self.delay)
+            return write(data)
+        ser.write = recording_write
+        self.laser = Laser(readMode=Laser.EVENT_READER, keepaliveInterval=0)
+        self.laser.connect(ser)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect()
+        self.laser.disconnect()
+
+    def client(self, address):
+        l = Laser(readMode=Laser.EVENT_READER, keepaliveInterval=0)
+        l.connect(DaemonSerial(address))
+        self.clients.append(l)
+        return l
+
+    def test_clients(self):
+        """Clients should share one laser, and concurrent status reads should be served from the cache."""
+        with LaserDaemon(self.laser, "tcp://127.0.0.1:0", status_max_age=1) as daemon:
+            a, b = self.client(daemon.address), self.client(daemon.address)
+            assert a.set_burst_count(25)
+            assert b._send_command('BC?') == b"25\r"
+            assert daemon.clients == 2
+
+            del self.received[:]
+            statuses = []
+            def poll():
+                for _ in range(20):
+                    statuses.append(b.get_status(0))
+            threads = [threading.Thread(target=poll) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert len(statuses) == 160 and all(s.ready_to_enable for s in statuses)
+            assert self.received.count("SS?") == 1
+
+            a.arm() # a state changing command drops the cached status
+            assert self.received[-1] == "EN 1"
+            assert b.get_status(0) == statuses[0] and self.received[-1] == "SS?"
+
+    def test_safety_commands(self):
+        """FL 0 and EN 0 should be sent ahead of the commands queued before them, while every client gets its replies in order."""
+        with LaserDaemon(self.laser, "tcp://127.0.0.1:0", max_batch=8) as daemon:
+            self.delay = .01 # every batch takes at least 10 ms on the link
+            host, port = daemon.address[len("tcp://"):].rsplit(":", 1)
+            sent = len(self.received) # the commands of setUp's connect
+            busy = socket.create_connection((host, int(port)))
+            busy.sendall(b";LA:BC 10\r" * 100)
+            time.sleep(.03)
+            safety = DaemonSerial(daemon.address)
+            safety.write(b";LA:BC?\r;LA:EN 0\r")
+            assert safety.read_until() == b"10\r" and safety.read_until() == b"OK\r"
+            assert 0 < self.received.index("EN 0") - sent < 40, self.received[sent:]
+            assert self.received.index("EN 0") < self.received.index("BC?")
+
+            replies = b""
+            busy.settimeout(5)
+            while len(replies) < 300:
+                replies += busy.recv(4096)
+            assert replies == b"OK\r" * 100
+            busy.close()
+            safety.close()
+
+    def test_safety_cancels_arming(self):
+        """An EN 1 still waiting when EN 0 arrives should be dropped with an error reply, so the laser ends up disarmed."""
+        with LaserDaemon(self.laser, "tcp://127.0.0.1:0", max_batch=8) as daemon:
+            self.delay = .01
+            host, port = daemon.address[len("tcp://"):].rsplit(":", 1)
+            busy = socket.create_connection((host, int(port)))
+            busy.sendall(b";LA:BC 10\r" * 100)
+            time.sleep(.03)
+            client = DaemonSerial(daemon.address)
+            client.write(b";LA:EN 1\r;LA:FL 1\r;LA:BC?\r;LA:EN 0\r")
+            assert [client.read_until() for _ in range(4)] == [b"?8\r", b"?8\r", b"10\r", b"OK\r"]
+            assert "EN 1" not in self.received and "FL 1" not in self.received
+
+            replies = b""
+            busy.settimeout(5)
+            while len(replies) < 300:
+                replies += busy.recv(4096)
+            busy.close()
+            client.close()
+        assert not self.laser.get_status(0).laser_enabled
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix sockets are not available")
+    def test_unix_socket_and_refresh(self):
+        """The ujlaser command should work through a Unix socket, with telemetry served from the cache the daemon keeps fresh."""
+        directory = tempfile.TemporaryDirectory()
+        address = "unix://" + os.path.join(directory.name, "laser.sock")
+        try:
+            sent = len(self.received)
+            with LaserDaemon(self.laser, address, status_max_age=5, telemetry_max_age=5, refresh=2) as daemon:
+                time.sleep(.1) # the first refresh happens at once
+                assert len(self.received) == sent + 7
+                sent = len(self.received)
+
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    assert cli.main(["--port", daemon.address, "--json", "telemetry"]) == 0
+                telemetry = json.loads(out.getvalue())
+                assert telemetry["status"] == 1024 and telemetry["shot_count"] == 0
+                assert self.received[sent:] == ["ID?"] + [key + bound for key in Laser.LIMITS for bound in (":MIN?", ":MAX?")] # connecting, the telemetry came from the cache
+            assert not os.path.exists(address[len("unix://"):])
+        finally:
+            directory.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import sys
+import time
+import unittest
+from ujlaser.lasercontrol import Laser
+from ujlaser.test.emulator import EmulatorProcess
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "the emulator needs Linux pseudo-terminals")
+class TestEmulator(unittest.TestCase):
+
+    def test_connect_by_path(self):
+        """A Laser should connect to the emulator's port by path, and see round trips no faster than the throttled link allows."""
+        with EmulatorProcess(baudrate=9600, delay=.002) as emulator:
+            l = Laser(readMode=Laser.EVENT_READER, pipelined=True)
+            l.connect(emulator.port)
+            try:
+                assert l.get_status().ready_to_enable
+                start = time.perf_counter()
+                assert l._send_command('BC?') == b"10\r"
+                assert time.perf_counter() - start >= (len(b";LA:BC?\r") + len(b"10\r")) * 10 / 9600 + .002
+
+                l.set_burst_count(25)
+                l._shadow.clear()
+                l.update_settings() # pipelined, every command in one write
+                assert l._send_command('BC?') == b"25\r"
+            finally:
+                l.disconnect()
+
+
+if __name__ == "__main__":
+    unittest.main()
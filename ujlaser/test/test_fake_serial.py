@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestFakeSerial(unittest.TestCase):
+
+    def setUp(self):
+        self.ser = fake_serial.Serial(timeout=0.05, verbose=False)
+
+    def test_commands(self):
+        """Queries, actions and every kind of malformed command should get the laser's response, in order, one per frame."""
+        ser = self.ser
+        ser.write(b";LA:SS?\r;LA:BC 25\r;LA:BC?\r;LA:RR:MAX?\r")
+        assert ser.in_waiting == len(b"1024\rOK\r25\r5\r")
+        assert [ser.read_until(b"\r") for _ in range(4)] == [b"1024\r", b"OK\r", b"25\r", b"5\r"]
+
+        for command, response in ((b";LA:XX?\r", b"?7\r"), (b";LA:BC 0\r", b"?5\r"), (b";LA:BC x\r", b"?5\r"), (b";LA:BC\r", b"?5\r"),
+                                  (b";LA:XX\r", b"?3\r"), (b";LA:SS 1\r", b"?6\r"), (b";LA:XX 1\r", b"?1\r"), (b";LB:SS?\r", b"?1\r"),
+                                  (b";LA:\r", b"?2\r"), (b";LA:SS?", b"?1\r"), (b";LA:FL 0\r", b"?8\r")):
+            ser.write(command)
+            assert ser.read(ser.in_waiting) == response, command
+
+        ser.write(b";LA:EM 1\r\n;LA:SS?\n")
+        assert ser.readline() == b"OK\r"
+        assert int(ser.readline()) & 4096 # low power mode
+
+        with self.assertRaises(TypeError):
+            ser.write(";LA:SS?\r")
+
+    def test_timeouts(self):
+        """Reads should return what has arrived once the timeout expires, and wait for data written by another thread until then."""
+        ser = self.ser
+        start = time.monotonic()
+        assert ser.read(4) == b""
+        assert time.monotonic() - start >= 0.04
+        ser.write(b";LA:SS?\r")
+        assert ser.read(10) == b"1024\r" # partial read
+        ser.write(b";LA:SS?\r")
+        assert ser.read_until(b"\n") == b"1024\r"
+
+        ser.timeout = 0
+        ser.write(b";LA:SS?\r")
+        assert ser.read(2) == b"10"
+        ser.reset_input_buffer()
+        assert ser.in_waiting == 0 and ser.read(1) == b""
+
+        ser.timeout = None
+        timer = threading.Timer(0.02, ser.write, args=(b";LA:BC?\r",))
+        timer.start()
+        assert ser.read_until(b"\r") == b"10\r"
+        timer.join()
+
+        buffer = bytearray(8)
+        ser.timeout = 0.05
+        ser.write(b";LA:SS?\r")
+        assert ser.readinto(buffer) == 5 and buffer[:5] == b"1024\r"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import time
+import unittest
+from ujlaser.lasercontrol import Laser
+from ujlaser.fleet import LaserFleet
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestFleet(unittest.TestCase):
+
+    def test_fleet(self):
+        """A fleet of fake lasers should connect, report status, fire and emergency stop together, with per laser results."""
+        fleet = LaserFleet()
+        results = fleet.connect([fake_serial.Serial() for _ in range(24)], keepaliveInterval=0, readMode=Laser.EVENT_READER)
+        assert len(fleet) == 24
+        assert results.ok
+        assert results.summary()["lasers"] == 24
+
+        snapshot = fleet.get_status()
+        assert snapshot.ok
+        assert all(not status.laser_enabled for status in snapshot.returned.values())
+
+        fleet.add("unplugged", Laser()) # never connected, every command fails
+        snapshot = fleet.get_status()
+        assert not snapshot.ok
+        assert list(snapshot.errors) == ["unplugged"]
+        assert isinstance(snapshot.errors["unplugged"], ConnectionError)
+        assert snapshot.summary()["failures"] == 1
+
+        telemetry = fleet.get_telemetry()
+        assert list(telemetry.errors) == ["unplugged"]
+        assert all(t["status"] == 1024 and t["shot_count"] == 0 for t in telemetry.returned.values())
+
+        for name, laser in fleet.lasers.items():
+            if name != "unplugged":
+                laser._ser._enable, laser._ser._LE, laser._ser._RTF = 1, '1', '1' # skip the 8 second arming time
+                laser.set_pulse_mode(Laser.BURST)
+                laser.set_rep_rate(5)
+                laser.set_burst_count(25) # 5 seconds
+        fired = fleet.fire()
+        assert list(fired.errors) == ["unplugged"]
+
+        workers = set(fleet._stop_threads.values())
+        assert len(workers) == 25 and all(worker.is_alive() for worker in workers) # parked before the stop is needed
+        start = time.monotonic()
+        stopped = fleet.emergency_stop()
+        assert set(fleet._stop_threads.values()) == workers
+        assert time.monotonic() - start < 1
+        assert list(stopped.errors) == ["unplugged"]
+        assert stopped.summary()["start_skew_ms"] < 100
+        for name, laser in fleet.lasers.items():
+            if name != "unplugged":
+                laser.fireThread.join(1)
+                assert not laser.fireThread.is_alive()
+
+        fleet.close()
+        assert not any(laser.connected for laser in fleet.lasers.values())
+        assert not any(worker.is_alive() for worker in workers)
+
+
+if __name__ == "__main__":
+    unittest.main()
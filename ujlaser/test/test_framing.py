@@ -0,0 +1,75 @@
+import unittest
+from ujlaser.framing import ResponseFramer, error_code, parse_float, parse_int
+
+class ChunkedSerial:
+    """A serial-like object that hands out the given data a few bytes at a time."""
+    def __init__(self, data, chunk):
+        self.data = data
+        self.chunk = chunk
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.data))
+
+    def read(self, n):
+        data, self.data = self.data[:n], self.data[n:]
+        return data
+
+class ReadintoSerial(ChunkedSerial):
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+class TestFraming(unittest.TestCase):
+
+    def test_framer(self):
+        """Frames split across reads, or several to a read, should come out whole and in order, as views into the buffer."""
+        for cls in (ChunkedSerial, ReadintoSerial):
+            for chunk in (1, 3, 7, 100):
+                ser = cls(b"OK\r3075\r?5\r25.5\r12", chunk)
+                framer = ResponseFramer(size=8) # small enough to have to compact and grow
+                frames = []
+                while ser.in_waiting:
+                    framer.fill(ser, ser.in_waiting)
+                    frame = framer.next_frame()
+                    while frame is not None:
+                        assert isinstance(frame, memoryview)
+                        frames.append(bytes(frame))
+                        frame = framer.next_frame()
+                assert frames == [b"OK\r", b"3075\r", b"?5\r", b"25.5\r"]
+                assert len(framer) == 2
+                assert bytes(framer.take_partial()) == b"12"
+                assert framer.take_partial() is None
+
+        framer = ResponseFramer()
+        framer.feed(b"1.5\r")
+        assert bytes(framer.next_frame()) == b"1.5\r"
+        framer.feed(b"2")
+        framer.clear()
+        assert framer.next_frame() is None and len(framer) == 0
+
+        with self.assertRaises(ValueError):
+            ResponseFramer(size=0)
+
+    def test_parsers(self):
+        """Numbers and error codes should be parsed from bytes or memoryviews, with or without the terminator."""
+        assert parse_int(b"3075\r") == 3075
+        assert parse_int(memoryview(bytearray(b"-12\r"))) == -12
+        assert parse_float(memoryview(b"25.5\r")) == 25.5
+        assert parse_float(b"0.00002\r") == 0.00002
+        assert parse_float(b"1e-3\r") == 0.001
+        with self.assertRaises(ValueError):
+            parse_int(b"OK\r")
+        with self.assertRaises(ValueError):
+            parse_float(memoryview(b"?5\r"))
+
+        assert error_code(b"?5\r") == 5
+        assert error_code(memoryview(b"?8")) == 8
+        assert error_code(b"OK\r") == 0
+        assert error_code(b"?") == 0
+        assert error_code(None) == 0
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,12 @@
+import pickle
+import threading
+import time
 import unittest
 from unittest.mock import Mock
-from ujlaser.lasercontrol import Laser, LaserCommandError, LaserStatusResponse
+from ujlaser import lasercontrol
+from ujlaser.clock import VirtualClock
+from ujlaser.lasercontrol import Laser, LaserCommandError, LaserStatusResponse, KickerError
+from ujlaser.test import FakeSerialLaser as fake_serial
 
 class TestLaserCommands(unittest.TestCase):
 
@@ -45,6 +51,112 @@ class TestLaserCommands(unittest.TestCase):
         assert l._send_command("HELLO WORLD") == b"OK\r" # Ensure that we are returning the serial response
         serial_mock.write.assert_called_once_with(";LA:HELLO WORLD\r".encode("ascii")) # Ensure that the correct command format is being used
 
+    def test_event_reader(self):
+        """Tests the event driven response reader. It should return exactly one \\r terminated frame per command, holding on to any bytes that follow it."""
+        serial_mock = Mock(spec=["write", "read", "in_waiting", "timeout"])
+        serial_mock.timeout = 1
+        serial_mock.in_waiting = 7
+        serial_mock.read = Mock(return_value=b"OK\r1024\r")
+
+        l = Laser(readMode=Laser.EVENT_READER)
+        l._ser = serial_mock
+        l.connected = True
+
+        assert l._send_command("DT 1") == b"OK\r"
+        serial_mock.write.assert_called_once_with(";LA:DT 1\r".encode("ascii"))
+        serial_mock.read.assert_called_once_with(7)
+
+        serial_mock.in_waiting = 0
+        assert l._send_command("SS?") == b"1024\r" # served from the bytes left over by the last read
+
+        serial_mock.timeout = 0.01
+        assert l._send_command("SS?") is None # nothing arrives before the timeout
+
+        with self.assertRaises(ValueError):
+            Laser(readMode=5)
+
+    def test_pipelined_commands(self):
+        """Tests Laser._send_commands in pipelined mode. Every command should go out in a single write, with each reply (including errors) matched back to its own command."""
+        serial_mock = Mock()
+        serial_mock.read_until = Mock()
+        serial_mock.read_until.side_effect = [b"OK\r", b"?5\r", b"OK\r"]
+        serial_mock.write = Mock()
+
+        l = Laser(pipelined=True)
+        l._ser = serial_mock
+        l.connected = True
+
+        assert l._send_commands(["RR 1", "BC 0", "", "DT 0"]) == [b"OK\r", b"?5\r", None, b"OK\r"]
+        serial_mock.write.assert_called_once_with(";LA:RR 1\r;LA:BC 0\r;LA:DT 0\r".encode("ascii"))
+        assert serial_mock.read_until.call_count == 3
+
+        serial_mock.read_until.side_effect = [b"1.0\r", b"5.0\r"]
+        serial_mock.write = Mock()
+        assert l.get_repetition_rate_range() == (1.0, 5.0)
+        serial_mock.write.assert_called_once_with(";LA:RR:MIN?\r;LA:RR:MAX?\r".encode("ascii"))
+
+        assert l.get_repetition_rate_range() == (1.0, 5.0) # read once per connection
+        serial_mock.write.assert_called_once()
+
+        l._limits = {}
+        serial_mock.read_until.side_effect = [b"1.0\r", b"?7\r"]
+        with self.assertRaises(LaserCommandError):
+            l.get_repetition_rate_range()
+
+    def test_io_thread(self):
+        """Tests the dedicated I/O thread. Commands submitted from any thread should complete their futures with their own response, and disconnect should stop the thread."""
+        serial_mock = Mock()
+        serial_mock.read_until = Mock(return_value=b"OK\r")
+        serial_mock.write = Mock()
+
+        l = Laser(ioThread=True)
+        l._ser = serial_mock
+        l.connected = True
+
+        futures = [l.submit_command("DT " + str(i % 2)) for i in range(10)]
+        assert [f.result(timeout=1) for f in futures] == [b"OK\r"] * 10
+        assert l._io_thread.is_alive()
+        assert l.set_diode_trigger(1) # blocking calls are routed through the same thread
+        serial_mock.write.assert_called_with(";LA:DT 1\r".encode("ascii"))
+
+        io_thread = l._io_thread
+        l.disconnect()
+        assert not io_thread.is_alive()
+        assert l._io_thread is None
+        with self.assertRaises(ConnectionError):
+            l.submit_command("SS?")
+        with self.assertRaises(ConnectionError):
+            l._submit(["SS?"], True, None) # past submit_command's own check, the request is still refused
+
+        l.connected = True
+        l._ser = serial_mock
+        futures = []
+        def submit_until_refused(): # races disconnect(), may get past submit_command's check just before it
+            while True:
+                try:
+                    futures.append(l._submit(["SS?"], True, None))
+                except ConnectionError:
+                    return
+                futures[-1].exception() # one request at a time, so disconnect() doesn't wait on a long queue
+        others = set(threading.enumerate())
+        submitter = threading.Thread(target=submit_until_refused)
+        submitter.start()
+        while not futures:
+            time.sleep(0.001)
+        l.disconnect()
+        submitter.join()
+        assert l._io_thread is None
+        assert not any(t.name == "ujlaser-io" for t in set(threading.enumerate()) - others) # no thread was started after the disconnect
+        assert all(f.done() for f in futures)
+
+        l = Laser() # Without the I/O thread the command is sent right away
+        l._ser = Mock()
+        l._ser.read_until = Mock(return_value=b"1024\r")
+        l.connected = True
+        future = l.submit_command("SS?")
+        assert future.done() and future.result() == b"1024\r"
+        assert l._io_thread is None
+
     def test_arm_command(self):
         """Tests Laser.arm(), should return True because we are feeding it a nominal response, and this should result in serial.write being called with the correct command"""
         serial_mock = Mock()
@@ -92,6 +204,32 @@ class TestLaserCommands(unittest.TestCase):
         assert not s.electrical_over_temp
         assert not s.external_interlock
 
+    def test_status_value(self):
+        """A status should be an immutable int, interned by its status word, with every flag decoded from the word."""
+        s = LaserStatusResponse(b'3075\r')
+        assert s == 3075 and int(s) == 3075
+        assert LaserStatusResponse(b'3075\r') is s
+        assert LaserStatusResponse("3075") is s
+        assert LaserStatusResponse(3075) is s
+        assert LaserStatusResponse(bytearray(b'3075\r')) is s
+        assert LaserStatusResponse(b'1024\r') is not s
+        assert "Ready to fire: True" in str(s)
+        assert repr(s) == "LaserStatusResponse(3075)"
+        assert pickle.loads(pickle.dumps(s)) is s
+        assert LaserStatusResponse(b'0\r') == 0 and LaserStatusResponse(b'0\r') # no flags set is still a status, as opposed to None
+
+        with self.assertRaises(AttributeError):
+            s.laser_enabled = False
+        with self.assertRaises(AttributeError):
+            s.new_attribute = 1
+
+        flags = ["laser_enabled", "laser_active", None, "diode_external_trigger", None, None, "external_interlock", "resonator_over_temp",
+                 "electrical_over_temp", "power_failure", "ready_to_enable", "ready_to_fire", "low_power_mode", "high_power_mode"]
+        for bit, flag in enumerate(flags):
+            if flag is not None:
+                status = LaserStatusResponse(1 << bit)
+                assert [name for name in flags if name is not None and getattr(status, name)] == [flag]
+
     def test_get_status(self):
         """Tests to make sure that the get_status() function operates properly."""
         serial_mock = Mock()
@@ -126,6 +264,205 @@ class TestLaserCommands(unittest.TestCase):
         assert not status.electrical_over_temp
         assert not status.external_interlock
 
+    def test_status_cache(self):
+        """Tests the status cache. Repeated calls within statusMaxAge should share one SS? query, and state changing commands should invalidate it."""
+        serial_mock = Mock()
+        serial_mock.read_until = Mock(return_value=b"3075\r")
+        serial_mock.write = Mock()
+
+        l = Laser(statusMaxAge=60)
+        l._ser = serial_mock
+        l.connected = True
+
+        first = l.get_status()
+        assert l.get_status() is first
+        assert serial_mock.write.call_count == 1
+
+        l.get_status(max_age=0) # bypasses the cache
+        assert serial_mock.write.call_count == 2
+
+        serial_mock.read_until = Mock(return_value=b"OK\r")
+        l._send_command('FL 0')
+        serial_mock.read_until = Mock(return_value=b"3073\r")
+        assert not l.get_status().laser_active # FL invalidated the cached (active) status
+        assert serial_mock.write.call_count == 4
+
+        l._send_command('EN?') # queries leave the cache alone
+        l.get_status()
+        assert serial_mock.write.call_count == 5
+
+    def test_status_single_flight(self):
+        """Concurrent get_status() callers should share a single SS? query that is already on the wire."""
+        def slow_read(expected):
+            time.sleep(0.05)
+            return b"3075\r"
+
+        serial_mock = Mock()
+        serial_mock.read_until = Mock(side_effect=slow_read)
+        serial_mock.write = Mock()
+
+        l = Laser(statusMaxAge=0.01)
+        l._ser = serial_mock
+        l.connected = True
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(l.get_status())) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(results) == 8
+        assert all(int(status) == 3075 for status in results)
+        assert serial_mock.write.call_count == 1
+
+    def test_status_single_flight_interrupted(self):
+        """Callers sharing an SS? query should get an error, rather than wait forever, when the query is interrupted."""
+        class Interrupted(BaseException):
+            pass
+        reads = []
+        def interrupted_read(expected):
+            reads.append(expected)
+            if len(reads) == 1:
+                time.sleep(0.1) # long enough for the follower to join the query
+                raise Interrupted()
+            return b"3075\r"
+
+        serial_mock = Mock()
+        serial_mock.read_until = Mock(side_effect=interrupted_read)
+        serial_mock.write = Mock()
+
+        l = Laser(statusMaxAge=0.01)
+        l._ser = serial_mock
+        l.connected = True
+
+        errors = []
+        def follow():
+            time.sleep(0.02)
+            try:
+                l.get_status()
+            except LaserCommandError as e:
+                errors.append(e)
+        follower = threading.Thread(target=follow)
+        follower.start()
+        with self.assertRaises(Interrupted):
+            l.get_status()
+        follower.join(5)
+        assert not follower.is_alive() and len(errors) == 1
+        assert int(l.get_status()) == 3075 # a new query, not the interrupted one
+
+    def _armed_fake_laser(self):
+        """Returns a Laser connected to a FakeSerialLaser that has already been armed."""
+        l = Laser(readMode=Laser.EVENT_READER)
+        l._ser = fake_serial.Serial(timeout=1)
+        l._ser._enable, l._ser._LE, l._ser._RTF = 1, '1', '1' # skip the 8 second arming time
+        l.connected = True
+        return l
+
+    def test_fire_poll_schedule(self):
+        """fire_thread should poll sparsely far from the end of a shot, tighten up near it, and never sleep past it."""
+        l = Laser()
+        assert l._next_fire_poll(100) == Laser.FIRE_POLL_MAX
+        assert l._next_fire_poll(0.1) == 0.025
+        assert l._next_fire_poll(0.02) == Laser.FIRE_POLL_MIN
+        assert l._next_fire_poll(0.001) == 0.001
+
+    def test_fire_burst(self):
+        """A burst should be tracked to its end with a handful of polls, and the fire thread should then clean up after itself."""
+        l = self._armed_fake_laser()
+        l.set_pulse_mode(Laser.BURST)
+        l.set_rep_rate(5)
+        l.set_burst_count(2) # 0.4 seconds
+
+        start = time.monotonic()
+        l.fire_laser()
+        assert l.fireThread in l._threads
+        l.fireThread.join(timeout=2)
+        assert not l.fireThread.is_alive()
+        assert 0.35 < time.monotonic() - start < 1
+        assert 0 < l.fire_polls < 20
+        assert l._threads == []
+        assert not l.get_status().laser_active
+
+    def test_emergency_stop_during_fire(self):
+        """emergency_stop() should stop the laser and wake the fire thread right away, even in the middle of a long shot."""
+        l = self._armed_fake_laser()
+        l.set_pulse_mode(Laser.CONTINUOUS)
+        l.set_pulse_period(3)
+
+        l.fire_laser()
+        assert l.get_status().laser_active
+        start = time.monotonic()
+        assert l.emergency_stop()
+        l.fireThread.join(timeout=1)
+        assert not l.fireThread.is_alive()
+        assert time.monotonic() - start < 0.5
+        assert not l.get_status().laser_active
+
+    def test_kicker(self):
+        """The kicker should only send a keepalive SS? when the line has been quiet, and its status should land in the status cache."""
+        clock = VirtualClock(idle=.005)
+        serial_mock = Mock()
+        serial_mock.read_until = Mock(return_value=b"3075\r")
+        written = []
+        serial_mock.write = Mock(side_effect=lambda data: written.append(clock.monotonic()))
+
+        l = Laser(keepaliveInterval=0.05, statusMaxAge=60, clock=clock)
+        l._ser = serial_mock
+        l.connected = True
+
+        assert l._kicker_thread_control(0)
+        with self.assertRaises(KickerError):
+            l._kicker_thread_control(0) # already running
+        with self.assertRaises(KickerError):
+            l._kicker_thread_control(2)
+
+        clock.sleep(0.21)
+        keepalives = serial_mock.write.call_count
+        assert 4 <= keepalives <= 8 # the job runs every 25 ms, and only sends when nothing went out for the last 25 ms
+        assert written[0] <= 0.05 and all(b - a <= 0.05 for a, b in zip(written, written[1:])) # never quiet for a whole interval
+        serial_mock.write.assert_called_with(";LA:SS?\r".encode("ascii"))
+        assert int(l.get_status()) == 3075 # served from the kicker's status
+        assert serial_mock.write.call_count == keepalives
+
+        serial_mock.write.reset_mock()
+        for _ in range(10): # steady traffic (every 15 ms with the sleep reader), the kicker should stay quiet
+            l._send_command("EN?")
+            clock.sleep(0.005)
+        assert serial_mock.write.call_count == 10
+
+        kicker = l._kicker_job
+        assert l._kicker_thread_control(1)
+        assert kicker.cancelled
+        serial_mock.write.reset_mock()
+        clock.sleep(0.1)
+        assert serial_mock.write.call_count == 0
+
+    def test_kicker_per_laser(self):
+        """Every laser should keep its own link alive, a keepalive stuck on a dead port shouldn't hold up another laser's keepalives."""
+        clock = VirtualClock(idle=.005)
+        released = threading.Event()
+        dead, alive = Mock(), Mock()
+        dead.read_until = Mock(side_effect=lambda *args, **kwargs: (clock.wait(released), b"")[1]) # never answers until released
+        alive.read_until = Mock(return_value=b"1024\r")
+        lasers = []
+        for ser in (dead, alive):
+            l = Laser(keepaliveInterval=0.5, clock=clock)
+            l._ser = ser
+            l.connected = True
+            l._kicker_thread_control(0)
+            lasers.append(l)
+        assert lasers[0]._scheduler is not lasers[1]._scheduler
+
+        clock.sleep(5)
+        assert dead.write.call_count == 1 # stuck in its first keepalive
+        assert alive.write.call_count >= 15
+        released.set()
+        for l in lasers:
+            scheduler = l._scheduler
+            l._kicker_thread_control(1)
+            assert l._scheduler is None and scheduler._thread is None # the kicker's own thread is gone
+
     def test_diode_trigger_command(self):
         """Tests Laser.set_diode_trigger, feeds in a mock serial object. Makes sure that the correct data is written and that the properties of the class are changed."""
         serial_mock = Mock()
@@ -156,6 +493,38 @@ class TestLaserCommands(unittest.TestCase):
         serial_mock.write.assert_called_once_with(";LA:DT 0\r".encode("ascii"))
         assert l.diodeTrigger == 1 # This value should have NOT changed since this command failed.
 
+    def test_queries(self):
+        """Getters should parse their replies, and raise a LaserCommandError with the right description for error replies."""
+        serial_mock = Mock()
+        serial_mock.write = Mock()
+        l = Laser()
+        l._ser = serial_mock
+        l.connected = True
+
+        serial_mock.read_until = Mock(return_value=b"25.5\r")
+        assert l.get_fet_temp() == 25.5
+        serial_mock.read_until = Mock(return_value=b"123456\r")
+        assert l.get_system_shot_count() == 123456
+        serial_mock.read_until = Mock(return_value=b"QC,MicroJewel,00101,1.0-0.0.0.8\r")
+        assert l.get_laser_ID() == "QC,MicroJewel,00101,1.0-0.0.0.8"
+        serial_mock.read_until = Mock(return_value=b"1\r")
+        assert l.is_armed()
+        serial_mock.read_until = Mock(return_value=b"0\r")
+        assert not l.is_armed()
+
+        for getter in (l.get_fet_temp, l.get_bank_voltage, l.get_laser_ID, l.get_system_shot_count, l.is_armed):
+            serial_mock.read_until = Mock(return_value=b"?7\r")
+            with self.assertRaisesRegex(LaserCommandError, "Invalid query"):
+                getter()
+        serial_mock.read_until = Mock(return_value=b"")
+        with self.assertRaises(LaserCommandError): # timed out
+            l.get_fet_temp()
+
+        assert Laser.get_error_code_description(b"?5\r") == "Invalid Parameter"
+        assert Laser.get_error_code_description(b"?1") == "Command not recognized."
+        assert Laser.get_error_code_description("?8") == "Command unavailable in current system state."
+        assert Laser.get_error_code_description(b"?9\r").startswith("Error description not found")
+
     def test_get_pulse_period_range(self):
         """Tests Laser.get_pulse_period_range"""
         serial_mock = Mock()
@@ -337,6 +706,127 @@ class TestLaserCommands(unittest.TestCase):
         assert l.diodeCurrent == 100 # This value should have NOT changed since this command failed.
         assert l.energyMode == 2 # This also should not have changed because the command failed.
 
+    def test_limits(self):
+        """connect should read the laser's limits once per connection, give up after one timeout on a dead link, and the setters should check values against them locally."""
+        writes = []
+        def recording_fake():
+            ser = fake_serial.Serial()
+            def recording_write(data):
+                writes.append(data)
+                return fake_serial.Serial.write(ser, data)
+            ser.write = recording_write
+            return ser
+
+        ser = recording_fake()
+        ser._pulsePeriodMAX = 2.5
+        l = Laser(keepaliveInterval=0)
+        l.connect(ser)
+        assert len(writes) == 1 and writes[0].startswith(b";LA:ID?\r") # ID? and every :MIN? and :MAX? in one write
+        limits = l.get_limits()
+        assert set(limits) == set(Laser.LIMITS)
+        assert limits["PE"] == (0.0, 2.5)
+        assert limits["RR"] == (1.0, 5.0)
+        assert limits["FT"][0] is None # the fake laser has no FT:MIN
+        assert l.get_pulse_period_range() == (0.0, 2.5)
+        assert len(writes) == 1
+
+        with self.assertRaises(ValueError): # rejected without asking the laser
+            l.set_pulse_period(2.6)
+        with self.assertRaises(ValueError):
+            with l.settings() as s:
+                s.pulsePeriod = 3
+        assert len(writes) == 1
+        assert l.set_pulse_period(2.5)
+        l.disconnect()
+
+        del writes[:]
+        l2 = Laser(keepaliveInterval=0)
+        l2.connect(recording_fake()) # another unit with the same ID has its own limits
+        assert len(writes) == 1
+        assert l2.get_limits()["PE"] == (0.0, 3.0)
+        l2._ser._pulsePeriodMAX = 2.0
+        assert l2.get_limits()["PE"] == (0.0, 3.0)
+        assert l2.get_limits(refresh=True)["PE"] == (0.0, 2.0)
+        l2.disconnect()
+
+        silent = Mock()
+        silent.read_until.return_value = b"" # every read times out
+        l3 = Laser(keepaliveInterval=0)
+        l3.connect(silent)
+        assert silent.read_until.call_count == 1 # gave up after ID?, rather than waiting for all 13 replies
+        assert l3._limits == {}
+        l3.disconnect()
+
+    def test_resync_after_timeout(self):
+        """A reply that arrives after its command timed out shouldn't be taken for the reply to the next command."""
+        for mode in (Laser.SLEEP_READER, Laser.EVENT_READER):
+            with self.subTest(readMode=mode):
+                ser = fake_serial.Serial(verbose=False)
+                l = Laser(readMode=mode, keepaliveInterval=0)
+                l.connect(ser)
+                assert l.set_burst_count(20)
+
+                held = []
+                def late_write(data):
+                    if data.endswith(b"BC?\r") and not held:
+                        held.append(data) # answered only once something else is written
+                        return len(data)
+                    if held and held[0] is not None:
+                        fake_serial.Serial.write(ser, held[0])
+                        held[0] = None
+                    return fake_serial.Serial.write(ser, data)
+                ser.write = late_write
+
+                assert not l._send_command("BC?")
+                assert l.get_system_shot_count() == 0 # not the late 20
+                assert l._send_command("BC?") == b"20\r"
+                l.disconnect()
+
+    def test_settings_transaction(self):
+        """update_settings should only send changed settings, and settings() should send a batch in one write and commit it only if every reply is OK."""
+        l = Laser(readMode=Laser.EVENT_READER)
+        l._ser = fake_serial.Serial(timeout=1)
+        l.connected = True
+        writes = []
+        write = l._ser.write
+        def recording_write(data):
+            writes.append(data)
+            return write(data)
+        l._ser.write = recording_write
+
+        assert l.update_settings() == [b"OK\r"] * 7 # nothing is known about a new connection
+        assert b";LA:DT 0\r" in writes
+        assert l.update_settings() == []
+        l.repRate = 2
+        assert l.update_settings() == [b"OK\r"]
+        assert writes[-1] == b";LA:RR 2\r"
+
+        del writes[:]
+        with l.settings() as s:
+            s.repRate = 4
+            s.burstCount = 10 # unchanged, not sent
+            s.pulseWidth = 20
+            assert s.repRate == 4 and l.repRate == 2
+        assert s.sent == ["RR 4", "DW 20.0"]
+        assert writes == [b";LA:RR 4\r;LA:DW 20.0\r"]
+        assert l.repRate == 4 and l.pulseWidth == 20.0 and l.burstDuration == 2.5
+
+        with self.assertRaises(ValueError):
+            with l.settings() as s:
+                s.repRate = 50
+        with self.assertRaises(AttributeError):
+            with l.settings() as s:
+                s.notASetting = 1
+
+        del writes[:]
+        with self.assertRaises(LaserCommandError): # 50 is outside of the fake laser's pulse period range
+            with l.settings() as s:
+                s.burstCount = 20
+                s.pulsePeriod = 50
+        assert len(writes) == 1
+        assert l.burstCount == 10 and l.pulsePeriod == 0 # nothing is committed
+        assert l.update_settings() == [b"OK\r"] # BC may have been applied, so it is sent again
+
 
 if __name__ == "__main__":
     unittest.main()
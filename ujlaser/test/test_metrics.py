@@ -0,0 +1,58 @@
+import json
+import unittest
+from unittest.mock import Mock
+from ujlaser.lasercontrol import Laser
+from ujlaser.metrics import Histogram
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        """Observations should land in the first bucket whose bound they don't exceed, with larger ones in the overflow bucket."""
+        h = Histogram(buckets=(.001, .01, .1))
+        assert h.quantile(.5) is None
+        for value in (.0005, .001, .005, .05, 2):
+            h.observe(value)
+        assert h.counts == [2, 1, 1, 1]
+        assert h.count == 5 and h.max == 2
+        assert h.quantile(.4) == .001
+        assert h.quantile(1) == 2
+        snapshot = h.snapshot()
+        assert snapshot["counts"] == [2, 1, 1, 1]
+        assert abs(snapshot["sum_s"] - 2.0565) < 1e-9
+
+    def test_laser_metrics(self):
+        """A Laser with metrics should count latency per command keyword, lock use, bytes and error codes, and return them in a snapshot."""
+        serial_mock = Mock()
+        serial_mock.read_until = Mock()
+        serial_mock.write = Mock()
+
+        l = Laser(pipelined=True, metrics=True)
+        l._ser = serial_mock
+        l.connected = True
+
+        serial_mock.read_until.side_effect = [b"OK\r", b"?5\r", b"?5\r", b"3075\r", b""]
+        l._send_commands(["RR 1", "BC 0", "DT 3"])
+        l._send_command("SS?")
+        l._send_command("FT?") # times out
+
+        snapshot = l.get_metrics()
+        assert sorted(snapshot["commands"]) == ["BC", "DT", "FT", "RR", "SS"]
+        assert all(c["count"] == 1 for c in snapshot["commands"].values())
+        assert snapshot["lock_wait"]["count"] == 3
+        assert snapshot["lock_hold"]["count"] == 3
+        assert snapshot["bytes_written"] == len(";LA:RR 1\r;LA:BC 0\r;LA:DT 3\r;LA:SS?\r;LA:FT?\r")
+        assert snapshot["bytes_read"] == len("OK\r?5\r?5\r3075\r")
+        assert snapshot["errors"] == {1: 0, 2: 0, 3: 0, 4: 0, 5: 2, 6: 0, 7: 0, 8: 0}
+        assert snapshot["timeouts"] == 1
+        assert snapshot["fire_polls"] == 0
+        json.dumps(snapshot) # plain values only
+
+        l.metrics.reset()
+        assert l.get_metrics()["commands"] == {}
+
+        l = Laser() # disabled by default
+        assert l.metrics is None and l.get_metrics() is None
+
+
+if __name__ == "__main__":
+    unittest.main()
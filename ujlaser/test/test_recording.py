@@ -0,0 +1,100 @@
+import os
+import tempfile
+import time
+import unittest
+from ujlaser.clock import VirtualClock
+from ujlaser.lasercontrol import Laser
+from ujlaser.recording import READ, SESSION, WRITE, Record, RecordingSerial, ReplayMismatchError, ReplaySerial, read_records, record
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestRecording(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".ujlr")
+        os.close(handle)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def session(self, l):
+        return [str(l.get_status()), l.get_fet_temp(), l.set_burst_count(7), l._send_command('BC?')]
+
+    def test_record_and_replay(self):
+        """A replayed session should give a Laser the recorded replies, with or without the recorded timing, for both readers."""
+        for mode in (Laser.SLEEP_READER, Laser.EVENT_READER):
+            with self.subTest(readMode=mode):
+                l = Laser(readMode=mode)
+                l.connect(RecordingSerial(fake_serial.Serial(verbose=False), self.path))
+                recorded = self.session(l)
+                l.disconnect()
+
+                records = read_records(self.path)
+                assert records[-1].kind == READ and records[-2] == Record(WRITE, records[-2].time_ns, b";LA:BC?\r")
+                assert all(a.time_ns <= b.time_ns for a, b in zip(records, records[1:]))
+
+                for realtime in (True, False):
+                    l = Laser(readMode=mode)
+                    l.connect(ReplaySerial(self.path, realtime=realtime))
+                    assert self.session(l) == recorded
+                    assert l._ser.remaining == 0
+                    with self.assertRaises(ReplayMismatchError):
+                        l._send_command('SS?') # past the end of the recording
+                    l.disconnect()
+
+                os.remove(self.path)
+
+    def test_replay_without_keepalives(self):
+        """Quiet spells longer than the keepalive interval shouldn't put keepalives into a recording or its replay."""
+        clock = VirtualClock(idle=.005)
+        l = Laser(readMode=Laser.EVENT_READER, keepaliveInterval=0.5, clock=clock)
+        l.connect(RecordingSerial(fake_serial.Serial(timeout=1, verbose=False, clock=clock), self.path))
+        assert not l._kicker_active
+        recorded = self.session(l)
+        clock.sleep(3)
+        recorded += self.session(l)
+        l.disconnect()
+
+        l = Laser(readMode=Laser.EVENT_READER, keepaliveInterval=0.5, clock=clock)
+        l.connect(ReplaySerial(self.path, realtime=False, clock=clock))
+        assert not l._kicker_active
+        replayed = self.session(l)
+        clock.sleep(3)
+        assert replayed + self.session(l) == recorded
+        assert l._ser.remaining == 0
+        l.disconnect()
+
+        l = Laser(readMode=Laser.EVENT_READER, keepaliveInterval=0.5, clock=clock)
+        l.connect(fake_serial.Serial(timeout=1, verbose=False, clock=clock))
+        assert l._kicker_active
+        record(l, self.path)
+        assert not l._kicker_active
+        l.disconnect()
+
+    def test_replay_timing(self):
+        """Replies should arrive as long after the write as recorded, or at once, and a truncated last record should be ignored."""
+        with open(self.path, "wb") as f:
+            f.write(b"UJLR\x01\x00\x00\x00")
+            for kind, time_ns, data in ((SESSION, 0, bytes(8)), (WRITE, 10**9, b";LA:SS?\r"), (READ, 10**9 + 50 * 10**6, b"1024\r")):
+                f.write(bytes([kind]) + time_ns.to_bytes(8, "little") + len(data).to_bytes(4, "little") + data)
+            f.write(bytes([WRITE]) + bytes(8) + (100).to_bytes(4, "little") + b";LA:") # cut short
+        assert len(read_records(self.path)) == 3
+
+        ser = ReplaySerial(self.path, timeout=1)
+        start = time.perf_counter()
+        ser.write(b";LA:SS?\r")
+        assert ser.in_waiting == 0
+        assert ser.read_until(b"\r") == b"1024\r"
+        assert time.perf_counter() - start >= .05
+
+        ser = ReplaySerial(self.path, realtime=False, timeout=1)
+        with self.assertRaises(ReplayMismatchError):
+            ser.write(b";LA:BC?\r")
+        ser = ReplaySerial(self.path, realtime=False, timeout=1)
+        ser.write(b";LA:SS?\r")
+        assert ser.read(10) == b"1024\r" # nothing more is coming, so the read returns without waiting for its timeout
+
+
+if __name__ == "__main__":
+    unittest.main()
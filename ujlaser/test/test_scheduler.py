@@ -0,0 +1,100 @@
+import threading
+import unittest
+from ujlaser.clock import VirtualClock
+from ujlaser.scheduler import PeriodicScheduler
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock(idle=.005)
+        self.scheduler = PeriodicScheduler(clock=self.clock)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_jobs_share_one_thread(self):
+        """Every job should run on the same worker thread, at its own rate."""
+        clock = self.clock
+        threads = set()
+        fast, slow = [], []
+        self.scheduler.schedule(0.01, lambda: (threads.add(threading.get_ident()), fast.append(clock.monotonic())))
+        self.scheduler.schedule(0.05, lambda: (threads.add(threading.get_ident()), slow.append(clock.monotonic())))
+        clock.sleep(0.255)
+        self.scheduler.stop()
+
+        assert len(threads) == 1 and threading.get_ident() not in threads
+        assert len(fast) == 25
+        assert len(slow) == 5
+
+    def test_stop_from_job(self):
+        """stop() called from a job should cancel every job and report that the worker thread is still running."""
+        results, workers = [], []
+        def stopping_job():
+            workers.append(threading.current_thread())
+            results.append(self.scheduler.stop())
+        self.scheduler.schedule(0.01, stopping_job)
+        other = self.scheduler.schedule(0.01, list)
+        self.clock.sleep(0.05)
+        assert results == [False] and other.cancelled and len(self.scheduler) == 0
+        workers[0].join(5)
+        assert not workers[0].is_alive()
+
+    def test_no_drift(self):
+        """A job that takes a while to run should still run on its original grid of deadlines."""
+        clock = VirtualClock(idle=.005)
+        scheduler = PeriodicScheduler(clock=clock)
+        start = clock.monotonic()
+        runs = []
+        def slow_job():
+            runs.append(clock.monotonic())
+            clock.sleep(0.01)
+        scheduler.schedule(0.02, slow_job, start=start)
+        clock.sleep(0.205)
+        scheduler.stop()
+
+        assert [round(run - start, 6) for run in runs] == [round(0.02 * i, 6) for i in range(11)] # 0, 0.02, ... 0.2, the time the job takes never shifts the grid
+
+    def test_overrun(self):
+        """SKIP should drop the deadlines missed by an overrunning job, CATCH_UP should run them back to back."""
+        clock = self.clock
+        start = clock.monotonic()
+        skip = self.scheduler.schedule(0.01, clock.sleep, 0.035, overrun=PeriodicScheduler.SKIP, start=start)
+        clock.sleep(0.195)
+        self.scheduler.stop()
+        assert skip.runs == 5 and skip.skipped == 15 # runs at 0, 0.04, 0.08, 0.12 and 0.16, the three deadlines each run overlaps are dropped
+
+        catch_up_runs = []
+        start = clock.monotonic()
+        def catch_up_job():
+            catch_up_runs.append(clock.monotonic())
+            if len(catch_up_runs) == 1:
+                clock.sleep(0.05)
+        job = self.scheduler.schedule(0.01, catch_up_job, overrun=PeriodicScheduler.CATCH_UP, start=start)
+        clock.sleep(0.095)
+        self.scheduler.stop()
+        assert job.skipped == 0
+        assert round(catch_up_runs[1] - start, 6) == round(catch_up_runs[5] - start, 6) == 0.05 # missed deadlines run back to back
+        assert len(catch_up_runs) == 10
+
+        with self.assertRaises(ValueError):
+            self.scheduler.schedule(0.01, print, overrun="sometimes")
+
+    def test_cancel_and_errors(self):
+        """Cancelled jobs should stop running, and a job that raises should keep running and count its errors."""
+        def failing():
+            raise RuntimeError("no laser")
+        bad = self.scheduler.schedule(0.01, failing)
+        good = self.scheduler.schedule(0.01, lambda: None)
+        self.clock.sleep(0.055)
+        good.cancel()
+        runs = good.runs
+        self.clock.sleep(0.03)
+
+        assert good.runs == runs == 5
+        assert bad.errors == bad.runs == 8
+        assert isinstance(bad.last_error, RuntimeError)
+        assert len(self.scheduler) == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
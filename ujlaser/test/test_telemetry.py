@@ -0,0 +1,62 @@
+import unittest
+from ujlaser.clock import VirtualClock
+from ujlaser.lasercontrol import Laser
+from ujlaser.telemetry import RingBuffer, TelemetrySampler
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        """The ring buffer should return the latest samples in order, even after wrapping around."""
+        r = RingBuffer(4)
+        assert len(r) == 0
+        assert r.last() is None
+        assert r.latest()[0].tolist() == []
+
+        for i in range(6):
+            r.append(float(i), i * 10.0)
+
+        assert len(r) == 4
+        times, values = r.latest()
+        assert times.tolist() == [2.0, 3.0, 4.0, 5.0]
+        assert values.tolist() == [20.0, 30.0, 40.0, 50.0]
+        assert r.latest(2)[1].tolist() == [40.0, 50.0]
+        assert r.last() == (5.0, 50.0)
+
+        with self.assertRaises(ValueError):
+            RingBuffer(0)
+
+    def test_sampler(self):
+        """The sampler should poll each channel at its own rate on the laser's clock, reading the channels due together in one write."""
+        clock = VirtualClock(idle=.005)
+        laser = Laser(readMode=Laser.EVENT_READER, keepaliveInterval=0, clock=clock)
+        laser.connect(fake_serial.Serial(timeout=1, verbose=False, clock=clock))
+        laser._ser._thermistorTemp = 25.5
+        laser._ser._QUERIES = dict(laser._ser._QUERIES, BV=None) # BV? answers with ?7
+        writes = []
+        write = laser._ser.write
+        laser._ser.write = lambda data: (writes.append(data), write(data))[1]
+
+        sampler = TelemetrySampler(laser, rates={"status": 10, "resonator_temp": 2, "bank_voltage": 2}, history=64)
+        start = clock.monotonic()
+        sampler.start()
+        clock.sleep(2.05)
+        sampler.stop()
+        laser.disconnect()
+
+        times, values = sampler.latest("status")
+        assert len(values) == 21
+        assert set(values.tolist()) == {1024}
+        assert [round(t - start, 6) for t in times] == [round(0.1 * i, 6) for i in range(21)]
+        assert len(writes) == 21 # one batch per tick
+        assert writes[0] == b";LA:SS?\r;LA:TR?\r;LA:BV?\r" and writes[1] == b";LA:SS?\r"
+        assert list(sampler.latest("resonator_temp")[0]) == list(times[::5])
+        assert sampler.last("resonator_temp")[1] == 25.5
+        assert sampler.last("bank_voltage") is None
+        assert sampler.errors["bank_voltage"] == 5
+
+        with self.assertRaises(ValueError):
+            TelemetrySampler(laser, rates={"not_a_channel": 1})
+
+if __name__ == "__main__":
+    unittest.main()
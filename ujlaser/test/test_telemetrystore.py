@@ -0,0 +1,80 @@
+import math
+import os
+import tempfile
+import unittest
+from ujlaser import telemetrystore
+from ujlaser.lasercontrol import Laser
+from ujlaser.telemetrystore import MISSING_STATUS, TelemetryStore
+from ujlaser.test import FakeSerialLaser as fake_serial
+
+class TestTelemetryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "laser")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_append_and_read(self):
+        """Records should roll over into new segments, and time range reads should span them, oldest first."""
+        with TelemetryStore(self.path, segment_size=64 + 64 * 100) as store: # 100 records per segment
+            for i in range(250):
+                store.append(1000 + i, status=i, fet_temp=i / 2, shot_count=i)
+            assert len(store) == 250
+            assert len([name for name in os.listdir(self.path) if name.endswith(".ujlt")]) == 3
+
+            records = list(store.records(1095, 1105))
+            assert [r.time for r in records] == list(range(1095, 1105))
+            assert records[0].status == 95 and records[0].fet_temp == 47.5 and math.isnan(records[0].bank_voltage)
+            assert list(store.records(2000)) == []
+
+            with self.assertRaises(ValueError):
+                store.append(999) # before the last record
+
+            store.append(2000)
+            assert list(store.records(2000))[0].status == MISSING_STATUS
+
+        with TelemetryStore(self.path) as store: # reopening carries on from the existing segments
+            assert len(store) == 251
+            store.append(3000)
+            assert len(list(store.records(1249))) == 3
+
+    @unittest.skipIf(telemetrystore.numpy is None, "NumPy is not installed")
+    def test_numpy_views(self):
+        """Reads within a segment should be zero-copy views of the file, and a read only store should see records added since."""
+        numpy = telemetrystore.numpy
+        with TelemetryStore(self.path, segment_size=64 + 64 * 100) as store:
+            for i in range(150):
+                store.append(1000 + i, fet_temp=i)
+            view = store.read(1010, 1020)
+            assert list(view["fet_temp"]) == list(range(10, 20))
+            assert not view.flags.writeable and not view.flags.owndata
+            assert [len(v) for v in store.views(1050, 1150)] == [50, 50]
+            assert list(store.read(1090, 1110)["time"]) == list(range(1090, 1110))
+            assert len(store.read(5000)) == 0
+
+            reader = TelemetryStore(self.path, readonly=True)
+            assert len(reader.read()) == 150
+            store.append(1200, fet_temp=-1)
+            assert reader.read(1200)["fet_temp"][0] == -1
+            del view
+            reader.close()
+
+    def test_sample(self):
+        """sample() should store one record from a laser's replies, with the replies it couldn't read as missing."""
+        l = Laser()
+        l.connect(fake_serial.Serial(verbose=False))
+        l._ser._thermistorTemp = 31.5
+        with TelemetryStore(self.path) as store:
+            store.sample(l)
+            l._ser._QUERIES = dict(l._ser._QUERIES, BV=None) # BV? now answers with ?7
+            store.sample(l)
+            first, second = store.records()
+        l.disconnect()
+        assert first.status == 1024 and first.resonator_temp == 31.5 and first.shot_count == 0 and first.bank_voltage == 0
+        assert second.time >= first.time and math.isnan(second.bank_voltage)
+
+
+if __name__ == "__main__":
+    unittest.main()